@@ -76,27 +76,42 @@ const AnalyticsDashboard = ({ topic }) => {
   }
 
   // --- Process data for charts ---
+  const sCurve = analyticsData.s_curve || [];
+  const sCurveForecast = analyticsData.s_curve_forecast?.forecast || [];
   const sCurveChartData = {
-    labels: analyticsData.mock_s_curve?.map(d => d.year) || [],
-    datasets: [{
-      label: 'Cumulative Publications (S-Curve)',
-      data: analyticsData.mock_s_curve?.map(d => d.cumulative_count) || [],
-      borderColor: '#4a9eff',
-      backgroundColor: 'rgba(74, 158, 255, 0.2)',
-      fill: true,
-      tension: 0.4
-    }]
+    labels: [...sCurve.map(d => d.year), ...sCurveForecast.map(d => d.year)],
+    datasets: [
+      {
+        label: 'Cumulative Publications (S-Curve)',
+        data: sCurve.map(d => d.cumulative_count),
+        borderColor: '#4a9eff',
+        backgroundColor: 'rgba(74, 158, 255, 0.2)',
+        fill: true,
+        tension: 0.4
+      },
+      {
+        label: 'Logistic Fit & Forecast',
+        data: [
+          ...sCurve.map(d => d.fitted_cumulative ?? null),
+          ...sCurveForecast.map(d => d.cumulative_count)
+        ],
+        borderColor: '#ffc107',
+        borderDash: [5, 5],
+        fill: false,
+        tension: 0.4
+      }
+    ]
   };
 
   const trlProgressionData = {
     labels: [
-      ...(analyticsData.mock_trl_progression?.history.map(d => d.year) || []),
-      ...(analyticsData.mock_trl_progression?.forecast.map(d => d.year) || [])
+      ...(analyticsData.trl_progression?.history.map(d => d.year) || []),
+      ...(analyticsData.trl_progression?.forecast.map(d => d.year) || [])
     ],
     datasets: [
       {
         label: 'Historical Avg. TRL',
-        data: analyticsData.mock_trl_progression?.history.map(d => d.avg_trl) || [],
+        data: analyticsData.trl_progression?.history.map(d => d.avg_trl) || [],
         borderColor: '#198754',
         fill: false,
         tension: 0.1
@@ -105,8 +120,8 @@ const AnalyticsDashboard = ({ topic }) => {
         label: 'Forecasted Avg. TRL',
         data: [
           // Add nulls to create a gap for the historical data
-          ...(analyticsData.mock_trl_progression?.history.map(() => null) || []),
-          ...(analyticsData.mock_trl_progression?.forecast.map(d => d.avg_trl) || [])
+          ...(analyticsData.trl_progression?.history.map(() => null) || []),
+          ...(analyticsData.trl_progression?.forecast.map(d => d.avg_trl) || [])
         ],
         borderColor: '#ffc107',
         borderDash: [5, 5],
@@ -145,13 +160,13 @@ const AnalyticsDashboard = ({ topic }) => {
         <div className="card chart-card">
           <h3>S-Curve (Adoption Rate)</h3>
           <div className="chart-wrapper">
-            {analyticsData.mock_s_curve ? <Line options={chartOptions} data={sCurveChartData} /> : <p>No S-Curve data generated.</p>}
+            {sCurve.length > 0 ? <Line options={chartOptions} data={sCurveChartData} /> : <p>No S-Curve data generated.</p>}
           </div>
         </div>
         <div className="card chart-card">
           <h3>TRL Progression & Forecast</h3>
           <div className="chart-wrapper">
-            {analyticsData.mock_trl_progression ? <Line options={chartOptions} data={trlProgressionData} /> : <p>No TRL data generated.</p>}
+            {analyticsData.trl_progression?.history.length > 0 ? <Line options={chartOptions} data={trlProgressionData} /> : <p>No TRL data generated.</p>}
           </div>
         </div>
       </div>
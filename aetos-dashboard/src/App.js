@@ -42,14 +42,40 @@ function App() {
       const payload = await resp.json();
       setStatus(`Server response: ${payload?.status || resp.statusText}`);
 
-      if (resp.ok) {
-        await fetchDocuments(currentTopic);
-        setAnalyzedTopic(currentTopic); // --- ADDED: Set topic to show analytics
+      if (!resp.ok || !payload?.events_url) {
+        setIsLoading(false);
+        return;
       }
 
+      // The analysis runs as a background job; follow its progress until it finishes
+      const events = new EventSource(`http://127.0.0.1:5000${payload.events_url}`);
+      events.addEventListener('progress', (event) => {
+        const job = JSON.parse(event.data);
+        const stats = job.progress?.stats;
+        setStatus(stats
+          ? `Analyzing "${currentTopic}" (${job.progress.stage}): fetched ${stats.fetched}, candidates ${stats.candidates}, analyzed ${stats.analyzed}, saved ${stats.saved}`
+          : `Analysis job for "${currentTopic}" is ${job.state.toLowerCase()}...`);
+      });
+      events.addEventListener('done', async (event) => {
+        events.close();
+        const job = JSON.parse(event.data);
+        if (job.state === 'SUCCESS') {
+          setStatus(job.result?.message || 'Analysis complete');
+          await fetchDocuments(currentTopic);
+          setAnalyzedTopic(currentTopic); // --- ADDED: Set topic to show analytics
+        } else {
+          setStatus(`Analysis failed: ${job.error || job.state}`);
+        }
+        setIsLoading(false);
+      });
+      events.onerror = () => {
+        events.close();
+        setStatus("Lost connection to the analysis job. Refresh to check on it later.");
+        setIsLoading(false);
+      };
+
     } catch (error) {
       setStatus("Error: Could not start analysis. Is the API server running?");
-    } finally {
       setIsLoading(false);
     }
   };
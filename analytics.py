@@ -1,72 +1,247 @@
 # analytics.py
 import pandas as pd
 import numpy as np
-import networkx as nx
-from itertools import combinations
+from scipy import sparse
+from scipy.sparse.linalg import eigsh
+from scipy.optimize import curve_fit
 from sklearn.linear_model import LinearRegression
+from search import build_topic_query
 
-def calculate_s_curve(df: pd.DataFrame) -> list:
-    """Calculates the S-curve data from a dataframe of documents."""
-    df['published_date'] = pd.to_datetime(df['published'], errors='coerce')
-    df.dropna(subset=['published_date'], inplace=True)
-    if df.empty:
+FORECAST_YEARS = 3
+
+# Year of `published`: dates stringify as ISO timestamps, so both dates and 'YYYY-MM-DD' strings start with it.
+# The prefix is grouped as a string and converted in Python; $substr (an alias of $substrBytes) also runs on mongomock.
+_YEAR_EXPRESSION = {'$substr': [{'$toString': '$published'}, 0, 4]}
+
+def yearly_topic_aggregates(db, topic: str, mode: str = "text") -> pd.DataFrame:
+    """
+    Per-year document counts and TRL sums for a topic, grouped inside MongoDB.
+    Only one row per year crosses the wire, however many documents match.
+    """
+    pipeline = [
+        {'$match': build_topic_query(topic, mode)},
+        {'$project': {'_id': 0, 'year': _YEAR_EXPRESSION, 'TRL': 1}},
+        {'$group': {
+            '_id': '$year',
+            'count': {'$sum': 1},
+            'trl_sum': {'$sum': {'$cond': [{'$gt': ['$TRL', 0]}, '$TRL', 0]}},
+            'trl_count': {'$sum': {'$cond': [{'$gt': ['$TRL', 0]}, 1, 0]}},
+        }},
+    ]
+    # Missing or malformed dates leave prefixes such as '' or 'n/a', which are dropped here
+    rows = [{**row, '_id': int(row['_id'])} for row in db.documents.aggregate(pipeline)
+            if isinstance(row['_id'], str) and len(row['_id']) == 4 and row['_id'].isdigit()]
+    yearly = pd.DataFrame(rows, columns=['_id', 'count', 'trl_sum', 'trl_count'])
+    return yearly.rename(columns={'_id': 'year'}).set_index('year').sort_index()
+
+def yearly_aggregates(df: pd.DataFrame) -> pd.DataFrame:
+    """The same per-year aggregates as yearly_topic_aggregates, from an in-memory DataFrame."""
+    columns = ['count', 'trl_sum', 'trl_count']
+    if df.empty or 'published' not in df.columns:
+        return pd.DataFrame(columns=columns)
+    years = pd.to_datetime(df['published'], errors='coerce').dt.year
+    trl = pd.to_numeric(df['TRL'], errors='coerce') if 'TRL' in df.columns else pd.Series(np.nan, index=df.index)
+    rated = trl > 0
+    frame = pd.DataFrame({'year': years, 'count': 1, 'trl_sum': trl.where(rated, 0), 'trl_count': rated.astype(int)})
+    yearly = frame.dropna(subset=['year']).groupby('year')[columns].sum().sort_index()
+    yearly.index = yearly.index.astype(int)
+    return yearly
+
+def _logistic(years, capacity, growth_rate, midpoint):
+    return capacity / (1 + np.exp(-growth_rate * (years - midpoint)))
+
+def _fitted(fit: dict, year) -> float:
+    return round(float(_logistic(year, fit['capacity'], fit['growth_rate'], fit['midpoint'])), 2)
+
+def fit_logistic_curve(years, cumulative_counts) -> dict:
+    """
+    Least-squares logistic fit of a cumulative publication curve.
+    Returns None with fewer than three years or when the fit does not converge.
+    """
+    x = np.asarray(years, dtype=float)
+    y = np.asarray(cumulative_counts, dtype=float)
+    if len(x) < 3 or y.max() <= 0:
+        return None
+    top = y.max()
+    initial = (top * 2, 0.5, np.median(x))
+    bounds = ([top, 1e-3, x.min() - 50], [top * 100, 5.0, x.max() + 50])
+    try:
+        params, _ = curve_fit(_logistic, x, y, p0=initial, bounds=bounds, maxfev=5000)
+    except (RuntimeError, ValueError):
+        return None
+    capacity, growth_rate, midpoint = params
+    return {"capacity": round(float(capacity), 2), "growth_rate": round(float(growth_rate), 4),
+            "midpoint": round(float(midpoint), 2)}
+
+def s_curve_from_aggregates(yearly: pd.DataFrame) -> list:
+    """S-curve points from per-year aggregates, with the fitted logistic value when a fit is possible."""
+    if yearly.empty:
         return []
+    counts = yearly['count'].astype(int)
+    cumulative_counts = counts.cumsum()
+    fit = fit_logistic_curve(counts.index, cumulative_counts)
 
-    df['year'] = df['published_date'].dt.year
-    yearly_counts = df['year'].value_counts().sort_index()
-    cumulative_counts = yearly_counts.cumsum()
-    
     s_curve_data = []
-    for year, count in yearly_counts.items():
-        s_curve_data.append({
+    for year, count in counts.items():
+        point = {
             'year': int(year),
             'count': int(count),
             'cumulative_count': int(cumulative_counts.loc[year])
-        })
+        }
+        if fit:
+            point['fitted_cumulative'] = _fitted(fit, year)
+        s_curve_data.append(point)
     return s_curve_data
 
+def forecast_s_curve(s_curve_data: list, years: int = FORECAST_YEARS) -> dict:
+    """Logistic fit parameters and the fitted cumulative count for the years after the last data point."""
+    if not s_curve_data:
+        return {"fit": None, "forecast": []}
+    fit = fit_logistic_curve([p['year'] for p in s_curve_data], [p['cumulative_count'] for p in s_curve_data])
+    if not fit:
+        return {"fit": None, "forecast": []}
+    last_year = s_curve_data[-1]['year']
+    forecast = [{'year': year, 'cumulative_count': _fitted(fit, year)}
+                for year in range(last_year + 1, last_year + years + 1)]
+    return {"fit": fit, "forecast": forecast}
+
+def calculate_s_curve(df: pd.DataFrame) -> list:
+    """Calculates the S-curve data from a dataframe of documents."""
+    return s_curve_from_aggregates(yearly_aggregates(df))
+
+def technology_incidence(df: pd.DataFrame) -> tuple:
+    """
+    Builds the document x technology incidence matrix in one pass.
+
+    Returns (matrix, names, row_positions): a CSR 0/1 matrix with one row per
+    document that lists technologies, the technology name of each column in
+    sorted order, and each matrix row's position in df.
+    """
+    empty = (sparse.csr_matrix((0, 0), dtype=np.int32), np.array([], dtype=object), np.array([], dtype=np.int64))
+    if 'technologies' not in df.columns or df.empty:
+        return empty
+    tech_lists = pd.Series(df['technologies'].to_numpy(), index=np.arange(len(df)))
+    tech_lists = tech_lists[tech_lists.map(lambda t: isinstance(t, list) and len(t) > 0)]
+    exploded = tech_lists.explode().dropna()
+    if exploded.empty:
+        return empty
+    codes, names = pd.factorize(exploded.astype(str), sort=True)
+    row_positions, rows = np.unique(exploded.index.to_numpy(), return_inverse=True)
+    matrix = sparse.csr_matrix((np.ones(len(codes), dtype=np.int32), (rows, codes)),
+                               shape=(len(row_positions), len(names)))
+    matrix.data[:] = 1  # a technology listed twice in one document still counts once
+    return matrix, np.array([str(name) for name in names], dtype=object), row_positions
+
+def cooccurrence_matrix(incidence: sparse.csr_matrix) -> sparse.csr_matrix:
+    """Technology x technology co-occurrence counts (upper triangle, no self-pairs)."""
+    return sparse.triu(incidence.T @ incidence, k=1, format='csr')
+
+def _top_pairs(cooccurrence: sparse.spmatrix, names: np.ndarray, top_n: int) -> list:
+    pairs = cooccurrence.tocoo()
+    if pairs.nnz == 0:
+        return []
+    weights = pairs.data
+    if pairs.nnz > top_n:
+        keep = np.argpartition(-weights, top_n - 1)[:top_n]
+    else:
+        keep = np.arange(pairs.nnz)
+    # Strongest first, ties broken by technology names
+    order = keep[np.lexsort((pairs.col[keep], pairs.row[keep], -weights[keep]))]
+    return [
+        {"tech_1": names[i], "tech_2": names[j], "strength": int(w)}
+        for i, j, w in zip(pairs.row[order], pairs.col[order], weights[order])
+    ]
+
 def find_technology_convergence(df: pd.DataFrame, top_n: int = 10) -> list:
     """Analyzes technology co-occurrence to find technology convergence."""
-    # Ensure technologies column exists and contains lists
-    if 'technologies' not in df.columns:
+    incidence, names, _ = technology_incidence(df)
+    if incidence.shape[1] < 2:
         return []
-    
-    df_tech = df.dropna(subset=['technologies'])
-    
-    G = nx.Graph()
-    
-    for tech_list in df_tech['technologies']:
-        if isinstance(tech_list, list) and len(tech_list) > 1:
-            for tech1, tech2 in combinations(sorted(tech_list), 2):
-                if G.has_edge(tech1, tech2):
-                    G[tech1][tech2]['weight'] += 1
-                else:
-                    G.add_edge(tech1, tech2, weight=1)
-
-    if not G.edges(data=True):
+    return _top_pairs(cooccurrence_matrix(incidence), names, top_n)
+
+def technology_centrality(df: pd.DataFrame, top_n: int = 10) -> list:
+    """
+    Degree, weighted degree, eigenvector centrality and clustering coefficient
+    of each technology in the co-occurrence graph, most connected first.
+    """
+    incidence, names, _ = technology_incidence(df)
+    if incidence.shape[1] < 2:
         return []
+    upper = cooccurrence_matrix(incidence)
+    weighted = (upper + upper.T).tocsr().astype(np.float64)
+    adjacency = (weighted > 0).astype(np.float64)
 
-    sorted_edges = sorted(G.edges(data=True), key=lambda x: x[2]['weight'], reverse=True)
-    
-    top_convergences = [
-        {"tech_1": edge[0], "tech_2": edge[1], "strength": edge[2]['weight']}
-        for edge in sorted_edges[:top_n]
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    weighted_degree = np.asarray(weighted.sum(axis=1)).ravel()
+    # Triangles through each node: row sums of (A @ A) masked by A, each triangle counted twice
+    triangles = np.asarray((adjacency @ adjacency).multiply(adjacency).sum(axis=1)).ravel() / 2
+    possible = degree * (degree - 1) / 2
+    clustering = np.divide(triangles, possible, out=np.zeros_like(triangles), where=possible > 0)
+
+    eigenvector = np.zeros(len(names))
+    if weighted.nnz:
+        try:
+            _, vectors = eigsh(weighted, k=1, which='LA')
+            eigenvector = np.abs(vectors[:, 0])
+        except Exception:
+            # Tiny or degenerate graphs: fall back to a few power iterations
+            eigenvector = np.ones(len(names))
+            for _ in range(100):
+                eigenvector = weighted @ eigenvector
+                eigenvector /= np.linalg.norm(eigenvector) or 1.0
+        eigenvector /= eigenvector.max() or 1.0
+
+    top_n = min(top_n, len(names))
+    keep = np.argpartition(-weighted_degree, top_n - 1)[:top_n]
+    order = keep[np.lexsort((keep, -weighted_degree[keep]))]
+    return [
+        {"technology": names[i], "degree": int(degree[i]), "weighted_degree": int(weighted_degree[i]),
+         "eigenvector": round(float(eigenvector[i]), 4), "clustering": round(float(clustering[i]), 4)}
+        for i in order
     ]
-    
-    return top_convergences
 
-def calculate_trl_progression(df: pd.DataFrame) -> dict:
-    """Calculates historical TRL progression and provides a simple forecast."""
-    df['published_date'] = pd.to_datetime(df['published'], errors='coerce')
-    df.dropna(subset=['published_date', 'TRL'], inplace=True)
-    df = df[df['TRL'] > 0]
-    if df.empty or len(df) < 2:
+def find_emerging_convergence(df: pd.DataFrame, recent_years: int = 2, min_recent: int = 2, top_n: int = 10) -> list:
+    """
+    Technology pairs whose co-occurrence grew the most in the last `recent_years`
+    years (by `published`) relative to everything before.
+    """
+    if 'published' not in df.columns:
+        return []
+    incidence, names, row_positions = technology_incidence(df)
+    if incidence.shape[1] < 2:
+        return []
+    years = pd.to_datetime(df['published'], errors='coerce').dt.year.to_numpy()[row_positions]
+    dated = ~np.isnan(years)
+    if not dated.any():
+        return []
+    recent = dated & (years > np.nanmax(years) - recent_years)
+    recent_pairs = cooccurrence_matrix(incidence[recent]).tocoo()
+    prior_pairs = cooccurrence_matrix(incidence[dated & ~recent]).tocsr()
+
+    candidates = recent_pairs.data >= min_recent
+    rows, cols, recent_counts = recent_pairs.row[candidates], recent_pairs.col[candidates], recent_pairs.data[candidates]
+    if not len(recent_counts):
+        return []
+    prior_counts = np.asarray(prior_pairs[rows, cols]).ravel()
+    growth = recent_counts / (prior_counts + 1.0)
+
+    top_n = min(top_n, len(growth))
+    keep = np.argpartition(-growth, top_n - 1)[:top_n]
+    order = keep[np.lexsort((cols[keep], rows[keep], -recent_counts[keep], -growth[keep]))]
+    return [
+        {"tech_1": names[rows[i]], "tech_2": names[cols[i]], "recent": int(recent_counts[i]),
+         "previous": int(prior_counts[i]), "growth": round(float(growth[i]), 2)}
+        for i in order
+    ]
+
+def trl_progression_from_aggregates(yearly: pd.DataFrame) -> dict:
+    """Historical average TRL per year from per-year aggregates, with a simple forecast."""
+    rated = yearly[yearly['trl_count'] > 0] if not yearly.empty else yearly
+    if rated.empty or rated['trl_count'].sum() < 2:
         return {"history": [], "forecast": []}
 
-    df['year'] = df['published_date'].dt.year
-    
     # Calculate historical average TRL per year
-    yearly_trl = df.groupby('year')['TRL'].mean().round(2).sort_index()
+    yearly_trl = (rated['trl_sum'] / rated['trl_count']).astype(float).round(2).sort_index()
     
     history = [{'year': int(year), 'avg_trl': trl} for year, trl in yearly_trl.items()]
 
@@ -81,7 +256,7 @@ def calculate_trl_progression(df: pd.DataFrame) -> dict:
 
         # Forecast for the next 3 years
         last_year = X.max()
-        future_years = np.arange(last_year + 1, last_year + 4).reshape(-1, 1)
+        future_years = np.arange(last_year + 1, last_year + FORECAST_YEARS + 1).reshape(-1, 1)
         future_trl = model.predict(future_years).round(2)
         
         # Ensure forecast doesn't exceed TRL 9
@@ -89,4 +264,8 @@ def calculate_trl_progression(df: pd.DataFrame) -> dict:
 
         forecast = [{'year': int(year), 'avg_trl': trl} for year, trl in zip(future_years.flatten(), future_trl)]
 
-    return {"history": history, "forecast": forecast}
\ No newline at end of file
+    return {"history": history, "forecast": forecast}
+
+def calculate_trl_progression(df: pd.DataFrame) -> dict:
+    """Calculates historical TRL progression and provides a simple forecast."""
+    return trl_progression_from_aggregates(yearly_aggregates(df))
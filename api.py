@@ -1,109 +1,441 @@
 import os
-from flask import Flask, jsonify, request
+import re
+import base64
+import time
+import uuid
+from urllib.parse import urlencode
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
-from pymongo import MongoClient
 from dotenv import load_dotenv
 from bson import json_util
 import json
-import pandas as pd
-from worker import run_analysis_pipeline_task
-# --- NEW IMPORTS ---
-from intelligence import get_gemini_topic_synthesis
-from analytics import calculate_s_curve, find_technology_convergence, calculate_trl_progression
+from jobs import claim_topic, release_topic, job_exists, job_payload, queue_lengths, ANALYSIS_TASK
+from mongo import get_db, pool_stats
+from search import find_documents, MATCH_MODES
+from convergence import top_convergences
+from synthesis_cache import synthesis_cache
+from metrics import observe, set_gauge, render as render_metrics, current_endpoint
+# Celery, analytics (pandas, scipy, scikit-learn), Gemini and the embedding index (numpy) are imported
+# inside the endpoints that use them, so the web process starts with Flask and pymongo only
 
 load_dotenv()
 
+MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", 500))
+MAX_SEARCH_RESULTS = 100
+STREAM_BATCH_SIZE = 200
+JOB_POLL_INTERVAL = float(os.getenv("API_JOB_POLL_INTERVAL", 1.0))
+SSE_HEARTBEAT_SECONDS = 15
+# Event streams are closed after this long so an abandoned or stuck job cannot hold a server thread forever
+SSE_MAX_SECONDS = float(os.getenv("API_SSE_MAX_SECONDS", 3600))
+_FIELD_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_.]*$")
+
+def _encode_cursor(offset: int, last_doc: dict = None) -> str:
+    """The offset, plus the (published, _id) key of the page's last document when it has one."""
+    payload = {"o": offset}
+    if last_doc is not None and "_id" in last_doc:
+        payload["k"] = [last_doc.get("published"), last_doc["_id"]]
+    return base64.urlsafe_b64encode(json_util.dumps(payload).encode()).decode().rstrip("=")
+
+def _decode_cursor(token: str) -> tuple:
+    """Opaque page cursor -> (offset, keyset or None). Cursors only come from X-Next-Cursor."""
+    if not token:
+        return 0, None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded))
+        offset = int(payload["o"])
+        key = tuple(payload["k"]) if "k" in payload else None
+    except Exception:
+        raise ValueError("Invalid 'after' cursor.")
+    if offset < 0 or (key is not None and len(key) != 2):
+        raise ValueError("Invalid 'after' cursor.")
+    return offset, key
+
+def _parse_projection(fields: str):
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    invalid = [name for name in names if not _FIELD_NAME_RE.match(name)]
+    if invalid:
+        raise ValueError(f"Invalid field name(s): {', '.join(invalid)}")
+    return {"id": 1, **{name: 1 for name in names}}
+
+def _query_with(**overrides) -> str:
+    args = request.args.to_dict()
+    args.update(overrides)
+    return urlencode(args)
+
+def _stream_json_array(documents):
+    yield "["
+    for i, doc in enumerate(documents):
+        yield ("," if i else "") + json_util.dumps(doc)
+    yield "]"
+
+def _celery():
+    from celery_app import celery_app
+    return celery_app
+
+def _job_state(job_id):
+    return _celery().AsyncResult(job_id)
+
+def _unknown_job(result):
+    """True for a job Celery has no result for and that was never queued, which Celery also reports as PENDING."""
+    from celery import states
+    if result.state != states.PENDING:
+        return False
+    try:
+        return not job_exists(result.id)
+    except Exception as e:
+        print(f"API: Could not look up job {result.id}: {e}")
+        return False
+
+def _job_not_found(job_id):
+    return jsonify({"error": f"Unknown job '{job_id}'."}), 404
+
+def _job_accepted(job_id, status, deduplicated=False):
+    status_url = f"/api/jobs/{job_id}"
+    body = {"status": status, "job_id": job_id, "deduplicated": deduplicated,
+            "status_url": status_url, "events_url": f"{status_url}/events"}
+    return jsonify(body), 202, {"Location": status_url}
+
 def create_app():
     app = Flask(__name__)
-    CORS(app, resources={r"/api/*": {"origins": "*"}})
-
-    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-    client = MongoClient(mongo_uri)
-    db = client.get_database("aetos_db")
-
-    def get_docs_for_topic(topic):
-        """Helper function to fetch documents for a topic."""
-        query = {
-            "$or": [
-                {"title": {"$regex": topic, "$options": "i"}},
-                {"technologies": {"$regex": topic, "$options": "i"}}
-            ]
-        }
-        return list(db.documents.find(query))
+    CORS(app, resources={r"/api/*": {"origins": "*", "expose_headers": ["X-Next-Cursor", "Link", "X-Cache"]}})
+
+    @app.before_request
+    def start_request_timer():
+        # The route template, not the path, so topics and ids do not multiply the label values
+        g.endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        g.request_started = time.perf_counter()
+        current_endpoint.set(g.endpoint)
+
+    @app.after_request
+    def record_request_latency(response):
+        # Streamed bodies are still being sent at this point; their time counts up to the first byte
+        if "request_started" in g:
+            observe("aetos_http_request_seconds", time.perf_counter() - g.request_started,
+                    endpoint=g.endpoint, method=request.method, status=str(response.status_code))
+        return response
+
+    @app.route("/metrics", methods=['GET'])
+    def get_metrics():
+        """Prometheus scrape endpoint: totals from the API, every worker and local runs."""
+        try:
+            for queue, length in queue_lengths([_celery().conf.task_default_queue]).items():
+                set_gauge("aetos_celery_queue_length", length, queue=queue)
+        except Exception as e:
+            print(f"API: Could not read the Celery queue length: {e}")
+        return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
     @app.route("/api/documents/<topic>", methods=['GET'])
     def get_documents(topic):
-        print(f"API: Received request for documents on topic: '{topic}'")
-        documents = get_docs_for_topic(topic)
-        print(f"API: Found {len(documents)} matching documents.")
-        return jsonify(json.loads(json_util.dumps(documents)))
+        """
+        Query parameters (all optional):
+        - match:  text | phrase | prefix (see search.py)
+        - limit:  page size; when set, X-Next-Cursor carries the cursor for the next page
+        - after:  cursor returned by the previous page
+        - fields: comma-separated projection, e.g. fields=title,TRL,technologies
+        - format: json (default) | ndjson
+        - stream: 1 to stream a JSON array chunk by chunk instead of building it in memory
+        """
+        mode = request.args.get('match', 'text')
+        if mode not in MATCH_MODES:
+            return jsonify({"error": f"Unknown match mode '{mode}'. Expected one of {', '.join(MATCH_MODES)}."}), 400
+        try:
+            limit = request.args.get('limit', type=int) or 0
+            limit = min(max(limit, 0), MAX_PAGE_SIZE)
+            offset, after = _decode_cursor(request.args.get('after'))
+            projection = _parse_projection(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        # Prefix-mode pages continue from the last document's (published, _id), which must be fetched
+        hide_published = bool(limit) and mode == "prefix" and projection is not None and "published" not in projection
+        if hide_published:
+            projection = {**projection, "published": 1}
+        output_format = request.args.get('format', 'json')
+        stream = request.args.get('stream', '0').lower() in ('1', 'true', 'yes')
+
+        print(f"API: Received request for documents on topic: '{topic}' (match={mode}, limit={limit or 'all'}, offset={offset})")
+        # Fetch one extra document to learn whether another page exists
+        cursor = find_documents(get_db(), topic, mode=mode, projection=projection,
+                                limit=limit + 1 if limit else 0, skip=offset, after=after)
+
+        headers = {}
+        if limit:
+            documents = list(cursor)
+            if len(documents) > limit:
+                documents = documents[:limit]
+                next_cursor = _encode_cursor(offset + limit, documents[-1] if mode == "prefix" else None)
+                headers["X-Next-Cursor"] = next_cursor
+                headers["Link"] = f'<{request.base_url}?{_query_with(after=next_cursor)}>; rel="next"'
+            if hide_published:
+                for doc in documents:
+                    doc.pop("published", None)
+            cursor = documents
+            print(f"API: Returning {len(documents)} matching documents.")
+        elif not stream and output_format != 'ndjson':
+            documents = list(cursor)
+            print(f"API: Found {len(documents)} matching documents.")
+            return Response(json_util.dumps(documents), mimetype='application/json')
+
+        elif hasattr(cursor, 'batch_size'):
+            cursor = cursor.batch_size(STREAM_BATCH_SIZE)
+
+        if output_format == 'ndjson':
+            body = (json_util.dumps(doc) + "\n" for doc in cursor)
+            return Response(body, mimetype='application/x-ndjson', headers=headers)
+        if stream:
+            return Response(_stream_json_array(cursor), mimetype='application/json', headers=headers)
+        return Response(json_util.dumps(cursor), mimetype='application/json', headers=headers)
+
+    def _documents_for_hits(hits, projection):
+        """Loads the documents behind (id, score) hits, in hit order, with their similarity."""
+        ids = [doc_id for doc_id, _ in hits]
+        by_id = {doc['id']: doc for doc in get_db().documents.find({'id': {'$in': ids}}, projection)}
+        return [{**by_id[doc_id], 'similarity': round(score, 4)} for doc_id, score in hits if doc_id in by_id]
+
+    def _search_params():
+        limit = request.args.get('limit', type=int) or 10
+        return min(max(limit, 1), MAX_SEARCH_RESULTS), _parse_projection(request.args.get('fields'))
+
+    @app.route("/api/search", methods=['GET'])
+    def semantic_search():
+        """Documents closest in meaning to ?q=, from the embedding index. Also takes limit and fields."""
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return jsonify({"error": "Missing query parameter 'q'."}), 400
+        try:
+            limit, projection = _search_params()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        started = time.perf_counter()
+        from embeddings import embedding_index
+        try:
+            embedding_index.refresh()
+            hits = embedding_index.search_text(query, limit)
+        except ImportError as e:
+            return jsonify({"error": f"Semantic search is unavailable: {e}"}), 503
+        documents = _documents_for_hits(hits, projection)
+        print(f"API: Semantic search for '{query}' returned {len(documents)} documents "
+              f"in {(time.perf_counter() - started) * 1000:.1f} ms.")
+        return Response(json_util.dumps(documents), mimetype='application/json')
+
+    @app.route("/api/documents/<path:doc_id>/similar", methods=['GET'])
+    def similar_documents(doc_id):
+        """Documents most similar to the given one. Also takes limit and fields."""
+        try:
+            limit, projection = _search_params()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        from embeddings import embedding_index, stored_vector
+        db = get_db()
+        embedding_index.refresh()
+        vector = embedding_index.vector_for(doc_id)
+        if vector is None:
+            # Embedded after the last sync
+            vector = stored_vector(db, doc_id)
+        if vector is None:
+            return jsonify({"error": f"No embedding for document '{doc_id}'."}), 404
+        hits = embedding_index.search(vector, limit, exclude={doc_id})
+        return Response(json_util.dumps(_documents_for_hits(hits, projection)), mimetype='application/json')
 
     @app.route("/api/analyze/<topic>", methods=['POST'])
     def analyze_topic(topic):
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         num_documents = data.get('num_documents', 50)
-        
-        print(f"API: Received analysis request for '{topic}' for {num_documents} documents. Running synchronously.")
+
+        from celery import states
+        job_id = uuid.uuid4().hex
+        try:
+            owner = claim_topic(topic, job_id)
+            if owner != job_id:
+                if _job_state(owner).state not in states.READY_STATES:
+                    print(f"API: Analysis for '{topic}' is already running as job {owner}.")
+                    return _job_accepted(owner, "Analysis already running", deduplicated=True)
+                # The owning job finished without releasing its claim (e.g. the worker died)
+                release_topic(topic, owner)
+                owner = claim_topic(topic, job_id)
+                if owner != job_id:
+                    return _job_accepted(owner, "Analysis already running", deduplicated=True)
+        except Exception as e:
+            print(f"API: Could not claim analysis job for '{topic}': {e}")
+            return jsonify({"status": "Analysis failed", "error": "Job queue unavailable."}), 503
+
+        print(f"API: Queuing analysis job {job_id} for '{topic}' ({num_documents} documents).")
         try:
-            result = run_analysis_pipeline_task(topic, num_documents=num_documents)
-            return jsonify({"status": "Analysis complete", "result": result}), 200
+            # By name, so the API does not import the worker and its pipeline dependencies
+            _celery().send_task(ANALYSIS_TASK, args=[topic], kwargs={"num_documents": num_documents}, task_id=job_id)
         except Exception as e:
-            print(f"API: Error during analysis: {e}")
-            return jsonify({"status": "Analysis failed", "error": str(e)}), 500
+            print(f"API: Error queuing analysis: {e}")
+            release_topic(topic, job_id)
+            return jsonify({"status": "Analysis failed", "error": str(e)}), 503
+        return _job_accepted(job_id, "Analysis queued")
+
+    @app.route("/api/jobs/<job_id>", methods=['GET'])
+    def get_job(job_id):
+        result = _job_state(job_id)
+        if _unknown_job(result):
+            return _job_not_found(job_id)
+        return jsonify(job_payload(result))
+
+    @app.route("/api/jobs/<job_id>/events", methods=['GET'])
+    def stream_job_events(job_id):
+        """
+        Server-sent events: one `data:` line per change in the job's state or progress, until it finishes.
+        A stream still open after SSE_MAX_SECONDS ends with a `timeout` event; clients reconnect to keep following.
+        """
+        if _unknown_job(_job_state(job_id)):
+            return _job_not_found(job_id)
+
+        def events():
+            last = None
+            last_sent = time.monotonic()
+            deadline = last_sent + SSE_MAX_SECONDS
+            while True:
+                payload = job_payload(_job_state(job_id))
+                encoded = json.dumps(payload)
+                if encoded != last:
+                    last, last_sent = encoded, time.monotonic()
+                    yield f"event: {'done' if payload['finished'] else 'progress'}\ndata: {encoded}\n\n"
+                    if payload["finished"]:
+                        return
+                elif time.monotonic() - last_sent >= SSE_HEARTBEAT_SECONDS:
+                    last_sent = time.monotonic()
+                    yield ": keep-alive\n\n"
+                if time.monotonic() >= deadline:
+                    yield f"event: timeout\ndata: {encoded}\n\n"
+                    return
+                time.sleep(JOB_POLL_INTERVAL)
+
+        return Response(events(), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.route("/api/stats/db", methods=['GET'])
+    def get_db_stats():
+        return jsonify(pool_stats())
 
     # --- NEW ANALYTICS ENDPOINTS ---
 
+    def _match_mode():
+        mode = request.args.get('match', 'text')
+        if mode not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode '{mode}'. Expected one of {', '.join(MATCH_MODES)}.")
+        return mode
+
+    def convergence_for_topic(topic, mode="text"):
+        # Ingested topics are served from the materialized co-occurrence index in the default mode.
+        # Those counts are keyed by topic, not by match, so phrase and prefix queries scan their documents.
+        if mode == "text":
+            convergence_data = top_convergences(get_db(), topic)
+            if convergence_data:
+                return convergence_data
+        import pandas as pd
+        from analytics import find_technology_convergence
+        documents = list(find_documents(get_db(), topic, mode=mode, projection={"_id": 0, "technologies": 1}))
+        return find_technology_convergence(pd.DataFrame(documents))
+
     @app.route("/api/analytics/synthesis/<topic>", methods=['GET'])
     def get_synthesis_and_charts(topic):
-        documents = get_docs_for_topic(topic)
-        if not documents:
+        try:
+            mode = _match_mode()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        def load_documents():
+            projection = {"_id": 0, "id": 1, "summary": 1, "updated_at": 1}
+            return list(find_documents(get_db(), topic, mode=mode, projection=projection, limit=20))
+
+        def synthesize(documents):
+            from intelligence import get_gemini_topic_synthesis
+            # We need summaries for the prompt; the charts come from stored data, not the LLM
+            summaries = [doc['summary'] for doc in documents if 'summary' in doc]
+            # Pass the topic to the synthesis function
+            return get_gemini_topic_synthesis(summaries[:20], topic)
+
+        synthesis, cache_status = synthesis_cache.get_or_compute(topic, mode, load_documents, synthesize)
+        if synthesis is None:
             return jsonify({"error": "No documents found for synthesis."}), 404
+        synthesis_data = dict(synthesis)
         
-        # We need summaries for the prompt, but the function will return all analytics data
-        summaries = [doc['summary'] for doc in documents if 'summary' in doc]
-        
-        # Pass the topic to the synthesis function
-        synthesis_data = get_gemini_topic_synthesis(summaries[:20], topic)
-        
-        # For convergence, we still use the real data
-        df = pd.DataFrame(json.loads(json_util.dumps(documents)))
-        convergence_data = find_technology_convergence(df)
+        from analytics import (yearly_topic_aggregates, s_curve_from_aggregates, forecast_s_curve,
+                               trl_progression_from_aggregates)
+        yearly = yearly_topic_aggregates(get_db(), topic, mode)
+        s_curve_data = s_curve_from_aggregates(yearly)
         
         # Combine the results
-        synthesis_data['convergence'] = convergence_data
+        synthesis_data['s_curve'] = s_curve_data
+        synthesis_data['s_curve_forecast'] = forecast_s_curve(s_curve_data)
+        synthesis_data['trl_progression'] = trl_progression_from_aggregates(yearly)
+        synthesis_data['convergence'] = convergence_for_topic(topic, mode)
         
-        return jsonify(synthesis_data)
+        return jsonify(synthesis_data), 200, {"X-Cache": cache_status}
 
-    return app
+    @app.route("/api/analytics/scurve/<topic>", methods=['GET'])
+    def get_scurve(topic):
+        try:
+            mode = _match_mode()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        from analytics import yearly_topic_aggregates, s_curve_from_aggregates
+        s_curve_data = s_curve_from_aggregates(yearly_topic_aggregates(get_db(), topic, mode))
+        if not s_curve_data:
+            return jsonify([]), 404
+        return jsonify(s_curve_data)
+
+    @app.route("/api/analytics/convergence/<topic>", methods=['GET'])
+    def get_convergence(topic):
+        try:
+            mode = _match_mode()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        convergence_data = convergence_for_topic(topic, mode)
+        if not convergence_data:
+            return jsonify([]), 404
+        return jsonify(convergence_data)
+
+    def technology_frame(topic, mode, fields):
+        import pandas as pd
+        projection = {"_id": 0, "technologies": 1, **{field: 1 for field in fields}}
+        return pd.DataFrame(list(find_documents(get_db(), topic, mode=mode, projection=projection)))
 
-    # @app.route("/api/analytics/scurve/<topic>", methods=['GET'])
-    # def get_scurve(topic):
-    #     documents = get_docs_for_topic(topic)
-    #     if not documents:
-    #         return jsonify([]), 404
-    #     df = pd.DataFrame(json.loads(json_util.dumps(documents)))
-    #     s_curve_data = calculate_s_curve(df)
-    #     return jsonify(s_curve_data)
-
-    # @app.route("/api/analytics/convergence/<topic>", methods=['GET'])
-    # def get_convergence(topic):
-    #     documents = get_docs_for_topic(topic)
-    #     if not documents:
-    #         return jsonify([]), 404
-    #     df = pd.DataFrame(json.loads(json_util.dumps(documents)))
-    #     convergence_data = find_technology_convergence(df)
-    #     return jsonify(convergence_data)
-
-    # @app.route("/api/analytics/trl_progression/<topic>", methods=['GET'])
-    # def get_trl_progression(topic):
-    #     documents = get_docs_for_topic(topic)
-    #     if not documents:
-    #         return jsonify({"history": [], "forecast": []}), 404
-    #     df = pd.DataFrame(json.loads(json_util.dumps(documents)))
-    #     trl_data = calculate_trl_progression(df)
-    #     return jsonify(trl_data)
-
-    # return app
+    @app.route("/api/analytics/centrality/<topic>", methods=['GET'])
+    def get_centrality(topic):
+        """Most connected technologies in the topic's co-occurrence graph."""
+        try:
+            mode = _match_mode()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        from analytics import technology_centrality
+        centrality_data = technology_centrality(technology_frame(topic, mode, ()))
+        if not centrality_data:
+            return jsonify([]), 404
+        return jsonify(centrality_data)
+
+    @app.route("/api/analytics/emerging/<topic>", methods=['GET'])
+    def get_emerging_convergence(topic):
+        """Technology pairs whose co-occurrence grew the most in the last two years."""
+        try:
+            mode = _match_mode()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        from analytics import find_emerging_convergence
+        emerging_data = find_emerging_convergence(technology_frame(topic, mode, ("published",)))
+        if not emerging_data:
+            return jsonify([]), 404
+        return jsonify(emerging_data)
+
+    @app.route("/api/analytics/trl_progression/<topic>", methods=['GET'])
+    def get_trl_progression(topic):
+        try:
+            mode = _match_mode()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        from analytics import yearly_topic_aggregates, trl_progression_from_aggregates
+        trl_data = trl_progression_from_aggregates(yearly_topic_aggregates(get_db(), topic, mode))
+        if not trl_data["history"]:
+            return jsonify(trl_data), 404
+        return jsonify(trl_data)
+
+    return app
 
 if __name__ == "__main__":
     app = create_app()
@@ -0,0 +1,342 @@
+# backfill.py
+"""
+Multi-topic historical backfill, fanned out over Celery workers.
+
+    python backfill.py --topic "quantum cryptography" --topic lidar --from 2018-01-01 --to 2023-12-31
+    python backfill.py --plan plan.json        # [{"topic": ..., "from": ..., "to": ..., "max_per_source": ...}]
+    python backfill.py --status <backfill_id>
+
+Each topic becomes one chord per topic. Its header is a group of per-source,
+per-page fetch tasks. Its callback splits the filtered, de-duplicated
+candidates into per-batch analysis tasks, followed by a final chord callback
+that closes out the topic. Work is spread over every worker consuming the
+default queue.
+
+Limits hold across all workers:
+- each source has a Redis semaphore (BACKFILL_<SOURCE>_CONCURRENCY) and a
+  minimum spacing between requests (arXiv asks for 3 seconds);
+- every Gemini call already goes through the shared gemini_limiter token bucket.
+
+A page whose fetch keeps failing is retried BACKFILL_FETCH_RETRIES times with
+exponential backoff, then skipped and listed under failed_pages, so one bad
+page cannot fail the topic's chord.
+
+Progress counters are $inc'ed into the backfill_runs collection by every task,
+so --status reports aggregate throughput while the backfill runs.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from datetime import datetime
+import pandas as pd
+from celery import chord, group
+from celery_app import celery_app
+from ingest import iter_arxiv_pages, arxiv_search_query, ARXIV_PAGE_SIZE, ARXIV_REQUEST_INTERVAL
+from ingest_patents import fetch_patent_data, PATENT_PAGE_SIZE
+from filtering import filter_candidates
+from dedup import dedup_index, load_canonical_analyses
+from intelligence import get_gemini_analysis_batch, ANALYSIS_BATCH_SIZE, ANALYSIS_FIELDS
+from database import save_to_db, get_db_connection, SaveError
+from embeddings import sync_index
+from rate_limiter import DEFAULT_REDIS_URL
+from pipeline import _inherit
+
+SOURCES = ("arxiv", "google_patents")
+SOURCE_LIMITS = {
+    "arxiv": {"concurrency": int(os.getenv("BACKFILL_ARXIV_CONCURRENCY", 1)), "interval": ARXIV_REQUEST_INTERVAL},
+    "google_patents": {"concurrency": int(os.getenv("BACKFILL_PATENTS_CONCURRENCY", 2)),
+                       "interval": float(os.getenv("BACKFILL_PATENTS_INTERVAL", 3.0))},
+}
+SLOT_RETRY_SECONDS = 5
+SLOT_TTL_SECONDS = 600  # a worker that dies mid-fetch frees its slot after this long
+FETCH_RETRIES = int(os.getenv("BACKFILL_FETCH_RETRIES", 3))
+FETCH_RETRY_BACKOFF_SECONDS = 30  # doubled after every failed attempt
+
+# KEYS: slot counter, next-request timestamp. ARGV: concurrency, interval ms, slot TTL ms.
+# Returns 0 when a slot was taken, otherwise the ms to wait before retrying.
+_ACQUIRE_SLOT_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local next_at = tonumber(redis.call('GET', KEYS[2]) or '0')
+if next_at > now then return next_at - now end
+if tonumber(redis.call('GET', KEYS[1]) or '0') >= tonumber(ARGV[1]) then return 1000 end
+redis.call('INCR', KEYS[1])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+redis.call('SET', KEYS[2], tostring(now + tonumber(ARGV[2])), 'PX', math.max(1, tonumber(ARGV[2])))
+return 0
+"""
+
+_RELEASE_SLOT_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') > 0 then redis.call('DECR', KEYS[1]) end
+return 0
+"""
+
+_redis_client = None
+_redis_pid = None
+_redis_lock = threading.Lock()
+
+
+def _redis():
+    global _redis_client, _redis_pid
+    with _redis_lock:
+        if _redis_client is None or _redis_pid != os.getpid():
+            import redis
+            _redis_client = redis.Redis.from_url(DEFAULT_REDIS_URL, socket_timeout=2, socket_connect_timeout=2)
+            _redis_pid = os.getpid()
+        return _redis_client
+
+
+def _slot_keys(source: str) -> list:
+    return [f"aetos:backfill:{source}:slots", f"aetos:backfill:{source}:next_at"]
+
+
+def _try_acquire_source(source: str) -> int:
+    limits = SOURCE_LIMITS[source]
+    return int(_redis().eval(_ACQUIRE_SLOT_SCRIPT, 2, *_slot_keys(source), limits["concurrency"],
+                             int(limits["interval"] * 1000), SLOT_TTL_SECONDS * 1000))
+
+
+def _release_source(source: str):
+    _redis().eval(_RELEASE_SLOT_SCRIPT, 1, _slot_keys(source)[0])
+
+
+def _record(backfill_id: str, **counts):
+    counts = {f"counters.{name}": value for name, value in counts.items() if value}
+    if counts:
+        get_db_connection().backfill_runs.update_one(
+            {"_id": backfill_id}, {"$inc": counts, "$set": {"updated_at": datetime.utcnow()}})
+
+
+def _record_failed_page(backfill_id: str, source: str, page: int, error: Exception):
+    get_db_connection().backfill_runs.update_one(
+        {"_id": backfill_id},
+        {"$inc": {"counters.failed_pages": 1},
+         "$push": {"failed_pages": {"source": source, "page": page, "error": str(error), "at": datetime.utcnow()}},
+         "$set": {"updated_at": datetime.utcnow()}})
+
+
+def _fetch_page(source: str, topic: str, page: int, page_size: int, date_from: str, date_to: str) -> pd.DataFrame:
+    if source == "arxiv":
+        query = arxiv_search_query(topic, date_from, date_to)
+        pages = iter_arxiv_pages(topic, max_results=page_size, page_size=page_size, search_query=query,
+                                 start=page * page_size)
+        return next(pages, pd.DataFrame())
+    return fetch_patent_data(topic, max_results=page_size, page=page, date_from=date_from, date_to=date_to)
+
+
+@celery_app.task(bind=True, name='backfill.fetch_page', max_retries=None, acks_late=True)
+def fetch_page_task(self, backfill_id: str, topic: str, source: str, page: int, page_size: int,
+                    date_from: str = None, date_to: str = None, fetch_failures: int = 0) -> list:
+    """Fetches, filters and de-duplicates one result page. Returns the candidates that still need analysis."""
+    wait_ms = _try_acquire_source(source)
+    if wait_ms > 0:
+        # Source is at its concurrency limit or too soon after the last request; go back on the queue
+        raise self.retry(countdown=max(1, min(SLOT_RETRY_SECONDS, wait_ms / 1000.0)))
+    try:
+        page_df = _fetch_page(source, topic, page, page_size, date_from, date_to)
+    except Exception as e:
+        # Slot waits retry without limit, so fetch failures are counted separately
+        if fetch_failures < FETCH_RETRIES:
+            print(f"[Backfill {backfill_id}] {source} page {page} of '{topic}' failed "
+                  f"(attempt {fetch_failures + 1}/{FETCH_RETRIES + 1}): {e}")
+            raise self.retry(kwargs={**self.request.kwargs, "fetch_failures": fetch_failures + 1},
+                             countdown=FETCH_RETRY_BACKOFF_SECONDS * 2 ** fetch_failures)
+        print(f"[Backfill {backfill_id}] Giving up on {source} page {page} of '{topic}': {e}")
+        _record_failed_page(backfill_id, source, page, e)
+        return []
+    finally:
+        _release_source(source)
+
+    candidates, drops = filter_candidates(page_df, topic)
+    records = json.loads(candidates.to_json(orient='records', date_format='iso')) if not candidates.empty else []
+    canonical, duplicates = dedup_index.assign(records) if records else ([], [])
+
+    # Duplicates of already-analyzed documents are saved straight away with the canonical analysis.
+    # The rest wait for their canonical document and ride along in its analysis batch.
+    stored = load_canonical_analyses({canonical_id for _, canonical_id in duplicates}, ANALYSIS_FIELDS)
+    inherited = [_inherit(record, canonical_id, stored[canonical_id])
+                 for record, canonical_id in duplicates if canonical_id in stored]
+    waiting = [{**record, 'duplicate_of': canonical_id}
+               for record, canonical_id in duplicates if canonical_id not in stored]
+    saved = _save(inherited, topic) if inherited else 0
+
+    _record(backfill_id, pages=1, fetched=len(page_df), candidates=len(records), filtered_out=sum(drops.values()),
+            duplicates=len(duplicates), saved=saved, failed=len(inherited) - saved)
+    return canonical + waiting
+
+
+def _save(records: list, topic: str) -> int:
+    """Saves the records and returns how many were written, unchanged ones included."""
+    df = pd.DataFrame(records)
+    if 'published' in df.columns:
+        df['published'] = pd.to_datetime(df['published'], errors='coerce')
+    try:
+        save_to_db(df, topic=topic)
+    except SaveError as e:
+        print(f"[Backfill] Failed to save {len(e.failed_ids)} of {len(records)} documents for '{topic}': {e}")
+        return len(records) - len(e.failed_ids)
+    return len(records)
+
+
+def _analyze(records: list) -> list:
+    """The records Gemini analyzed successfully, merged with their analysis."""
+    if not records:
+        return []
+    insights_list = get_gemini_analysis_batch([r['summary'] for r in records], batch_size=len(records))
+    return [{**record, **insights} for record, insights in zip(records, insights_list)
+            if isinstance(insights, dict) and insights.get("TRL", 0) != 0]
+
+
+@celery_app.task(name='backfill.analyze_batch', acks_late=True)
+def analyze_batch_task(backfill_id: str, topic: str, records: list) -> dict:
+    """
+    Analyzes one batch through the shared Gemini limiter and saves the
+    successful results, along with near-duplicates that inherit them.
+    """
+    started = time.monotonic()
+    analyzed = _analyze([r for r in records if not r.get('duplicate_of')])
+    analyses_by_id = {record['id']: {field: record[field] for field in ANALYSIS_FIELDS if field in record}
+                      for record in analyzed}
+    inherited = [_inherit(record, record['duplicate_of'], analyses_by_id[record['duplicate_of']])
+                 for record in records if record.get('duplicate_of') in analyses_by_id]
+    # Duplicates of a document that failed analysis have nothing to inherit, so they are analyzed themselves
+    orphans = [{k: v for k, v in record.items() if k != 'duplicate_of'} for record in records
+               if record.get('duplicate_of') and record['duplicate_of'] not in analyses_by_id]
+    analyzed += _analyze(orphans)
+    saved = _save(analyzed + inherited, topic) if analyzed or inherited else 0
+    counts = {"analyzed": len(analyzed), "failed": len(records) - saved,
+              "saved": saved, "analysis_seconds": round(time.monotonic() - started, 2)}
+    _record(backfill_id, **counts)
+    return counts
+
+
+@celery_app.task(bind=True, name='backfill.plan_analysis')
+def plan_analysis_task(self, page_results: list, backfill_id: str, topic: str, batch_size: int = None):
+    """Chord callback for a topic's fetches: fans its candidates out into analysis batches."""
+    batch_size = max(1, batch_size or ANALYSIS_BATCH_SIZE)
+    records = {r['id']: r for page in page_results for r in (page or [])}
+    to_analyze = [r for r in records.values() if r.get('duplicate_of') not in records]
+    waiting = {}
+    for record in records.values():
+        if record.get('duplicate_of') in records:
+            waiting.setdefault(record['duplicate_of'], []).append(record)
+
+    batches = []
+    for i in range(0, len(to_analyze), batch_size):
+        batch = [{k: v for k, v in r.items() if k != 'duplicate_of'} for r in to_analyze[i:i + batch_size]]
+        batches.append(batch + [d for r in batch for d in waiting.get(r['id'], [])])
+    print(f"[Backfill {backfill_id}] '{topic}': {len(to_analyze)} documents to analyze in {len(batches)} batches.")
+    if not batches:
+        return finish_topic_task([], backfill_id, topic)
+    return self.replace(chord(group(analyze_batch_task.s(backfill_id, topic, batch) for batch in batches),
+                              finish_topic_task.s(backfill_id, topic)))
+
+
+@celery_app.task(name='backfill.finish_topic')
+def finish_topic_task(batch_results: list, backfill_id: str, topic: str) -> dict:
+    db = get_db_connection()
+    sync_index(db, force=True)
+    now = datetime.utcnow()
+    run = db.backfill_runs.find_one_and_update(
+        {"_id": backfill_id}, {"$addToSet": {"completed_topics": topic}, "$set": {"updated_at": now}},
+        return_document=True)
+    if run and len(run.get("completed_topics", [])) >= len(run.get("plan", [])):
+        db.backfill_runs.update_one({"_id": backfill_id, "finished_at": {"$exists": False}},
+                                    {"$set": {"finished_at": now}})
+    print(f"[Backfill {backfill_id}] Finished '{topic}'.")
+    return {"topic": topic, "batches": len(batch_results)}
+
+
+def _page_counts(max_per_source: int, arxiv_page_size: int) -> dict:
+    return {
+        "arxiv": -(-max_per_source // arxiv_page_size),
+        "google_patents": -(-max_per_source // PATENT_PAGE_SIZE),
+    }
+
+
+def start_backfill(plan: list, sources: tuple = SOURCES, arxiv_page_size: int = ARXIV_PAGE_SIZE,
+                   batch_size: int = None) -> str:
+    """
+    Queues a backfill. `plan` is a list of {"topic", "from", "to", "max_per_source"}
+    entries (dates are YYYY-MM-DD and optional). Returns the backfill id.
+    """
+    backfill_id = uuid.uuid4().hex
+    page_sizes = {"arxiv": arxiv_page_size, "google_patents": PATENT_PAGE_SIZE}
+    get_db_connection().backfill_runs.insert_one({
+        "_id": backfill_id, "plan": plan, "sources": list(sources), "started_at": datetime.utcnow(),
+        "completed_topics": [], "counters": {},
+    })
+    for entry in plan:
+        topic = entry["topic"]
+        pages = _page_counts(int(entry.get("max_per_source", 100)), arxiv_page_size)
+        fetches = [
+            fetch_page_task.s(backfill_id, topic, source, page, page_sizes[source], entry.get("from"), entry.get("to"))
+            for source in sources for page in range(pages[source])
+        ]
+        print(f"Backfill {backfill_id}: '{topic}' -> {len(fetches)} fetch tasks.")
+        chord(group(fetches), plan_analysis_task.s(backfill_id, topic, batch_size)).apply_async()
+    return backfill_id
+
+
+def backfill_status(backfill_id: str) -> dict:
+    run = get_db_connection().backfill_runs.find_one({"_id": backfill_id})
+    if run is None:
+        raise ValueError(f"Unknown backfill '{backfill_id}'.")
+    counters = run.get("counters", {})
+    end = run.get("finished_at") or datetime.utcnow()
+    elapsed = max((end - run["started_at"]).total_seconds(), 1e-9)
+    return {
+        "backfill_id": backfill_id,
+        "topics": len(run.get("plan", [])),
+        "completed_topics": run.get("completed_topics", []),
+        "finished": "finished_at" in run,
+        "failed_pages": run.get("failed_pages", []),
+        "elapsed_seconds": round(elapsed, 1),
+        "counters": counters,
+        "throughput": {
+            "pages_per_minute": round(counters.get("pages", 0) * 60 / elapsed, 2),
+            "documents_fetched_per_minute": round(counters.get("fetched", 0) * 60 / elapsed, 2),
+            "documents_analyzed_per_minute": round(counters.get("analyzed", 0) * 60 / elapsed, 2),
+        },
+    }
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Queue a multi-topic historical backfill on the Celery workers.")
+    parser.add_argument("--topic", action="append", default=[], help="Topic to backfill (repeatable).")
+    parser.add_argument("--plan", help="JSON file with a list of {topic, from, to, max_per_source} entries.")
+    parser.add_argument("--from", dest="date_from", help="Earliest date, YYYY-MM-DD.")
+    parser.add_argument("--to", dest="date_to", help="Latest date, YYYY-MM-DD.")
+    parser.add_argument("--max-per-source", type=int, default=100, help="Documents to fetch per topic and source.")
+    parser.add_argument("--sources", default=",".join(SOURCES), help="Comma-separated sources.")
+    parser.add_argument("--batch-size", type=int, default=None, help="Documents per analysis task.")
+    parser.add_argument("--status", help="Print progress and throughput of a backfill id.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = _parse_args(sys.argv[1:])
+    if args.status:
+        print(json.dumps(backfill_status(args.status), indent=2, default=str))
+        sys.exit(0)
+
+    if args.plan:
+        with open(args.plan) as f:
+            plan = json.load(f)
+    else:
+        plan = [{"topic": topic, "from": args.date_from, "to": args.date_to, "max_per_source": args.max_per_source}
+                for topic in args.topic]
+    if not plan:
+        sys.exit("Nothing to backfill: pass --topic or --plan.")
+    sources = tuple(s.strip() for s in args.sources.split(",") if s.strip())
+    unknown = [s for s in sources if s not in SOURCES]
+    if unknown:
+        sys.exit(f"Unknown source(s): {', '.join(unknown)}. Expected {', '.join(SOURCES)}.")
+
+    backfill_id = start_backfill(plan, sources=sources, batch_size=args.batch_size)
+    print(f"Queued backfill {backfill_id}. Follow it with: python backfill.py --status {backfill_id}")
@@ -0,0 +1,7 @@
+# benchmarks/__init__.py
+"""
+Offline benchmark suite: `python -m benchmarks --help`.
+
+Everything external is replaced by local stand-ins (benchmarks/fakes.py), so
+the suite needs neither Gemini quota nor network access nor a MongoDB server.
+"""
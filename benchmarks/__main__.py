@@ -0,0 +1,5 @@
+# benchmarks/__main__.py
+import sys
+from benchmarks.runner import main
+
+sys.exit(main())
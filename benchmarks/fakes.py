@@ -0,0 +1,170 @@
+# benchmarks/fakes.py
+"""
+Local stand-ins for Gemini, the arXiv API, Google Patents and MongoDB.
+
+Each use_* function patches the application modules in place, so it belongs
+in a benchmark process only, never in the API or a worker.
+"""
+
+import io
+import re
+import json
+import time
+import random
+import zlib
+import threading
+from google.api_core.exceptions import ResourceExhausted
+from benchmarks.fixtures import TECHNOLOGIES, arxiv_feed, patent_page
+
+BENCHMARK_DB_NAME = "aetos_benchmark"
+
+_DOC_ID_RE = re.compile(r"^\s*\[(doc_\d+)\]", re.MULTILINE)
+
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = None
+
+
+class FakeGeminiModel:
+    """
+    Answers analysis, batch-analysis and synthesis prompts with well-formed
+    JSON after `latency_ms` (+/- `jitter`). A share of calls fail:
+    `error_rate` with a generic error and `throttle_rate` with ResourceExhausted.
+    """
+
+    def __init__(self, latency_ms: float = 50, jitter: float = 0.2, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, seed: int = 0):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "errors": 0, "throttled": 0}
+
+    def _roll(self) -> tuple:
+        with self._lock:
+            self.counters["calls"] += 1
+            return self._random.random(), self._random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    @staticmethod
+    def _analysis(key: str) -> dict:
+        digest = zlib.crc32(key.encode("utf-8"))
+        technologies = [TECHNOLOGIES[(digest >> shift) % len(TECHNOLOGIES)] for shift in (0, 7, 14)]
+        return {
+            "TRL": digest % 9 + 1,
+            "TRL_justification": "Synthetic benchmark response.",
+            "strategic_summary": "Synthetic benchmark response.",
+            "technologies": list(dict.fromkeys(technologies)),
+            "key_relationships": [{"subject": technologies[0], "relationship": "enables", "object": technologies[1]}],
+            "country": "N/A",
+            "provider_company": "N/A",
+            "funding_details": "N/A",
+        }
+
+    def generate_content(self, prompt: str) -> _Response:
+        roll, scale = self._roll()
+        time.sleep(self.latency * scale)
+        if roll < self.throttle_rate:
+            self.counters["throttled"] += 1
+            raise ResourceExhausted("Synthetic quota error")
+        if roll < self.throttle_rate + self.error_rate:
+            self.counters["errors"] += 1
+            raise RuntimeError("Synthetic Gemini error")
+
+        doc_ids = _DOC_ID_RE.findall(prompt)
+        if doc_ids:
+            return _Response(json.dumps([{"doc_id": doc_id, **self._analysis(prompt + doc_id)} for doc_id in doc_ids]))
+        # Topic synthesis; the single-abstract analysis prompt asks for a "structured intelligence report"
+        if "comprehensive intelligence report" in prompt:
+            return _Response(json.dumps({"overall_summary": "Synthetic benchmark report.",
+                                         "emerging_signals": TECHNOLOGIES[:2], "key_players": ["N/A"]}))
+        return _Response(json.dumps(self._analysis(prompt)))
+
+
+def use_fake_gemini(**options) -> FakeGeminiModel:
+    """
+    Routes every Gemini call to one FakeGeminiModel. The LLM cache is turned
+    off so each analysis reaches the model. The shared rate limiter keeps a
+    per-process bucket with no effective limit and a short throttle cooldown.
+    """
+    import intelligence
+    from llm_cache import analysis_cache
+    from rate_limiter import gemini_limiter, _LocalState
+
+    model = FakeGeminiModel(**options)
+    intelligence.genai.configure = lambda **kwargs: None
+    intelligence.genai.GenerativeModel = lambda *args, **kwargs: model
+    analysis_cache.enabled = False
+    gemini_limiter._local = _LocalState()
+    gemini_limiter.rpm = gemini_limiter.tpm = 1e12
+    gemini_limiter.cooldown_ms = 1000
+    return model
+
+
+class _RawStream(io.BytesIO):
+    decode_content = False
+
+
+class _ArxivResponse:
+    def __init__(self, body: bytes):
+        self.raw = _RawStream(body)
+
+    def close(self):
+        self.raw.close()
+
+
+class FakeArxiv:
+    """Serves `total` results in arXiv API pages. Pages are built up front so timing covers parsing only."""
+
+    def __init__(self, total: int, page_size: int, latency_ms: float = 0):
+        self.total = total
+        self.latency = latency_ms / 1000.0
+        self.pages = {}
+        for start in range(0, total, page_size):
+            count = min(page_size, total - start)
+            self.pages[(start, count)] = arxiv_feed(start, count)
+        self.requests = 0
+
+    def __call__(self, params: dict) -> _ArxivResponse:
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        start = int(params["start"])
+        count = max(0, min(int(params["max_results"]), self.total - start))
+        body = self.pages.get((start, count))
+        return _ArxivResponse(body if body is not None else arxiv_feed(start, count))
+
+
+def use_fake_arxiv(total: int, page_size: int, latency_ms: float = 0) -> FakeArxiv:
+    import ingest
+    fake = FakeArxiv(total, page_size, latency_ms)
+    # Replaces the HTTP call, and with it the 3-second spacing between real requests
+    ingest._polite_get = fake
+    return fake
+
+
+def patent_pages(total: int, page_size: int = 10) -> list:
+    return [patent_page(start, min(page_size, total - start)) for start in range(0, total, page_size)]
+
+
+def use_mongo(uri: str = "mongomock"):
+    """
+    Points the application at an in-process mongomock server ("mongomock")
+    or at the given MongoDB URI, using a dedicated database that is dropped
+    first. Returns the database handle.
+    """
+    import mongo
+    if uri == "mongomock":
+        import mongomock
+        client = mongomock.MongoClient()
+        mongo.get_client = lambda: client
+    else:
+        mongo.MONGO_URI = uri
+        mongo._client = None
+    mongo.MONGO_DB_NAME = BENCHMARK_DB_NAME
+    mongo._indexes_ready = False
+    mongo.get_client().drop_database(BENCHMARK_DB_NAME)
+    return mongo.get_db()
@@ -0,0 +1,140 @@
+# benchmarks/fixtures.py
+"""
+Benchmark corpora, grown from the recorded responses in benchmarks/fixtures/.
+
+arXiv feeds and patent result pages are built by cloning the recorded entries
+and rewriting their ids, dates and part of their text. Every generated
+document is unique and survives near-duplicate detection, while the parsers
+still see production markup. analyzed_documents() builds documents as
+save_to_db receives them after analysis, for the storage, analytics and API
+benchmarks.
+"""
+
+import os
+import copy
+from datetime import datetime, timedelta
+from xml.etree import ElementTree as ET
+import numpy as np
+import pandas as pd
+from lxml import html as lxml_html
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+ARXIV_FIXTURE = os.path.join(FIXTURE_DIR, "arxiv_page.atom")
+PATENTS_FIXTURE = os.path.join(FIXTURE_DIR, "patents_page.html")
+TOPIC = "quantum cryptography"
+
+ATOM_NS = "http://www.w3.org/2005/Atom"
+ATOM = f"{{{ATOM_NS}}}"
+ET.register_namespace("", ATOM_NS)
+ET.register_namespace("opensearch", "http://a9.com/-/spec/opensearch/1.1/")
+ET.register_namespace("arxiv", "http://arxiv.org/schemas/atom")
+
+TECHNOLOGIES = [
+    "quantum key distribution", "post-quantum cryptography", "lattice-based cryptography", "photonic integrated circuits",
+    "single-photon detectors", "entangled photon sources", "satellite communication", "free-space optics",
+    "adaptive optics", "fpga", "error correction", "privacy amplification", "homomorphic encryption",
+    "trusted execution environments", "quantum random number generators", "optical fiber networks",
+    "superconducting nanowires", "silicon photonics", "machine learning", "side-channel analysis",
+    "hardware security modules", "5g networks", "software-defined networking", "quantum repeaters",
+    "quantum memory", "time-bin encoding", "continuous-variable qkd", "key encapsulation", "digital signatures",
+    "zero-knowledge proofs", "blockchain", "secure multiparty computation", "edge computing",
+    "internet of things", "radiation-hardened processors", "cubesats", "ground stations", "optical clocks",
+    "trapped ions", "neutral atoms",
+]
+
+FIRST_YEAR, LAST_YEAR = 2005, 2024
+
+
+def _rng(seed: int) -> np.random.Generator:
+    return np.random.default_rng(seed)
+
+
+def _sentence(rng: np.random.Generator, words: int = 18) -> str:
+    picks = rng.choice(len(TECHNOLOGIES), size=max(1, words // 3), replace=False)
+    return "This work also relates to " + ", ".join(TECHNOLOGIES[i] for i in picks) + "."
+
+
+def _publication_dates(rng: np.random.Generator, count: int) -> list:
+    """Dates on a logistic adoption curve, so S-curve fits have something to find."""
+    years = np.arange(FIRST_YEAR, LAST_YEAR + 1)
+    weights = 1.0 / (1.0 + np.exp(-0.45 * (years - 2017)))
+    chosen = rng.choice(years, size=count, p=weights / weights.sum())
+    days = rng.integers(0, 365, size=count)
+    return [datetime(int(year), 1, 1) + timedelta(days=int(day)) for year, day in zip(chosen, days)]
+
+
+def _technologies(rng: np.random.Generator) -> list:
+    # Zipf-like popularity, so a few technologies dominate the co-occurrence graph as in real corpora
+    ranks = np.arange(1, len(TECHNOLOGIES) + 1)
+    popularity = 1.0 / ranks
+    picks = rng.choice(len(TECHNOLOGIES), size=int(rng.integers(2, 7)), replace=False, p=popularity / popularity.sum())
+    return [TECHNOLOGIES[i] for i in picks]
+
+
+def arxiv_feed(start: int, count: int, seed: int = 0) -> bytes:
+    """An arXiv API response holding results start..start+count-1, newest first."""
+    feed = ET.parse(ARXIV_FIXTURE).getroot()
+    templates = feed.findall(f"{ATOM}entry")
+    for entry in templates:
+        feed.remove(entry)
+    rng = _rng(seed + start)
+    newest = datetime(LAST_YEAR, 12, 31)
+    for position in range(start, start + count):
+        entry = copy.deepcopy(templates[position % len(templates)])
+        arxiv_id = f"{2400 - position // 100000:04d}.{position % 100000:05d}"
+        entry.find(f"{ATOM}id").text = f"http://arxiv.org/abs/{arxiv_id}v1"
+        published = (newest - timedelta(hours=6 * position)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        entry.find(f"{ATOM}published").text = published
+        entry.find(f"{ATOM}updated").text = published
+        summary = entry.find(f"{ATOM}summary")
+        summary.text = f"{summary.text.strip()} {_sentence(rng)} Reference {position}."
+        feed.append(entry)
+    return ET.tostring(feed, encoding="utf-8", xml_declaration=True)
+
+
+def patent_page(start: int, count: int = 10, seed: int = 0) -> bytes:
+    """A Google Patents results page holding results start..start+count-1."""
+    root = lxml_html.fromstring(open(PATENTS_FIXTURE, "rb").read())
+    container = root.xpath("//search-results")[0]
+    templates = container.xpath("./search-result-item")
+    for item in templates:
+        container.remove(item)
+    rng = _rng(seed + start)
+    for position in range(start, start + count):
+        item = copy.deepcopy(templates[position % len(templates)])
+        number = f"US{11000000 + position}B2"
+        for link in item.xpath(".//a[starts-with(@href, '/patent/')]"):
+            link.set("href", f"/patent/{number}/en")
+        abstract = item.xpath(".//span[@id='htmlContent']")[0]
+        abstract.text = f"{abstract.text} {_sentence(rng)} Reference {position}."
+        container.append(item)
+    return lxml_html.tostring(root)
+
+
+def analyzed_documents(count: int, seed: int = 0) -> pd.DataFrame:
+    """Documents as save_to_db receives them after LLM analysis."""
+    rng = _rng(seed)
+    dates = _publication_dates(rng, count)
+    records = []
+    for i, published in enumerate(dates):
+        technologies = _technologies(rng)
+        maturity = (published.year - FIRST_YEAR) / (LAST_YEAR - FIRST_YEAR)
+        trl = int(np.clip(round(2 + 6 * maturity + rng.normal(0, 1.2)), 1, 9))
+        source = "arxiv" if i % 3 else "google_patents"
+        records.append({
+            "id": f"http://arxiv.org/abs/bench.{i:07d}v1" if source == "arxiv" else f"https://patents.google.com/patent/US{20000000 + i}A1/en",
+            "title": f"{TOPIC.title()} with {technologies[0]} ({i})",
+            "summary": f"We study {TOPIC} using {' and '.join(technologies)}. {_sentence(rng, 30)} Reference {i}.",
+            "published": published,
+            "authors": [f"Author {int(a)}" for a in rng.integers(0, 5000, size=int(rng.integers(1, 5)))],
+            "source": source,
+            "provider_company": "N/A",
+            "TRL": trl,
+            "TRL_justification": "Benchmark fixture.",
+            "strategic_summary": f"Advances {technologies[0]} for {TOPIC}.",
+            "technologies": technologies,
+            "key_relationships": [{"subject": technologies[0], "relationship": "enables", "object": technologies[1]}],
+            "country": "N/A",
+            "funding_details": "N/A",
+        })
+    return pd.DataFrame(records)
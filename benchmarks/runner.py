@@ -0,0 +1,334 @@
+# benchmarks/runner.py
+"""
+Runs the offline benchmarks and reports throughput, p50/p99 latency and peak RSS.
+
+    python -m benchmarks                                  # every benchmark, default corpus sizes, mongomock
+    python -m benchmarks --sizes 1000,10000,100000 --mongo mongodb://localhost:27017/
+    python -m benchmarks --only save_to_db --only api. --save baseline.json
+    python -m benchmarks --compare baseline.json --tolerance 0.25   # exits 1 on regressions
+
+Each (benchmark, size) pair runs in a fresh process, so peak RSS belongs to
+that benchmark alone and no state leaks between runs. mongomock grows
+roughly quadratically on bulk writes, so use a local mongod for large sizes.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import resource
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+DEFAULT_SIZES = "100,1000"
+TOPIC_PATH = "quantum%20cryptography"
+SAVE_CHUNK_SIZE = 500
+LLM_CHUNK_SIZE = 20
+
+# Benchmark processes must not touch the real services, whatever the local .env says
+BENCHMARK_ENV = {
+    "GEMINI_API_KEY": "benchmark",
+    "RATE_LIMIT_REDIS_URL": "redis://127.0.0.1:1/0",
+    "CELERY_BROKER_URL": "redis://127.0.0.1:1/0",
+    "CELERY_RESULT_BACKEND": "redis://127.0.0.1:1/0",
+}
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _timed(samples: list, items: int, fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    samples.append((items, time.perf_counter() - started))
+    return result
+
+
+# --- benchmarks: each takes (size, options) and returns (unit, [(items, seconds), ...]) ---
+
+def bench_arxiv_fetch(size, options):
+    """fetch_arxiv_data over recorded Atom pages: parsing, relevance filtering, paging."""
+    from benchmarks.fakes import use_fake_arxiv
+    from ingest import fetch_arxiv_data, ARXIV_PAGE_SIZE
+    from benchmarks.fixtures import TOPIC
+    use_fake_arxiv(size, ARXIV_PAGE_SIZE)
+    samples = []
+    for _ in range(options.repeats):
+        _timed(samples, size, fetch_arxiv_data, TOPIC, max_results=size)
+    return "docs", samples
+
+
+def bench_patent_parse(size, options):
+    """parse_patent_html over recorded result pages, 10 patents each."""
+    from benchmarks.fakes import patent_pages
+    from ingest_patents import parse_patent_html
+    pages = patent_pages(size)
+    samples = []
+    for page in pages:
+        patents = _timed(samples, 0, parse_patent_html, page)
+        samples[-1] = (len(patents), samples[-1][1])
+    return "docs", samples
+
+
+def bench_patent_parse_files(size, options):
+    """parse_patent_files over recorded result pages saved to disk, across worker processes."""
+    import tempfile
+    from benchmarks.fakes import patent_pages
+    from ingest_patents import parse_patent_files
+    samples = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i, page in enumerate(patent_pages(size)):
+            paths.append(os.path.join(directory, f"page_{i}.html"))
+            with open(paths[-1], "wb") as f:
+                f.write(page)
+        for _ in range(options.repeats):
+            patents = _timed(samples, 0, parse_patent_files, paths)
+            samples[-1] = (len(patents), samples[-1][1])
+    return "docs", samples
+
+
+def bench_llm_analysis(size, options):
+    """get_gemini_analysis_batch against the fake model, 20 abstracts per call."""
+    from benchmarks.fakes import use_fake_gemini
+    from benchmarks.fixtures import analyzed_documents
+    from intelligence import get_gemini_analysis_batch
+    use_fake_gemini(latency_ms=options.llm_latency_ms, error_rate=options.llm_error_rate,
+                    throttle_rate=options.llm_throttle_rate)
+    texts = analyzed_documents(size)["summary"].tolist()
+    samples = []
+    for start in range(0, len(texts), LLM_CHUNK_SIZE):
+        chunk = texts[start:start + LLM_CHUNK_SIZE]
+        _timed(samples, len(chunk), get_gemini_analysis_batch, chunk)
+    return "docs", samples
+
+
+def _save_chunks(df, samples=None):
+    from database import save_to_db
+    from benchmarks.fixtures import TOPIC
+    for start in range(0, len(df), SAVE_CHUNK_SIZE):
+        chunk = df.iloc[start:start + SAVE_CHUNK_SIZE]
+        if samples is None:
+            save_to_db(chunk, topic=TOPIC)
+        else:
+            _timed(samples, len(chunk), save_to_db, chunk, topic=TOPIC)
+
+
+def bench_save_to_db(size, options):
+    """save_to_db of new documents, including co-occurrence and cache upkeep."""
+    from benchmarks.fakes import use_mongo
+    from benchmarks.fixtures import analyzed_documents
+    use_mongo(options.mongo)
+    df = analyzed_documents(size)
+    samples = []
+    _save_chunks(df, samples)
+    return "docs", samples
+
+
+def bench_save_to_db_unchanged(size, options):
+    """save_to_db of documents that did not change, the common case for incremental runs."""
+    from benchmarks.fakes import use_mongo
+    from benchmarks.fixtures import analyzed_documents
+    use_mongo(options.mongo)
+    df = analyzed_documents(size)
+    _save_chunks(df)
+    samples = []
+    _save_chunks(df, samples)
+    return "docs", samples
+
+
+def _analytics_bench(fn_name):
+    def bench(size, options):
+        import analytics
+        from benchmarks.fixtures import analyzed_documents
+        df = analyzed_documents(size)
+        fn = getattr(analytics, fn_name)
+        samples = []
+        for _ in range(options.repeats):
+            _timed(samples, size, fn, df)
+        return "docs", samples
+    bench.__doc__ = f"analytics.{fn_name} over an in-memory corpus."
+    return bench
+
+
+def bench_s_curve_forecast(size, options):
+    """calculate_s_curve followed by forecast_s_curve."""
+    from analytics import calculate_s_curve, forecast_s_curve
+    from benchmarks.fixtures import analyzed_documents
+    df = analyzed_documents(size)
+    samples = []
+    for _ in range(options.repeats):
+        _timed(samples, size, lambda: forecast_s_curve(calculate_s_curve(df)))
+    return "docs", samples
+
+
+def _api_bench(path):
+    def bench(size, options):
+        from benchmarks.fakes import use_mongo, use_fake_gemini
+        from benchmarks.fixtures import analyzed_documents
+        use_mongo(options.mongo)
+        use_fake_gemini(latency_ms=options.llm_latency_ms)
+        _save_chunks(analyzed_documents(size))
+        from api import create_app
+        app = create_app()
+        app.testing = True  # server errors propagate, so the report names the cause instead of "HTTP 500"
+        client = app.test_client()
+        samples = []
+        for _ in range(options.requests):
+            _timed(samples, 1, client.get, path)
+        return "requests", samples
+    bench.__doc__ = f"GET {path} through the Flask test client."
+    return bench
+
+
+BENCHMARKS = {
+    "arxiv_fetch": bench_arxiv_fetch,
+    "patent_parse": bench_patent_parse,
+    "patent_parse_files": bench_patent_parse_files,
+    "llm_analysis": bench_llm_analysis,
+    "save_to_db": bench_save_to_db,
+    "save_to_db_unchanged": bench_save_to_db_unchanged,
+    "convergence": _analytics_bench("find_technology_convergence"),
+    "analytics.centrality": _analytics_bench("technology_centrality"),
+    "analytics.emerging": _analytics_bench("find_emerging_convergence"),
+    "analytics.trl_progression": _analytics_bench("calculate_trl_progression"),
+    "analytics.s_curve": bench_s_curve_forecast,
+    "api.documents": _api_bench(f"/api/documents/{TOPIC_PATH}?match=prefix&limit=50&fields=title,TRL"),
+    "api.convergence": _api_bench(f"/api/analytics/convergence/{TOPIC_PATH}?match=prefix"),
+    "api.centrality": _api_bench(f"/api/analytics/centrality/{TOPIC_PATH}?match=prefix"),
+    "api.emerging": _api_bench(f"/api/analytics/emerging/{TOPIC_PATH}?match=prefix"),
+    "api.scurve": _api_bench(f"/api/analytics/scurve/{TOPIC_PATH}?match=prefix"),
+    "api.trl_progression": _api_bench(f"/api/analytics/trl_progression/{TOPIC_PATH}?match=prefix"),
+    "api.synthesis": _api_bench(f"/api/analytics/synthesis/{TOPIC_PATH}?match=prefix"),
+}
+
+
+def _summarize(name: str, size: int, unit: str, samples: list) -> dict:
+    latencies = np.array([seconds for _, seconds in samples]) * 1000
+    items = sum(count for count, _ in samples)
+    total = float(latencies.sum()) / 1000
+    return {
+        "benchmark": name, "size": size, "unit": unit, "ops": len(samples),
+        "throughput": round(items / total, 1) if total else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3) if len(latencies) else None,
+    }
+
+
+def run_benchmark(name: str, size: int, options) -> dict:
+    """Runs one benchmark in the current process. Application output is captured unless --verbose."""
+    os.environ.update(BENCHMARK_ENV)
+    if not options.embeddings:
+        os.environ["EMBEDDINGS_ENABLED"] = "0"
+    output = io.StringIO()
+    redirect = contextlib.ExitStack()
+    if not options.verbose:
+        redirect.enter_context(contextlib.redirect_stdout(output))
+        redirect.enter_context(contextlib.redirect_stderr(output))
+    try:
+        with redirect:
+            unit, samples = BENCHMARKS[name](size, options)
+        result = _summarize(name, size, unit, samples)
+    except Exception as e:
+        result = {"benchmark": name, "size": size, "error": f"{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"}
+    result["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+    return result
+
+
+def _run_isolated(name: str, size: int, options) -> dict:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_benchmark, name, size, options).result()
+
+
+def _format_table(results: list) -> str:
+    header = f"{'benchmark':<28}{'size':>8}  {'throughput':>16}{'p50 ms':>11}{'p99 ms':>11}{'ops':>6}{'peak RSS MB':>13}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        if "error" in r:
+            lines.append(f"{r['benchmark']:<28}{r['size']:>8}  ERROR {r['error']}")
+            continue
+        throughput = f"{r['throughput']} {r['unit']}/s" if r["throughput"] is not None else "-"
+        lines.append(f"{r['benchmark']:<28}{r['size']:>8}  {throughput:>16}{r['p50_ms']:>11}{r['p99_ms']:>11}"
+                     f"{r['ops']:>6}{r['peak_rss_mb']:>13}")
+    return "\n".join(lines)
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """Regressions against a saved run: p50 slower, throughput lower or peak RSS higher by more than `tolerance`."""
+    previous = {(r["benchmark"], r["size"]): r for r in baseline if "error" not in r}
+    regressions = []
+    for r in results:
+        old = previous.get((r["benchmark"], r["size"]))
+        if old is None or "error" in r:
+            continue
+        checks = [("p50_ms", r["p50_ms"] > old["p50_ms"] * (1 + tolerance)),
+                  ("throughput", r["throughput"] < old["throughput"] * (1 - tolerance)),
+                  ("peak_rss_mb", r["peak_rss_mb"] > old["peak_rss_mb"] * (1 + tolerance))]
+        for metric, regressed in checks:
+            if regressed:
+                regressions.append(f"{r['benchmark']} @ {r['size']}: {metric} {old[metric]} -> {r[metric]}")
+    return regressions
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Offline AETOS benchmarks.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated corpus sizes.")
+    parser.add_argument("--only", action="append", default=[],
+                        help="Run benchmarks whose name starts with this prefix (repeatable).")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit.")
+    parser.add_argument("--mongo", default="mongomock", help='"mongomock" or a MongoDB URI, e.g. mongodb://localhost:27017/')
+    parser.add_argument("--repeats", type=int, default=5, help="Repetitions of whole-corpus operations.")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per API benchmark.")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="Latency of the fake Gemini model.")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Share of fake Gemini calls that fail.")
+    parser.add_argument("--llm-throttle-rate", type=float, default=0.0,
+                        help="Share of fake Gemini calls that raise ResourceExhausted.")
+    parser.add_argument("--embeddings", action="store_true", help="Embed documents on save (needs sentence-transformers).")
+    parser.add_argument("--in-process", action="store_true", help="Run everything in this process (RSS is then cumulative).")
+    parser.add_argument("--verbose", action="store_true", help="Show application output.")
+    parser.add_argument("--save", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="Compare against results saved with --save.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative change before --compare fails.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    options = _parse_args(sys.argv[1:] if argv is None else argv)
+    if options.list:
+        for name, bench in BENCHMARKS.items():
+            print(f"{name:<28}{(bench.__doc__ or '').strip()}")
+        return 0
+    names = [name for name in BENCHMARKS if not options.only or any(name.startswith(p) for p in options.only)]
+    sizes = [int(size) for size in options.sizes.split(",") if size.strip()]
+
+    results = []
+    print("\n".join(_format_table([]).splitlines()))
+    for name in names:
+        for size in sizes:
+            result = run_benchmark(name, size, options) if options.in_process else _run_isolated(name, size, options)
+            results.append(result)
+            print(_format_table([result]).splitlines()[-1], flush=True)
+
+    print()
+    print(_format_table(results))
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {options.save}")
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {options.tolerance:.0%}:")
+            print("\n".join(f"  {line}" for line in regressions))
+            return 1
+        print(f"\nNo regressions beyond {options.tolerance:.0%} against {options.compare}.")
+    return 0
@@ -0,0 +1,157 @@
+# browser_pool.py
+"""
+Bounded pool of warm headless Chrome sessions for Selenium scraping.
+
+Launching Chrome costs seconds and hundreds of MB, so sessions are kept
+alive between fetches. A session is health-checked before it is handed out,
+retired after a fixed number of page loads (Chrome's memory creeps up over a
+long-lived session), and discarded if the caller's block raised. At most
+`max_size` sessions exist at any time; callers beyond that wait for one.
+"""
+
+import os
+import atexit
+import queue
+import threading
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+
+def default_chrome_options() -> Options:
+    # Selenium setup (headless for efficiency)
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument(f"--user-agent={USER_AGENT}")
+    return options
+
+
+class BrowserPool:
+    def __init__(self, max_size: int = None, max_pages_per_session: int = None,
+                 acquire_timeout: float = 300, options_factory=default_chrome_options):
+        self.max_size = max(1, max_size or int(os.getenv("PATENT_BROWSER_POOL_SIZE", 2)))
+        self.max_pages_per_session = max(1, max_pages_per_session or int(os.getenv("PATENT_BROWSER_MAX_PAGES", 50)))
+        self.acquire_timeout = acquire_timeout
+        self.options_factory = options_factory
+        self._idle = queue.LifoQueue()  # most recently used first, so warm sessions are reused
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        self._pages = {}
+        self._closed = False
+        self.counters = {"launched": 0, "reused": 0, "recycled": 0, "unhealthy": 0, "discarded": 0}
+
+    def _launch(self):
+        driver = webdriver.Chrome(options=self.options_factory())
+        driver.set_page_load_timeout(30)
+        with self._lock:
+            self._pages[id(driver)] = 0
+            self.counters["launched"] += 1
+        return driver
+
+    def _quit(self, driver):
+        with self._lock:
+            self._pages.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_healthy(driver) -> bool:
+        try:
+            return driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def _checkout(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                return self._launch()
+            if self._is_healthy(driver):
+                with self._lock:
+                    self.counters["reused"] += 1
+                return driver
+            with self._lock:
+                self.counters["unhealthy"] += 1
+            self._quit(driver)
+
+    def _checkin(self, driver, broken: bool):
+        with self._lock:
+            self._pages[id(driver)] = self._pages.get(id(driver), 0) + 1
+            pages = self._pages[id(driver)]
+        if broken or self._closed:
+            with self._lock:
+                self.counters["discarded"] += 1
+            self._quit(driver)
+        elif pages >= self.max_pages_per_session:
+            with self._lock:
+                self.counters["recycled"] += 1
+            self._quit(driver)
+        else:
+            self._idle.put(driver)
+
+    @contextmanager
+    def session(self):
+        """Yields a ready WebDriver for one page load; it goes back to the pool afterwards."""
+        if self._closed:
+            raise RuntimeError("Browser pool is closed.")
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"No browser session became available within {self.acquire_timeout}s.")
+        driver = None
+        broken = False
+        try:
+            driver = self._checkout()
+            yield driver
+        except Exception:
+            broken = True
+            raise
+        finally:
+            if driver is not None:
+                self._checkin(driver, broken)
+            self._slots.release()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(driver)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["open_sessions"] = len(self._pages)
+        stats["idle_sessions"] = self._idle.qsize()
+        stats["max_size"] = self.max_size
+        return stats
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    """The process-wide pool, created on first use (and again in forked children)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = BrowserPool()
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _close_pool():
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+
+
+atexit.register(_close_pool)
@@ -0,0 +1,16 @@
+# celery_app.py
+"""
+The Celery application, without any tasks attached.
+
+Tasks live in worker.py and backfill.py, which only the worker process
+imports (through `include`). The API enqueues them by name with send_task and
+reads their results through this app, so it never loads the pipeline, Selenium,
+Gemini or pandas.
+"""
+
+import os
+from celery import Celery
+
+celery_app = Celery('aetos_tasks', include=['worker', 'backfill'], broker=os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"), backend=os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0"))
+# STARTED lets /api/jobs tell a queued job from a running one
+celery_app.conf.task_track_started = True
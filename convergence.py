@@ -0,0 +1,115 @@
+# convergence.py
+"""
+Materialized technology co-occurrence counts.
+
+Every pair of technologies mentioned by the same document is counted once per
+topic the document was ingested under, plus once under GLOBAL_TOPIC. The
+counts live in the tech_cooccurrence collection, one row per
+(topic, tech_1, tech_2). save_to_db adjusts them by the difference between a
+document's previous and new technologies, so nothing is ever recounted. Top-k
+queries read a handful of rows from the (topic, weight) index rather than
+rebuilding a graph from every matching document.
+
+`python convergence.py --rebuild` recomputes the collection from scratch.
+"""
+
+import sys
+from collections import Counter
+from itertools import combinations
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+COLLECTION = "tech_cooccurrence"
+GLOBAL_TOPIC = "*"
+
+
+def topic_key(topic: str) -> str:
+    return (topic or "").strip().lower()
+
+
+def technology_pairs(technologies) -> list:
+    if not isinstance(technologies, (list, tuple)):
+        return []
+    names = sorted({str(t).strip() for t in technologies if t is not None and str(t).strip()})
+    return list(combinations(names, 2))
+
+
+def _contributions(technologies, topics) -> Counter:
+    counts = Counter()
+    pairs = technology_pairs(technologies)
+    if not pairs:
+        return counts
+    for topic in {GLOBAL_TOPIC, *(topic_key(t) for t in topics or [])}:
+        for tech_1, tech_2 in pairs:
+            counts[(topic, tech_1, tech_2)] += 1
+    return counts
+
+
+def ensure_convergence_indexes(db, collection: str = COLLECTION):
+    db[collection].create_index([("topic", ASCENDING), ("tech_1", ASCENDING), ("tech_2", ASCENDING)],
+                                unique=True, name="pair_unique")
+    db[collection].create_index([("topic", ASCENDING), ("weight", DESCENDING)], name="topic_weight")
+
+
+def apply_document_changes(db, changes: list) -> int:
+    """
+    Applies co-occurrence deltas for a batch of document writes.
+
+    `changes` holds (old, new) pairs of (technologies, topics) tuples; old is
+    None for new documents. Returns the number of pair rows touched.
+    """
+    delta = Counter()
+    for old, new in changes:
+        delta.update(_contributions(*new))
+        if old is not None:
+            delta.subtract(_contributions(*old))
+    delta = {key: weight for key, weight in delta.items() if weight}
+    if not delta:
+        return 0
+
+    collection = db[COLLECTION]
+    ops = [
+        UpdateOne({"topic": topic, "tech_1": tech_1, "tech_2": tech_2}, {"$inc": {"weight": weight}}, upsert=True)
+        for (topic, tech_1, tech_2), weight in delta.items()
+    ]
+    collection.bulk_write(ops, ordered=False)
+    if any(weight < 0 for weight in delta.values()):
+        collection.delete_many({"weight": {"$lte": 0}})
+    return len(ops)
+
+
+def top_convergences(db, topic: str = None, top_n: int = 10) -> list:
+    """Strongest co-occurring technology pairs for a topic (or overall), in find_technology_convergence's format."""
+    key = topic_key(topic) or GLOBAL_TOPIC
+    cursor = (db[COLLECTION]
+              .find({"topic": key}, {"_id": 0, "tech_1": 1, "tech_2": 1, "weight": 1})
+              .sort([("weight", DESCENDING)])
+              .limit(top_n))
+    return [{"tech_1": row["tech_1"], "tech_2": row["tech_2"], "strength": row["weight"]} for row in cursor]
+
+
+def rebuild(db, chunk_size: int = 1000) -> int:
+    """Recounts every pair from the documents collection and swaps the result in."""
+    counts = Counter()
+    cursor = db.documents.find({"technologies.1": {"$exists": True}}, {"technologies": 1, "topics": 1})
+    for doc in cursor:
+        counts.update(_contributions(doc.get("technologies"), doc.get("topics")))
+
+    staging = db[f"{COLLECTION}_rebuild"]
+    staging.drop()
+    ensure_convergence_indexes(db, staging.name)
+    rows = [{"topic": topic, "tech_1": tech_1, "tech_2": tech_2, "weight": weight}
+            for (topic, tech_1, tech_2), weight in counts.items()]
+    for start in range(0, len(rows), chunk_size):
+        staging.insert_many(rows[start:start + chunk_size], ordered=False)
+    if rows:
+        staging.rename(COLLECTION, dropTarget=True)
+    else:
+        db[COLLECTION].delete_many({})
+        staging.drop()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    if "--rebuild" in sys.argv:
+        from mongo import get_db
+        print(f"Rebuilt {COLLECTION} with {rebuild(get_db())} technology pairs.")
@@ -1,50 +1,164 @@
 import os
-from pymongo import MongoClient, ASCENDING
+from pymongo import UpdateOne
 from dotenv import load_dotenv
 import pandas as pd
 from datetime import datetime
+from mongo import get_db
+from search import search_terms_for
+from convergence import topic_key, apply_document_changes
+from synthesis_cache import synthesis_cache
+from embeddings import update_embeddings, sync_index
+from metrics import stage_timer
 
 load_dotenv()
 
+BULK_CHUNK_SIZE = int(os.getenv("DB_BULK_CHUNK_SIZE", 1000))
+
+class SaveError(Exception):
+    """Raised by save_to_db when some documents were not written. `failed_ids` lists them."""
+
+    def __init__(self, message: str, failed_ids, saved_count: int = 0):
+        super().__init__(message)
+        self.failed_ids = set(failed_ids)
+        self.saved_count = saved_count
+
 def get_db_connection():
-    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-    client = MongoClient(mongo_uri)
-    db = client.aetos_db
-    
-    db.documents.create_index([("title", ASCENDING)])
-    db.documents.create_index([("technologies", ASCENDING)])
-    db.documents.create_index([("published", ASCENDING)])
-    db.documents.create_index([("source", ASCENDING)])
-    
-    return db
-
-def save_to_db(df: pd.DataFrame) -> int:
+    """Returns the aetos_db handle from the shared, pooled connection manager."""
+    return get_db()
+
+def _prepare_records(df: pd.DataFrame) -> list:
+    records = df.to_dict('records')
+    now = datetime.utcnow()
+    for record in records:
+        record['updated_at'] = now
+        if 'authors' in record and isinstance(record['authors'], list):
+            record['authors'] = [str(a) for a in record['authors']]
+        record['search_terms'] = search_terms_for(record)
+    return records
+
+def _upsert_pipeline(fields: dict, updated_at: datetime) -> list:
+    """
+    Update pipeline that writes `fields` and bumps updated_at only if a value
+    actually changed, so modified_count tells changed and unchanged documents apart.
+    """
+    unchanged = {'$and': [{'$eq': [f'${key}', {'$literal': value}]} for key, value in fields.items()]}
+    return [
+        {'$set': {'updated_at': {'$cond': [unchanged, '$updated_at', updated_at]}}},
+        {'$set': {key: {'$literal': value} for key, value in fields.items()}},
+    ]
+
+def bulk_upsert_documents(records: list, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """
+    Upserts records by `id` with one unordered bulk_write per chunk.
+
+    Returns an inserted/modified/unchanged/failed breakdown, plus the ids of
+    the records that were not written under failed_ids. Records without an id
+    are counted as failed and never sent.
+    """
+    db = get_db_connection()
+    summary = {"inserted": 0, "modified": 0, "unchanged": 0, "failed": 0, "failed_ids": []}
+    chunk_size = max(1, chunk_size)
+
+    ops = []
+    op_ids = []
+    for record in records:
+        if record.get('id') is None:
+            summary["failed"] += 1
+            continue
+        fields = {k: v for k, v in record.items() if k not in ('updated_at', '_id')}
+        ops.append(UpdateOne({'id': record['id']}, _upsert_pipeline(fields, record.get('updated_at')), upsert=True))
+        op_ids.append(record['id'])
+
+    for start in range(0, len(ops), chunk_size):
+        chunk = ops[start:start + chunk_size]
+        try:
+            result = db.documents.bulk_write(chunk, ordered=False)
+        except Exception as e:
+            details = getattr(e, 'details', None) or {}
+            write_errors = details.get('writeErrors', [])
+            summary["failed"] += len(write_errors) if write_errors else len(chunk)
+            # Error indexes are positions within the chunk; without them the whole chunk is in doubt
+            failed = [error['index'] for error in write_errors] if write_errors else range(len(chunk))
+            summary["failed_ids"].extend(op_ids[start + i] for i in failed)
+            summary["inserted"] += details.get('nUpserted', 0)
+            summary["modified"] += details.get('nModified', 0)
+            matched = details.get('nMatched', 0)
+            summary["unchanged"] += max(0, matched - details.get('nModified', 0))
+            print(f"Error in bulk write chunk starting at {start}: {e}")
+            continue
+        summary["inserted"] += result.upserted_count
+        summary["modified"] += result.modified_count
+        summary["unchanged"] += result.matched_count - result.modified_count
+
+    return summary
+
+def _convergence_changes(db, records: list, topic: str = None) -> list:
+    """
+    Old and new (technologies, topics) of each record, read in one query before
+    the write. With a topic, it is added to each record's `topics`.
+    """
+    ids = [r['id'] for r in records if r.get('id') is not None]
+    projection = {'_id': 0, 'id': 1, 'technologies': 1, 'topics': 1}
+    stored = {doc['id']: doc for doc in db.documents.find({'id': {'$in': ids}}, projection)}
+    key = topic_key(topic)
+    changes = []
+    for record in records:
+        if record.get('id') is None:
+            continue
+        previous = stored.get(record['id'])
+        old_topics = list(previous.get('topics', [])) if previous else []
+        topics = old_topics + [key] if key and key not in old_topics else old_topics
+        if key:
+            record['topics'] = topics
+        technologies = record['technologies'] if 'technologies' in record else (previous or {}).get('technologies')
+        old = (previous.get('technologies'), old_topics) if previous else None
+        changes.append((old, (technologies, topics)))
+    return changes
+
+def save_to_db(df: pd.DataFrame, chunk_size: int = BULK_CHUNK_SIZE, topic: str = None) -> int:
+    """
+    Upserts documents and keeps the technology co-occurrence counts in step.
+    `topic` is the topic the documents were ingested for, if any. Returns the
+    number of documents inserted or changed. Raises SaveError if any document
+    was not written, so callers can tell which ones to retry.
+    """
     if df.empty:
         print("No data to save")
         return 0
-    
+
     try:
+        records = _prepare_records(df)
         db = get_db_connection()
-        records = df.to_dict('records')
-        
-        for record in records:
-            record['updated_at'] = datetime.utcnow()
-            if 'authors' in record and isinstance(record['authors'], list):
-                record['authors'] = [str(a) for a in record['authors']]
-        
-        inserted_count = 0
-        for record in records:
-            result = db.documents.update_one(
-                {'id': record['id']},
-                {'$set': record},
-                upsert=True
-            )
-            if result.upserted_id or result.modified_count > 0:
-                inserted_count += 1
-        
-        print(f"Successfully saved/updated {inserted_count} documents to database")
-        return inserted_count
-        
+        with stage_timer("db_write", source="mongodb"):
+            changes = _convergence_changes(db, records, topic)
+            summary = bulk_upsert_documents(records, chunk_size=chunk_size)
+        if summary["failed"]:
+            print("Skipped co-occurrence update after failed writes; run `python convergence.py --rebuild` to resync.")
+        else:
+            try:
+                apply_document_changes(db, changes)
+            except Exception as e:
+                print(f"Error updating technology co-occurrence: {e}")
+        saved_count = summary["inserted"] + summary["modified"]
+        if saved_count:
+            try:
+                synthesis_cache.invalidate_all()
+            except Exception as e:
+                print(f"Error invalidating the synthesis cache: {e}")
+            try:
+                if update_embeddings(db, records):
+                    # Rate-limited by EMBEDDING_SYNC_SECONDS; the API only reads the index
+                    sync_index(db)
+            except Exception as e:
+                print(f"Error updating document embeddings: {e}")
+        print(f"Successfully saved/updated {saved_count} documents to database "
+              f"(inserted={summary['inserted']}, modified={summary['modified']}, "
+              f"unchanged={summary['unchanged']}, failed={summary['failed']})")
     except Exception as e:
         print(f"Error saving to database: {e}")
-        return 0
\ No newline at end of file
+        ids = df['id'].dropna().tolist() if 'id' in df.columns else []
+        raise SaveError(str(e), ids) from e
+    if summary["failed"]:
+        raise SaveError(f"{summary['failed']} of {len(records)} documents were not written.",
+                        summary["failed_ids"], saved_count)
+    return saved_count
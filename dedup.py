@@ -0,0 +1,154 @@
+# dedup.py
+"""
+Near-duplicate detection for abstracts, run before LLM analysis.
+
+Each abstract gets a MinHash signature over its word shingles. Signatures are
+split into LSH bands, and documents sharing a band are compared on their
+estimated Jaccard similarity. A document that clears DEDUP_THRESHOLD against
+an earlier one is linked to that document's canonical id and reuses its
+analysis instead of being sent to Gemini again. Signatures and band keys are
+stored in the doc_signatures collection, so duplicates are also caught across
+runs.
+"""
+
+import os
+import re
+import zlib
+import hashlib
+import threading
+from datetime import datetime
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 16  # 16 bands x 8 rows: pairs above ~0.7 Jaccard almost always share a band
+ROWS_PER_BAND = NUM_PERMUTATIONS // NUM_BANDS
+SHINGLE_SIZE = 3
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", 0.8))
+
+_PRIME = 4294967311  # smallest prime above 2**32
+_rng = np.random.default_rng(20240601)  # fixed seed: signatures must match across processes and runs
+_A = _rng.integers(1, 2 ** 31, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 31, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    words = _WORD_RE.findall((text or "").lower())
+    if len(words) < size:
+        shingles = {" ".join(words)} if words else set()
+    else:
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    hashes = shingle_hashes(text)
+    if hashes.size == 0:
+        return np.full(NUM_PERMUTATIONS, _PRIME, dtype=np.uint64)
+    # a < 2**31 and h < 2**32, so a*h + b stays well inside uint64
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def band_keys(signature: np.ndarray) -> list:
+    keys = []
+    for band in range(NUM_BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(rows.tobytes(), digest_size=8).hexdigest()
+        keys.append(f"{band}:{digest}")
+    return keys
+
+
+def estimated_jaccard(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    return float(np.mean(sig_a == sig_b))
+
+
+class NearDuplicateIndex:
+    """MinHash/LSH index over abstracts, persisted in MongoDB."""
+
+    def __init__(self, collection_name: str = "doc_signatures", threshold: float = DEDUP_THRESHOLD):
+        self.collection_name = collection_name
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._collection = None
+
+    def _get_collection(self):
+        if self._collection is None:
+            from database import get_db_connection
+            collection = get_db_connection()[self.collection_name]
+            collection.create_index([("bands", ASCENDING)])
+            self._collection = collection
+        return self._collection
+
+    def assign(self, records: list, text_field: str = "summary") -> tuple:
+        """
+        Splits records into (canonical, duplicates). Each duplicate is returned
+        as (record, canonical_id). All signatures are persisted so later batches
+        and later runs match against them.
+        """
+        if not records:
+            return [], []
+        with self._lock:
+            collection = self._get_collection()
+            signatures = [minhash_signature(r.get(text_field) or "") for r in records]
+            keys = [band_keys(sig) for sig in signatures]
+
+            # One round trip for every stored signature sharing a band with this batch
+            stored = {}
+            all_keys = list({k for doc_keys in keys for k in doc_keys})
+            for doc in collection.find({"bands": {"$in": all_keys}}, {"signature": 1, "canonical_id": 1, "bands": 1}):
+                stored[doc["_id"]] = (np.array(doc["signature"], dtype=np.uint64), doc.get("canonical_id") or doc["_id"], doc["bands"])
+
+            buckets = {}
+            for doc_id, (_, _, doc_bands) in stored.items():
+                for key in doc_bands:
+                    buckets.setdefault(key, set()).add(doc_id)
+            signature_of = {doc_id: sig for doc_id, (sig, _, _) in stored.items()}
+            canonical_of = {doc_id: canonical for doc_id, (_, canonical, _) in stored.items()}
+
+            canonical, duplicates, ops = [], [], []
+            now = datetime.utcnow()
+            for record, sig, doc_keys in zip(records, signatures, keys):
+                doc_id = record["id"]
+                best_id, best_score = None, 0.0
+                candidates = set().union(*(buckets.get(k, ()) for k in doc_keys)) - {doc_id}
+                for candidate in candidates:
+                    score = estimated_jaccard(sig, signature_of[candidate])
+                    if score > best_score:
+                        best_id, best_score = candidate, score
+
+                if best_id is not None and best_score >= self.threshold and canonical_of[best_id] != doc_id:
+                    canonical_id = canonical_of[best_id]
+                    duplicates.append((record, canonical_id))
+                else:
+                    canonical_id = doc_id
+                    canonical.append(record)
+
+                signature_of[doc_id] = sig
+                canonical_of[doc_id] = canonical_id
+                for key in doc_keys:
+                    buckets.setdefault(key, set()).add(doc_id)
+                ops.append(UpdateOne(
+                    {"_id": doc_id},
+                    {"$set": {"signature": [int(v) for v in sig], "bands": doc_keys, "canonical_id": canonical_id,
+                              "updated_at": now}},
+                    upsert=True,
+                ))
+
+            if ops:
+                collection.bulk_write(ops, ordered=False)
+            return canonical, duplicates
+
+
+def load_canonical_analyses(ids: list, fields: tuple) -> dict:
+    """Stored analyses (TRL > 0) of canonical documents, keyed by id."""
+    if not ids:
+        return {}
+    from database import get_db_connection
+    projection = {"_id": 0, "id": 1, **{field: 1 for field in fields}}
+    cursor = get_db_connection().documents.find({"id": {"$in": list(ids)}, "TRL": {"$gt": 0}}, projection)
+    return {doc.pop("id"): doc for doc in cursor}
+
+
+dedup_index = NearDuplicateIndex()
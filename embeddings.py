@@ -0,0 +1,458 @@
+# embeddings.py
+"""
+Semantic document search over sentence embeddings.
+
+save_to_db embeds every document whose title or summary changed and stores
+the vector as float16 bytes in the document_embeddings collection. That
+collection is the source of truth, so any worker can write to it.
+
+Queries are answered from an index in EMBEDDING_INDEX_DIR, which workers and
+API processes must share (same host or a shared volume):
+
+- vectors.f16    memory-mapped float16 matrix, one L2-normalized row per vector
+- lists.i32      the inverted list (IVF cluster) each row belongs to
+- ids.txt        document id and text hash of each row
+- centroids.npy  IVF centroids, trained once enough vectors exist
+- meta.json      row count, capacity, sync watermark; written last, so a crash mid-append is harmless
+
+A query scores the centroids, then only the rows of the EMBEDDING_NPROBE
+closest lists, so it reads a small slice of the matrix. sync() appends
+vectors written since the last sync and places them in the list of their
+nearest centroid, retraining the centroids as the index grows. A re-embedded
+document gets a new row and its old row is skipped at query time.
+
+Only workers sync: save_to_db does at most every EMBEDDING_SYNC_SECONDS,
+and every analysis run ends with one. The API never takes the writers'
+lock or reads document_embeddings. refresh() just rereads meta.json
+when it has changed and maps the rows added since.
+
+`python embeddings.py --backfill` embeds documents saved before embeddings
+existed. `python embeddings.py --sync` brings the index up to date.
+`python embeddings.py --rebuild` rebuilds the index from MongoDB, dropping
+superseded rows and retraining the centroids.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+from bson.binary import Binary
+from pymongo import ASCENDING, UpdateOne
+
+COLLECTION = "document_embeddings"
+EMBEDDINGS_ENABLED = os.getenv("EMBEDDINGS_ENABLED", "1") != "0"
+EMBEDDING_INDEX_DIR = os.getenv("EMBEDDING_INDEX_DIR", "embedding_index")
+EMBEDDING_NPROBE = int(os.getenv("EMBEDDING_NPROBE", 8))
+EMBEDDING_SYNC_SECONDS = float(os.getenv("EMBEDDING_SYNC_SECONDS", 30))
+SYNC_OVERLAP_SECONDS = 300  # re-reads vectors written just before the watermark by slow or clock-skewed workers
+IVF_MIN_VECTORS = 20000  # below this a flat scan is as fast as probing lists
+RETRAIN_GROWTH = 4  # retrain the centroids once the index is this many times larger than at training
+MAX_LISTS = 4096
+TRAINING_ROWS_PER_LIST = 64
+MIN_CAPACITY = 65536
+SCAN_CHUNK_ROWS = 65536
+
+_unavailable = False
+_indexes_ready = False
+
+
+def embedding_text(record: dict) -> str:
+    title = (record.get("title") or "").strip()
+    summary = (record.get("summary") or "").strip()
+    return f"{title}. {summary}" if title and summary else title or summary
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def ensure_embedding_indexes(db):
+    """Creates the document_embeddings indexes once per process, before the first write or sync."""
+    global _indexes_ready
+    if not _indexes_ready:
+        db[COLLECTION].create_index([("embedded_at", ASCENDING)])
+        _indexes_ready = True
+
+
+def update_embeddings(db, records: list) -> int:
+    """Embeds the records whose text changed since they were last embedded. Returns the number embedded."""
+    global _unavailable
+    if not EMBEDDINGS_ENABLED or _unavailable:
+        return 0
+    texts = {}
+    for record in records:
+        text = embedding_text(record)
+        if record.get("id") is not None and text:
+            texts[record["id"]] = text
+    if not texts:
+        return 0
+    hashes = {doc_id: text_hash(text) for doc_id, text in texts.items()}
+    stored = {doc["_id"]: doc.get("hash") for doc in db[COLLECTION].find({"_id": {"$in": list(texts)}}, {"hash": 1})}
+    pending = [doc_id for doc_id in texts if stored.get(doc_id) != hashes[doc_id]]
+    if not pending:
+        return 0
+    ensure_embedding_indexes(db)
+
+    try:
+        from engine import embed, EMBEDDING_MODEL
+        vectors = embed([texts[doc_id] for doc_id in pending]).astype(np.float16)
+    except ImportError as e:
+        # torch and sentence-transformers are only imported when the model first loads
+        _unavailable = True
+        print(f"Embeddings disabled: {e}. Install sentence-transformers to enable semantic search.")
+        return 0
+    now = datetime.utcnow()
+    ops = [
+        UpdateOne({"_id": doc_id}, {"$set": {"vector": Binary(vector.tobytes()), "dim": int(vector.shape[0]),
+                                             "hash": hashes[doc_id], "model": EMBEDDING_MODEL, "embedded_at": now}},
+                  upsert=True)
+        for doc_id, vector in zip(pending, vectors)
+    ]
+    db[COLLECTION].bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def stored_vector(db, doc_id: str):
+    doc = db[COLLECTION].find_one({"_id": doc_id}, {"vector": 1})
+    return np.frombuffer(doc["vector"], dtype=np.float16).astype(np.float32) if doc else None
+
+
+def _train_centroids(sample: np.ndarray, n_lists: int) -> np.ndarray:
+    from scipy.cluster.vq import kmeans2
+    centroids, _ = kmeans2(sample, n_lists, iter=10, minit="points", seed=0)
+    norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+    return (centroids / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+class EmbeddingIndex:
+    def __init__(self, path: str = EMBEDDING_INDEX_DIR, nprobe: int = EMBEDDING_NPROBE,
+                 sync_seconds: float = EMBEDDING_SYNC_SECONDS):
+        self.path = path
+        self.nprobe = nprobe
+        self.sync_seconds = sync_seconds
+        self._lock = threading.RLock()
+        self._last_sync = None
+        self._meta_stamp = None
+        self._reset()
+
+    def _reset(self):
+        self.generation = None
+        self.count = 0
+        self.dim = None
+        self.vectors = None
+        self.lists = np.zeros(0, dtype=np.int32)
+        self.ids = []
+        self.hashes = []
+        self.row_of = {}
+        self.centroids = None
+        self._ids_bytes = 0
+        self._live = np.zeros(0, dtype=bool)
+        self._order = self._offsets = None
+
+    # --- files ---
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(self._file("meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"count": 0, "capacity": 0, "dim": None, "ids_bytes": 0, "watermark": None, "generation": 0,
+                    "trained_count": 0}
+
+    def _write_meta(self, meta: dict):
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._file("meta.json"))
+
+    @contextmanager
+    def _file_lock(self):
+        """Serializes writers across processes; readers never take it."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self, meta: dict):
+        """Brings the in-memory view up to `meta`, reading only the new rows when possible."""
+        if meta["count"] == 0 or meta["dim"] is None:
+            self._reset()
+            self.generation = meta["generation"]
+            return
+        incremental = self.generation == meta["generation"] and self.count <= meta["count"]
+        if not incremental:
+            self._reset()
+            if os.path.exists(self._file("centroids.npy")):
+                self.centroids = np.load(self._file("centroids.npy"))
+        first = self.count
+        self.dim = meta["dim"]
+        self.vectors = np.memmap(self._file("vectors.f16"), dtype=np.float16, mode="r",
+                                 shape=(meta["capacity"], meta["dim"]))
+        new_lists = np.fromfile(self._file("lists.i32"), dtype=np.int32, count=meta["count"] - first,
+                                offset=first * 4)
+        self.lists = np.concatenate([self.lists, new_lists])
+        with open(self._file("ids.txt"), "rb") as f:
+            f.seek(self._ids_bytes)
+            lines = f.read(meta["ids_bytes"] - self._ids_bytes).decode("utf-8").splitlines()
+        for row, line in enumerate(lines, start=first):
+            doc_id, digest = line.rsplit("\t", 1)
+            self.ids.append(doc_id)
+            self.hashes.append(digest)
+            self.row_of[doc_id] = row
+        self._ids_bytes = meta["ids_bytes"]
+        self.count = meta["count"]
+        self.generation = meta["generation"]
+
+        self._live = np.zeros(self.count, dtype=bool)
+        self._live[np.fromiter(self.row_of.values(), dtype=np.int64, count=len(self.row_of))] = True
+        n_lists = len(self.centroids) if self.centroids is not None else 1
+        self._order = np.argsort(self.lists, kind="stable")
+        self._offsets = np.searchsorted(self.lists[self._order], np.arange(n_lists + 1))
+
+    def _assign(self, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        if centroids is None:
+            return np.zeros(len(vectors), dtype=np.int32)
+        return np.argmax(vectors.astype(np.float32) @ centroids.T, axis=1).astype(np.int32)
+
+    def _append(self, meta: dict, doc_ids: list, digests: list, vectors: np.ndarray) -> dict:
+        """Appends rows to the files (caller holds the file lock) and returns the updated meta."""
+        count, dim = meta["count"], meta["dim"] or vectors.shape[1]
+        needed = count + len(vectors)
+        capacity = meta["capacity"]
+        if needed > capacity:
+            capacity = max(MIN_CAPACITY, capacity * 2, needed)
+            with open(self._file("vectors.f16"), "ab") as f:
+                f.truncate(capacity * dim * 2)
+        matrix = np.memmap(self._file("vectors.f16"), dtype=np.float16, mode="r+", shape=(capacity, dim))
+        matrix[count:needed] = vectors
+        matrix.flush()
+        del matrix
+
+        centroids = np.load(self._file("centroids.npy")) if meta.get("trained_count") else None
+        # Drop anything a crashed writer left past the committed rows before appending
+        with open(self._file("lists.i32"), "ab") as f:
+            f.truncate(count * 4)
+            self._assign(vectors, centroids).tofile(f)
+        lines = "".join(f"{doc_id}\t{digest}\n" for doc_id, digest in zip(doc_ids, digests)).encode("utf-8")
+        with open(self._file("ids.txt"), "ab") as f:
+            f.truncate(meta["ids_bytes"])
+            f.write(lines)
+        return {**meta, "count": needed, "capacity": capacity, "dim": dim, "ids_bytes": meta["ids_bytes"] + len(lines)}
+
+    def _train(self, meta: dict) -> dict:
+        """Trains centroids on a sample of the index and reassigns every row to its nearest list."""
+        count, dim = meta["count"], meta["dim"]
+        n_lists = min(MAX_LISTS, max(1, int(np.sqrt(count))))
+        matrix = np.memmap(self._file("vectors.f16"), dtype=np.float16, mode="r", shape=(meta["capacity"], dim))
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(count, size=min(count, n_lists * TRAINING_ROWS_PER_LIST), replace=False))
+        started = time.monotonic()
+        centroids = _train_centroids(matrix[sample_rows].astype(np.float32), n_lists)
+        lists = np.concatenate([self._assign(matrix[start:start + SCAN_CHUNK_ROWS], centroids)
+                                for start in range(0, count, SCAN_CHUNK_ROWS)])
+        # Replaced whole, since readers load these files without the file lock
+        with open(self._file("centroids.npy.tmp"), "wb") as f:
+            np.save(f, centroids)
+        lists.tofile(self._file("lists.i32.tmp"))
+        os.replace(self._file("centroids.npy.tmp"), self._file("centroids.npy"))
+        os.replace(self._file("lists.i32.tmp"), self._file("lists.i32"))
+        print(f"Embedding index: trained {n_lists} lists over {count} vectors in {time.monotonic() - started:.1f}s.")
+        # A new generation makes every process reload the reassigned lists
+        return {**meta, "trained_count": count, "generation": meta["generation"] + 1}
+
+    # --- maintenance ---
+
+    def sync(self, db, force: bool = False) -> int:
+        """Appends vectors written since the last sync. Returns the number of rows added."""
+        now = time.monotonic()
+        if not force and self._last_sync is not None and now - self._last_sync < self.sync_seconds:
+            return 0
+        ensure_embedding_indexes(db)
+        with self._lock:
+            self._last_sync = now
+            with self._file_lock():
+                meta = self._read_meta()
+                self._load(meta)
+                query = {}
+                if meta["watermark"]:
+                    since = datetime.fromisoformat(meta["watermark"]) - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+                    query = {"embedded_at": {"$gte": since}}
+                cursor = (db[COLLECTION].find(query, {"vector": 1, "hash": 1, "embedded_at": 1})
+                          .sort("embedded_at", ASCENDING).batch_size(SCAN_CHUNK_ROWS))
+                added, watermark = 0, meta["watermark"]
+                batch = []
+                for doc in cursor:
+                    watermark = max(watermark or "", doc["embedded_at"].isoformat())
+                    row = self.row_of.get(doc["_id"])
+                    if row is None or self.hashes[row] != doc["hash"]:
+                        batch.append(doc)
+                    if len(batch) >= SCAN_CHUNK_ROWS:
+                        meta = self._append_docs(meta, batch)
+                        added += len(batch)
+                        batch = []
+                if batch:
+                    meta = self._append_docs(meta, batch)
+                    added += len(batch)
+                meta["watermark"] = watermark
+                if meta["count"] >= IVF_MIN_VECTORS and meta["count"] >= RETRAIN_GROWTH * meta.get("trained_count", 0):
+                    meta = self._train(meta)
+                self._write_meta(meta)
+                self._load(meta)
+        if added:
+            print(f"Embedding index: added {added} vectors ({self.count} rows).")
+        return added
+
+    def refresh(self) -> bool:
+        """Loads rows other processes have synced since the last call. Returns True if anything changed."""
+        try:
+            stat = os.stat(self._file("meta.json"))
+        except FileNotFoundError:
+            return False
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._meta_stamp:
+            return False
+        with self._lock:
+            self._load(self._read_meta())
+            self._meta_stamp = stamp
+        return True
+
+    def _append_docs(self, meta: dict, docs: list) -> dict:
+        vectors = [np.frombuffer(doc["vector"], dtype=np.float16) for doc in docs]
+        dim = meta["dim"] or len(vectors[0])
+        keep = [i for i, vector in enumerate(vectors) if len(vector) == dim]
+        if len(keep) < len(docs):
+            print(f"Embedding index: skipped {len(docs) - len(keep)} vectors that are not {dim}-dimensional; "
+                  f"run `python embeddings.py --rebuild` after changing EMBEDDING_MODEL.")
+        if not keep:
+            return meta
+        return self._append(meta, [docs[i]["_id"] for i in keep], [docs[i]["hash"] for i in keep],
+                            np.stack([vectors[i] for i in keep]))
+
+    def rebuild(self, db) -> int:
+        """Recreates the index from document_embeddings and swaps it in. Returns the row count."""
+        staging = EmbeddingIndex(f"{self.path}.rebuild")
+        shutil.rmtree(staging.path, ignore_errors=True)
+        with self._file_lock():
+            generation = self._read_meta()["generation"]
+            meta = {**staging._read_meta(), "generation": generation + 1}
+            os.makedirs(staging.path, exist_ok=True)
+            staging._write_meta(meta)
+            staging.sync(db, force=True)
+            meta = staging._read_meta()
+            if meta["count"] and not meta.get("trained_count") and meta["count"] >= IVF_MIN_VECTORS:
+                meta = staging._train(meta)
+            meta["generation"] = generation + 2
+            staging._write_meta(meta)
+            for name in ("vectors.f16", "lists.i32", "ids.txt", "centroids.npy", "meta.json"):
+                source = staging._file(name)
+                if os.path.exists(source):
+                    os.replace(source, self._file(name))
+                elif os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+        shutil.rmtree(staging.path, ignore_errors=True)
+        with self._lock:
+            self._reset()
+            self._load(self._read_meta())
+        return self.count
+
+    # --- queries ---
+
+    def vector_for(self, doc_id: str):
+        with self._lock:
+            row = self.row_of.get(doc_id)
+            return None if row is None else self.vectors[row].astype(np.float32)
+
+    def _candidate_rows(self, query: np.ndarray) -> np.ndarray:
+        if self.centroids is None:
+            return None
+        n_lists = len(self.centroids)
+        nprobe = min(self.nprobe, n_lists)
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate([self._order[self._offsets[l]:self._offsets[l + 1]] for l in probe])
+        return np.sort(rows)  # ascending rows read the memory map sequentially
+
+    def search(self, vector, k: int = 10, exclude: set = None) -> list:
+        """Approximate top-k by cosine similarity: [(doc_id, score)], best first."""
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            if not self.count or k <= 0:
+                return []
+            rows = self._candidate_rows(query)
+            if rows is None:
+                rows = np.arange(self.count)
+                scores = np.concatenate([self.vectors[start:min(start + SCAN_CHUNK_ROWS, self.count)].astype(np.float32)
+                                         @ query for start in range(0, self.count, SCAN_CHUNK_ROWS)])
+            elif not len(rows):
+                return []
+            else:
+                scores = self.vectors[rows].astype(np.float32) @ query
+            scores[~self._live[rows]] = -np.inf
+            for doc_id in exclude or ():
+                row = self.row_of.get(doc_id)
+                if row is not None:
+                    scores[rows == row] = -np.inf
+            top = min(k, len(rows))
+            best = np.argpartition(-scores, top - 1)[:top] if top < len(rows) else np.arange(len(rows))
+            best = best[np.argsort(-scores[best])]
+            return [(self.ids[rows[i]], float(scores[i])) for i in best if np.isfinite(scores[i])]
+
+    def search_text(self, text: str, k: int = 10) -> list:
+        from engine import embed
+        return self.search(embed([text])[0], k)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rows": self.count, "documents": len(self.row_of), "dim": self.dim,
+                    "lists": len(self.centroids) if self.centroids is not None else 0, "nprobe": self.nprobe}
+
+
+embedding_index = EmbeddingIndex()
+
+
+def sync_index(db, force: bool = False) -> int:
+    """Worker-side sync of the shared index after saving documents. Errors are printed, not raised."""
+    if not EMBEDDINGS_ENABLED:
+        return 0
+    try:
+        return embedding_index.sync(db, force=force)
+    except Exception as e:
+        print(f"Error syncing the embedding index: {e}")
+        return 0
+
+
+def backfill_embeddings(db, chunk_size: int = 256) -> int:
+    """Embeds every document that has no embedding for its current text."""
+    embedded = 0
+    batch = []
+    for doc in db.documents.find({}, {"_id": 0, "id": 1, "title": 1, "summary": 1}):
+        batch.append(doc)
+        if len(batch) >= chunk_size:
+            embedded += update_embeddings(db, batch)
+            batch = []
+    if batch:
+        embedded += update_embeddings(db, batch)
+    return embedded
+
+
+if __name__ == "__main__":
+    from mongo import get_db
+    if "--backfill" in sys.argv:
+        print(f"Embedded {backfill_embeddings(get_db())} documents.")
+    if "--sync" in sys.argv:
+        print(f"Added {embedding_index.sync(get_db(), force=True)} vectors to the embedding index.")
+    if "--rebuild" in sys.argv:
+        print(f"Rebuilt the embedding index with {embedding_index.rebuild(get_db())} vectors.")
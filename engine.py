@@ -1,36 +1,173 @@
 # engine.py
+"""
+Local NLP engine: summaries, named entities and keywords without the Gemini quota.
+
+Models are loaded once per process through a lazily initialized registry and
+reused across calls. Documents are sorted by length and fed through each model
+in batches, so every padded batch holds similarly sized texts.
+
+ENGINE_BATCH_SIZE      documents per model batch (default 16)
+ENGINE_TORCH_THREADS   intra-op threads for torch (default: torch's own choice)
+ENGINE_QUANTIZE        1 to apply dynamic int8 quantization to the Linear layers (CPU only)
+EMBEDDING_MODEL        sentence-transformer shared by KeyBERT and the embedding index
+"""
+
+import os
+import threading
 import pandas as pd
-from transformers import pipeline
-from keybert import KeyBERT
 from tqdm import tqdm
 
-def process_documents(df: pd.DataFrame) -> pd.DataFrame:
-    print("Initializing AI models...")
-    summarizer = pipeline("summarization", model="sshleifer/distilbart-cnn-6-6", framework="pt")
-    ner_pipeline = pipeline("ner", model="dslim/bert-base-NER", grouped_entities=True, framework="pt")
-    kw_model = KeyBERT()
-    print("Models initialized.")
-    
-    results = []
-    print("Processing documents...")
-    for summary_text in tqdm(df['summary'], total=len(df), desc="Analyzing Papers"):
-        if not summary_text or not isinstance(summary_text, str):
-            results.append(("No summary available", [], []))
-            continue
-            
-        generated_summary = summarizer(summary_text[:1024], max_length=60, min_length=20, do_sample=False)[0]['summary_text']
-        
-        entities = ner_pipeline(summary_text)
-        
-        # --- THIS IS THE FIX ---
-        # Convert any numpy types in entities to standard Python types
-        for entity in entities:
-            entity['score'] = float(entity['score'])
-            
-        keywords = kw_model.extract_keywords(summary_text, keyphrase_ngram_range=(1, 2), stop_words='english', top_n=5)
-        results.append((generated_summary, entities, [kw[0] for kw in keywords]))
+SUMMARY_MODEL = "sshleifer/distilbart-cnn-6-6"
+NER_MODEL = "dslim/bert-base-NER"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")  # KeyBERT's default sentence-transformer
+ENGINE_BATCH_SIZE = int(os.getenv("ENGINE_BATCH_SIZE", 16))
+ENGINE_TORCH_THREADS = int(os.getenv("ENGINE_TORCH_THREADS", 0))
+ENGINE_QUANTIZE = os.getenv("ENGINE_QUANTIZE", "0") == "1"
+SUMMARY_INPUT_CHARS = 1024
+NO_SUMMARY = "No summary available"
+
+
+def _configure_torch():
+    import torch
+    if ENGINE_TORCH_THREADS > 0:
+        torch.set_num_threads(ENGINE_TORCH_THREADS)
+        try:
+            torch.set_num_interop_threads(max(1, ENGINE_TORCH_THREADS // 2))
+        except RuntimeError:
+            # Inter-op threads can only be set before torch runs its first parallel op
+            pass
+    return torch
+
+
+def _quantized(module):
+    """Dynamic int8 quantization of the Linear layers; a no-op unless ENGINE_QUANTIZE is on and we run on CPU."""
+    if not ENGINE_QUANTIZE or not hasattr(module, "parameters"):
+        return module
+    torch = _configure_torch()
+    device = next(module.parameters()).device
+    if device.type != "cpu":
+        return module
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _load_summarizer():
+    from transformers import pipeline
+    summarizer = pipeline("summarization", model=SUMMARY_MODEL, framework="pt")
+    summarizer.model = _quantized(summarizer.model)
+    return summarizer
+
+
+def _load_ner():
+    from transformers import pipeline
+    ner_pipeline = pipeline("ner", model=NER_MODEL, grouped_entities=True, framework="pt")
+    ner_pipeline.model = _quantized(ner_pipeline.model)
+    return ner_pipeline
+
+
+def _load_embedder():
+    from sentence_transformers import SentenceTransformer
+    return _quantized(SentenceTransformer(EMBEDDING_MODEL, device="cpu" if ENGINE_QUANTIZE else None))
+
+
+def _load_keyword_model():
+    from keybert import KeyBERT
+    # Shares the registry's sentence-transformer rather than loading a second copy
+    return KeyBERT(model=models.get("embedder"))
+
+
+class ModelRegistry:
+    """Loads each model on first use and keeps it for the life of the process."""
+
+    def __init__(self, loaders: dict):
+        self._loaders = loaders
+        self._models = {}
+        self._lock = threading.RLock()  # loaders may fetch other models from the registry
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            if name not in self._models:
+                _configure_torch()
+                print(f"Engine: loading '{name}' model...")
+                self._models[name] = self._loaders[name]()
+            return self._models[name]
+
+    def loaded(self) -> list:
+        return list(self._models)
+
+
+models = ModelRegistry({
+    "summarizer": _load_summarizer,
+    "ner": _load_ner,
+    "keywords": _load_keyword_model,
+    "embedder": _load_embedder,
+})
+
+
+def _length_sorted_batches(texts: list, batch_size: int) -> list:
+    """Splits positions of texts into batches of similar length, longest first."""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def _run_batched(texts: list, batch_size: int, desc: str, run) -> list:
+    """Applies run(batch_texts) -> list over length-sorted batches and returns results in input order."""
+    results = [None] * len(texts)
+    for positions in tqdm(_length_sorted_batches(texts, batch_size), desc=desc):
+        for position, output in zip(positions, run([texts[i] for i in positions])):
+            results[position] = output
+    return results
+
+
+def summarize(texts: list, batch_size: int = ENGINE_BATCH_SIZE) -> list:
+    summarizer = models.get("summarizer")
+    texts = [text[:SUMMARY_INPUT_CHARS] for text in texts]
+    outputs = _run_batched(texts, batch_size, "Summaries", lambda batch: summarizer(
+        batch, max_length=60, min_length=20, do_sample=False, truncation=True, batch_size=len(batch)))
+    return [output['summary_text'] for output in outputs]
+
+
+def extract_entities(texts: list, batch_size: int = ENGINE_BATCH_SIZE) -> list:
+    ner_pipeline = models.get("ner")
+    entities_per_text = _run_batched(texts, batch_size, "Entities",
+                                     lambda batch: ner_pipeline(batch, batch_size=len(batch)))
+    # Convert numpy scores to plain floats so the entities can be stored as JSON/BSON
+    return [[{**entity, 'score': float(entity['score'])} for entity in entities] for entities in entities_per_text]
+
+
+def extract_keywords(texts: list, batch_size: int = ENGINE_BATCH_SIZE, top_n: int = 5) -> list:
+    kw_model = models.get("keywords")
+
+    def run(batch):
+        keywords = kw_model.extract_keywords(batch, keyphrase_ngram_range=(1, 2), stop_words='english', top_n=top_n)
+        # KeyBERT returns a flat list of (keyword, score) for a single document
+        return [keywords] if len(batch) == 1 else keywords
+
+    return [[kw[0] for kw in keywords] for keywords in _run_batched(texts, batch_size, "Keywords", run)]
+
+
+def embed(texts: list, batch_size: int = ENGINE_BATCH_SIZE):
+    """L2-normalized float32 sentence embeddings, one row per text."""
+    return models.get("embedder").encode(texts, batch_size=batch_size, normalize_embeddings=True,
+                                         convert_to_numpy=True, show_progress_bar=False)
+
+
+def process_documents(df: pd.DataFrame, batch_size: int = ENGINE_BATCH_SIZE) -> pd.DataFrame:
+    valid = [i for i, text in enumerate(df['summary']) if text and isinstance(text, str)]
+    texts = [df['summary'].iloc[i] for i in valid]
+    print(f"Processing {len(texts)} documents in batches of {batch_size}...")
+
+    results = [(NO_SUMMARY, [], [])] * len(df)
+    if texts:
+        summaries = summarize(texts, batch_size)
+        entities = extract_entities(texts, batch_size)
+        keywords = extract_keywords(texts, batch_size)
+        for position, row in zip(valid, zip(summaries, entities, keywords)):
+            results[position] = row
 
     df[['generated_summary', 'entities', 'keywords']] = pd.DataFrame(results, index=df.index)
-    
+
     print("Processing complete.")
-    return df
\ No newline at end of file
+    return df
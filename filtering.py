@@ -0,0 +1,167 @@
+# filtering.py
+"""
+Vectorized relevance and quality filtering for ingested documents.
+
+Runs once over a whole DataFrame of candidates before anything is sent to
+the LLM. Every stage is a boolean mask over the remaining rows, and the
+number of rows each stage drops is reported alongside the result:
+
+1. missing_summary   - no abstract at all
+2. too_short         - fewer than MIN_SUMMARY_LENGTH characters
+3. too_few_words     - fewer than MIN_SUMMARY_WORDS words
+4. off_topic         - no topic keyword appears as a whole word in title + abstract
+5. low_similarity    - TF-IDF-weighted (BM25) topic similarity below min_similarity
+6. low_quality       - weighted quality score below min_quality
+"""
+
+import os
+import re
+import numpy as np
+import pandas as pd
+
+MIN_SUMMARY_LENGTH = 150
+MIN_SUMMARY_WORDS = 25
+MIN_SIMILARITY = float(os.getenv("FILTER_MIN_SIMILARITY", 0.05))
+MIN_QUALITY = float(os.getenv("FILTER_MIN_QUALITY", 0.2))
+
+# Quality score = weighted sum of components in [0, 1]
+QUALITY_WEIGHTS = {"similarity": 0.6, "length": 0.25, "completeness": 0.15}
+SIMILARITY_SATURATION = 0.5  # similarity at or above this counts as a perfect topic match
+LENGTH_SATURATION_CHARS = 1000  # about 150 words
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _keywords(topic: str) -> list:
+    return sorted({k for k in (topic or '').lower().split() if k})
+
+
+def _lowered(texts) -> list:
+    return [text.lower() if isinstance(text, str) else '' for text in texts.tolist()]
+
+
+def _term_counts(lowered: list, keywords: list):
+    """
+    Sparse document x keyword matrix of whole-word occurrence counts.
+
+    The token pattern only matches the keywords themselves, so every other word
+    is skipped and the vocabulary stays fixed to the topic. Lookarounds rather
+    than \\b keep keywords that end in punctuation, such as 'c++', matchable.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+    # Longest first, so a keyword that extends another is not cut short
+    alternatives = "|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+    vectorizer = CountVectorizer(vocabulary=keywords, lowercase=False, token_pattern=rf"(?<!\w)(?:{alternatives})(?!\w)",
+                                 dtype=np.float64)
+    return vectorizer.transform(lowered).tocsr()
+
+
+def _keyword_hits(counts) -> np.ndarray:
+    return counts.getnnz(axis=1) > 0
+
+
+def keyword_mask(texts: pd.Series, topic: str) -> pd.Series:
+    """True where any topic keyword is a whole word, e.g. 'quantum' matches 'quantum-safe' but not 'nonquantum' or 'quantumness'."""
+    keywords = _keywords(topic)
+    if not keywords or len(texts) == 0:
+        return pd.Series(True, index=texts.index)
+    return pd.Series(_keyword_hits(_term_counts(_lowered(texts), keywords)), index=texts.index)
+
+
+def _bm25(counts, lengths: np.ndarray) -> np.ndarray:
+    """BM25 of each row of a term-count matrix, over the nonzero entries only, scaled to [0, 1)."""
+    n = counts.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    lengths = np.maximum(np.asarray(lengths, dtype=float), 1.0)
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / lengths.mean())
+    doc_freq = counts.getnnz(axis=0)
+    idf = np.log(1 + (n - doc_freq + 0.5) / (doc_freq + 0.5))
+    rows = np.repeat(np.arange(n), np.diff(counts.indptr))
+    tf = counts.data
+    weights = idf[counts.indices] * tf * (BM25_K1 + 1) / (tf + length_norm[rows])
+    score = np.bincount(rows, weights=weights, minlength=n)
+    max_score = idf.sum() * (BM25_K1 + 1)
+    return score / max_score if max_score else score
+
+
+def topic_similarity(texts: pd.Series, topic: str) -> np.ndarray:
+    """
+    TF-IDF-weighted (BM25) similarity of each text to the topic, scaled to [0, 1).
+
+    Term counts come from a CountVectorizer whose vocabulary is the topic's
+    terms, and IDF comes from the batch itself. BM25 is then computed on the
+    sparse count matrix. Fitting a full TfidfVectorizer over every word costs
+    seconds per 100k abstracts, and counting only the topic's terms avoids that.
+    """
+    keywords = _keywords(topic)
+    if len(texts) == 0 or not keywords:
+        return np.zeros(len(texts))
+    lowered = _lowered(texts)
+    return _bm25(_term_counts(lowered, keywords), [len(text) for text in lowered])
+
+
+def quality_scores(df: pd.DataFrame, similarity: np.ndarray, summary_lengths: np.ndarray,
+                   weights: dict = None) -> np.ndarray:
+    weights = weights or QUALITY_WEIGHTS
+    similarity_component = np.clip(similarity / SIMILARITY_SATURATION, 0, 1)
+    length_component = np.clip(np.asarray(summary_lengths, dtype=float) / LENGTH_SATURATION_CHARS, 0, 1)
+    completeness = np.zeros(len(df))
+    present_fields = [f for f in ('title', 'published', 'authors') if f in df.columns]
+    for field in present_fields:
+        values = df[field]
+        completeness += values.notna().to_numpy() & (values.astype(str).str.len().to_numpy() > 0)
+    if present_fields:
+        completeness /= len(present_fields)
+    total = sum(weights.values()) or 1.0
+    return (weights.get("similarity", 0) * similarity_component
+            + weights.get("length", 0) * length_component
+            + weights.get("completeness", 0) * completeness) / total
+
+
+def filter_candidates(df: pd.DataFrame, topic: str = None, min_similarity: float = None,
+                      min_quality: float = None, quality_weights: dict = None) -> tuple:
+    """
+    Returns (filtered_df, drop_counts). Without a topic only the length stages run.
+    The surviving rows carry `relevance` and `quality_score` columns.
+    """
+    drops = {"missing_summary": 0, "too_short": 0, "too_few_words": 0, "off_topic": 0, "low_similarity": 0, "low_quality": 0}
+    if df is None or df.empty or 'summary' not in df.columns:
+        return pd.DataFrame(), drops
+    min_similarity = MIN_SIMILARITY if min_similarity is None else min_similarity
+    min_quality = MIN_QUALITY if min_quality is None else min_quality
+
+    def apply(frame, mask, stage):
+        drops[stage] += int(len(frame) - np.count_nonzero(mask))
+        return frame[mask]
+
+    df = apply(df, df['summary'].notna().to_numpy(), "missing_summary")
+    summaries = df['summary'].astype(str).tolist()
+    lengths = np.fromiter(map(len, summaries), dtype=np.int64, count=len(summaries))
+    keep = lengths >= MIN_SUMMARY_LENGTH
+    df, summaries, lengths = apply(df, keep, "too_short"), [s for s, k in zip(summaries, keep) if k], lengths[keep]
+    # maxsplit stops counting once the minimum is reached, so long abstracts are not split in full
+    words = np.fromiter((len(s.split(None, MIN_SUMMARY_WORDS)) for s in summaries), dtype=np.int64, count=len(summaries))
+    keep = words >= MIN_SUMMARY_WORDS
+    df, summaries, lengths = apply(df, keep, "too_few_words"), [s for s, k in zip(summaries, keep) if k], lengths[keep]
+
+    keywords = _keywords(topic)
+    if keywords and not df.empty:
+        titles = df['title'].fillna('').astype(str).tolist() if 'title' in df.columns else [''] * len(df)
+        content = [f"{t} {s}".lower() for t, s in zip(titles, summaries)]
+        counts = _term_counts(content, keywords)
+        content_lengths = np.fromiter(map(len, content), dtype=np.int64, count=len(content))
+        keep = _keyword_hits(counts)
+        df, counts, lengths = apply(df, keep, "off_topic"), counts[keep], lengths[keep]
+
+        similarity = _bm25(counts, content_lengths[keep])
+        keep = similarity >= min_similarity
+        df, similarity, lengths = apply(df, keep, "low_similarity"), similarity[keep], lengths[keep]
+
+        quality = quality_scores(df, similarity, lengths, quality_weights)
+        keep = quality >= min_quality
+        df = apply(df, keep, "low_quality").assign(relevance=similarity[keep], quality_score=quality[keep])
+
+    if 'published' in df.columns:
+        df = df.assign(published=pd.to_datetime(df['published'], errors='coerce'))
+    return df, drops
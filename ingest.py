@@ -1,54 +1,305 @@
 # ingest.py
+import os
 import requests
 import pandas as pd
 from xml.etree import ElementTree as ET
+import threading
 import time
+from datetime import datetime
+from config import ARXIV_API_URL
+from filtering import keyword_mask
+from metrics import inc, stage_timer
 
-def fetch_arxiv_data(topic: str, max_results: int = 10) -> pd.DataFrame:
-    base_url = "http://export.arxiv.org/api/query"
-    params = {
-        "search_query": f"all:{topic}",
-        "start": 0,
-        "max_results": max_results,
-        "sortBy": "submittedDate",
-        "sortOrder": "descending"
-    }
-    
-    try:
-        print(f"Fetching up to {max_results} arXiv papers for '{topic}'...")
-        response = requests.get(base_url, params=params, timeout=30)
-        response.raise_for_status()
-        
-        root = ET.fromstring(response.content)
-        ns = {'atom': 'http://www.w3.org/2005/Atom'}
-        
-        all_papers = []
-        for entry in root.findall('atom:entry', ns):
+ARXIV_PAGE_SIZE = int(os.getenv("ARXIV_PAGE_SIZE", 100))
+ARXIV_REQUEST_INTERVAL = 3.0  # arXiv asks API clients to wait 3 seconds between requests
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+_last_request_at = 0.0
+_request_lock = threading.Lock()
+
+def _polite_get(params: dict) -> requests.Response:
+    """Issues one arXiv API request, spacing requests from this process at least ARXIV_REQUEST_INTERVAL apart."""
+    global _last_request_at
+    with _request_lock:
+        wait = _last_request_at + ARXIV_REQUEST_INTERVAL - time.monotonic()
+        if wait > 0:
+            inc("aetos_arxiv_polite_wait_seconds_total", wait)
+            time.sleep(wait)
+        try:
+            # Time to the response headers; the body streams in during parsing
+            with stage_timer("fetch", source="arxiv"):
+                response = requests.get(ARXIV_API_URL, params=params, timeout=30, stream=True)
+                response.raise_for_status()
+        except Exception:
+            inc("aetos_source_requests_total", source="arxiv", method="http", outcome="error")
+            raise
+        finally:
+            _last_request_at = time.monotonic()
+    inc("aetos_source_requests_total", source="arxiv", method="http", outcome="ok")
+    return response
+
+def _iter_entries(stream):
+    """Parses an Atom feed incrementally, yielding one paper dict per <entry> and freeing it afterwards."""
+    for _, elem in ET.iterparse(stream, events=('end',)):
+        if elem.tag != f'{ATOM}entry':
+            continue
+        try:
             paper_data = {
-                'id': entry.find('atom:id', ns).text,
-                'title': entry.find('atom:title', ns).text.strip(),
-                'summary': entry.find('atom:summary', ns).text.strip(),
-                'published': entry.find('atom:published', ns).text[:10],
-                'authors': [a.find('atom:name', ns).text for a in entry.findall('atom:author', ns)],
+                'id': elem.findtext(f'{ATOM}id'),
+                'title': (elem.findtext(f'{ATOM}title') or '').strip(),
+                'summary': (elem.findtext(f'{ATOM}summary') or '').strip(),
+                'published': (elem.findtext(f'{ATOM}published') or '')[:10],
+                'authors': [a.findtext(f'{ATOM}name') for a in elem.findall(f'{ATOM}author')],
                 'source': 'arxiv',
                 'provider_company': 'N/A'  # --- ADDED for data consistency
             }
-            if all(paper_data.values()): # Basic check for missing fields
-                all_papers.append(paper_data)
-        
+        finally:
+            elem.clear()
+        if all(paper_data.values()): # Basic check for missing fields
+            yield paper_data
+
+class ArxivWatermark:
+    """
+    Per-topic high-water mark of ingested arXiv papers: the newest `published`
+    date seen and the ids published on that date. Results are sorted newest
+    first, so paging can stop at the first paper at or below the mark.
+
+    A run that hits max_results before paging back down to the mark leaves a
+    gap. Papers from `gap_before` up to `top` are ingested; those between the
+    mark and `gap_before` are not. The mark stays where it was. The next run
+    first pages down to `top` for new papers, then resumes the gap below
+    `gap_before`. The mark only advances once the gap has been paged through.
+    """
+
+    def __init__(self, topic: str):
+        self.topic = topic.strip().lower()
+        self.published = None
+        self.ids = set()
+        self.top = None
+        self.top_ids = set()
+        self.gap_before = None
+        self.gap_ids = set()
+        self.in_gap = False
+        self.complete = {"top": False, "gap": False}
+        self._newest = None
+        self._newest_ids = set()
+        self._oldest = None
+        self._oldest_ids = set()
+
+    @property
+    def _key(self) -> str:
+        return f"arxiv:{self.topic}"
+
+    @property
+    def has_gap(self) -> bool:
+        return self.gap_before is not None
+
+    @classmethod
+    def load(cls, topic: str):
+        watermark = cls(topic)
+        try:
+            from database import get_db_connection
+            doc = get_db_connection().ingest_watermarks.find_one({'_id': watermark._key})
+        except Exception as e:
+            print(f"Could not load arXiv watermark for '{topic}': {e}")
+            doc = None
+        if doc:
+            watermark.published = doc.get('published')
+            watermark.ids = set(doc.get('ids', []))
+            if doc.get('gap_before'):
+                watermark.top, watermark.top_ids = doc.get('top'), set(doc.get('top_ids', []))
+                watermark.gap_before, watermark.gap_ids = doc['gap_before'], set(doc.get('gap_ids', []))
+        return watermark
+
+    def _stop_mark(self) -> tuple:
+        """The (date, ids) the current pass pages down to."""
+        if self.has_gap and not self.in_gap:
+            return self.top, self.top_ids
+        return self.published, self.ids
+
+    def already_ingested(self, paper: dict) -> bool:
+        published, ids = self._stop_mark()
+        if self.in_gap and paper['published'] == self.gap_before and paper['id'] in self.gap_ids:
+            return True
+        if not published:
+            return False
+        return paper['published'] < published or (paper['published'] == published and paper['id'] in ids)
+
+    def reached(self, paper: dict) -> bool:
+        """True once paging has gone past everything newer than the current pass's stop mark."""
+        published, _ = self._stop_mark()
+        return bool(published) and paper['published'] < published
+
+    def observe(self, paper: dict):
+        published = paper['published']
+        if not self.in_gap:
+            if self._newest is None or published > self._newest:
+                self._newest, self._newest_ids = published, {paper['id']}
+            elif published == self._newest:
+                self._newest_ids.add(paper['id'])
+        if self._oldest is None or published < self._oldest:
+            self._oldest, self._oldest_ids = published, {paper['id']}
+        elif published == self._oldest:
+            self._oldest_ids.add(paper['id'])
+
+    def start_gap(self):
+        """Switches to the pass below gap_before. Its oldest paper becomes the new resume point."""
+        self.in_gap = True
+        self._oldest, self._oldest_ids = None, set()
+
+    def _next_state(self) -> dict:
+        """What commit() stores, or None when there is nothing to advance."""
+        newest, newest_ids = self._newest, self._newest_ids
+        if not self.has_gap:
+            if newest is None or (self.published and newest < self.published):
+                return None
+            # Without an earlier mark there is nothing below to fill in
+            if self.complete["top"] or not self.published:
+                ids = newest_ids | (self.ids if newest == self.published else set())
+                return {'published': newest, 'ids': ids, 'top': None, 'top_ids': set(), 'gap_before': None, 'gap_ids': set()}
+            # Stopped at max_results above the mark: keep it, and remember where to resume
+            return {'published': self.published, 'ids': self.ids, 'top': newest, 'top_ids': newest_ids,
+                    'gap_before': self._oldest, 'gap_ids': self._oldest_ids}
+        if not self.complete["top"]:
+            # A second gap above `top` cannot be recorded; the next run pages through it again
+            return None
+        top, top_ids = self.top, self.top_ids
+        if newest is not None and newest >= top:
+            top_ids = newest_ids | (top_ids if newest == top else set())
+            top = newest
+        if self.complete["gap"]:
+            return {'published': top, 'ids': top_ids, 'top': None, 'top_ids': set(), 'gap_before': None, 'gap_ids': set()}
+        gap_before, gap_ids = self.gap_before, self.gap_ids
+        if self.in_gap and self._oldest is not None:
+            gap_ids = self._oldest_ids | (gap_ids if self._oldest == gap_before else set())
+            gap_before = self._oldest
+        return {'published': self.published, 'ids': self.ids, 'top': top, 'top_ids': top_ids,
+                'gap_before': gap_before, 'gap_ids': gap_ids}
+
+    def commit(self):
+        """Advances the stored mark (or the gap) past the papers observed. Call after those papers are saved."""
+        state = self._next_state()
+        if state is None:
+            return
+        try:
+            from database import get_db_connection
+            get_db_connection().ingest_watermarks.update_one(
+                {'_id': self._key},
+                {'$set': {'source': 'arxiv', 'topic': self.topic, 'published': state['published'],
+                          'ids': sorted(state['ids']), 'top': state['top'], 'top_ids': sorted(state['top_ids']),
+                          'gap_before': state['gap_before'], 'gap_ids': sorted(state['gap_ids']),
+                          'updated_at': datetime.utcnow()}},
+                upsert=True,
+            )
+            self.published, self.ids = state['published'], state['ids']
+            self.top, self.top_ids = state['top'], state['top_ids']
+            self.gap_before, self.gap_ids = state['gap_before'], state['gap_ids']
+        except Exception as e:
+            print(f"Could not store arXiv watermark for '{self.topic}': {e}")
+
+def arxiv_search_query(topic: str, date_from: str = None, date_to: str = None) -> str:
+    """arXiv query for a topic, optionally restricted to papers submitted between two YYYY-MM-DD dates."""
+    query = f"all:{topic}"
+    if date_from or date_to:
+        lower = (date_from or "1991-01-01").replace("-", "") + "0000"
+        upper = (date_to or datetime.utcnow().strftime("%Y-%m-%d")).replace("-", "") + "2359"
+        query += f" AND submittedDate:[{lower} TO {upper}]"
+    return query
+
+def _walk_arxiv_pages(topic: str, search_query: str, max_results: int, page_size: int,
+                      watermark: ArxivWatermark, start: int):
+    """
+    Pages through one arXiv query newest first, yielding relevant papers per
+    page. Returns (results seen, complete), where complete means paging
+    reached the watermark or ran out of results rather than stopping at max_results.
+    """
+    seen = 0
+
+    while seen < max_results:
+        page_limit = min(page_size, max_results - seen)
+        params = {
+            "search_query": search_query,
+            "start": start,
+            "max_results": page_limit,
+            "sortBy": "submittedDate",
+            "sortOrder": "descending"
+        }
+        print(f"Fetching arXiv papers {start}-{start + page_limit} for '{topic}'...")
+        response = _polite_get(params)
+        response.raw.decode_content = True
+
+        entries = 0
+        new_papers = []
+        stop = False
+        with stage_timer("parse", source="arxiv"):
+            for paper in _iter_entries(response.raw):
+                entries += 1
+                if watermark is not None:
+                    if watermark.reached(paper):
+                        stop = True
+                        break
+                    if watermark.already_ingested(paper):
+                        continue
+                    watermark.observe(paper)
+                new_papers.append(paper)
+            response.close()
+
         # --- CRITICAL RELEVANCE VALIDATION STEP ---
-        print(f"--- Relevance Check ---")
-        relevant_papers = []
-        topic_keywords = set(topic.lower().split())
-        for paper in all_papers:
-            content = (paper['title'] + ' ' + paper['summary']).lower()
-            if any(keyword in content for keyword in topic_keywords):
-                relevant_papers.append(paper)
-        
-        print(f"--- Found {len(all_papers)} total papers, {len(relevant_papers)} are relevant. ---")
-        time.sleep(3)
-        return pd.DataFrame(relevant_papers)
-        
+        with stage_timer("filter", source="arxiv"):
+            page_df = pd.DataFrame(new_papers)
+            if not page_df.empty:
+                page_df = page_df[keyword_mask(page_df['title'] + ' ' + page_df['summary'], topic)]
+        print(f"--- Page at {start}: {entries} papers, {len(new_papers)} new, {len(page_df)} relevant. ---")
+        if not page_df.empty:
+            yield page_df.reset_index(drop=True)
+
+        seen += entries
+        start += entries
+        if stop:
+            print(f"--- Reached previously ingested arXiv papers for '{topic}'. ---")
+            return seen, True
+        if entries < page_limit:
+            return seen, True
+    return seen, False
+
+def iter_arxiv_pages(topic: str, max_results: int = 10, page_size: int = ARXIV_PAGE_SIZE,
+                     watermark: ArxivWatermark = None, search_query: str = None, start: int = 0):
+    """
+    Walks arXiv search results newest first, from result offset `start`,
+    yielding one DataFrame of relevant papers per page. With a watermark,
+    already-ingested papers are skipped and paging stops as soon as results go
+    past the mark. If an earlier run left a gap above the mark, the budget
+    left after the new papers goes to paging through that gap.
+    """
+    search_query = search_query or f"all:{topic}"
+    seen, complete = yield from _walk_arxiv_pages(topic, search_query, max_results, page_size, watermark, start)
+    if watermark is None:
+        return
+    watermark.complete["top"] = complete
+    if watermark.has_gap and complete and seen < max_results:
+        print(f"--- Resuming the gap in ingested arXiv papers for '{topic}' below {watermark.gap_before}. ---")
+        watermark.start_gap()
+        gap_query = arxiv_search_query(topic, date_from=watermark.published, date_to=watermark.gap_before)
+        _, watermark.complete["gap"] = yield from _walk_arxiv_pages(
+            topic, gap_query, max_results - seen, page_size, watermark, 0)
+
+def fetch_arxiv_data(topic: str, max_results: int = 10, page_size: int = ARXIV_PAGE_SIZE,
+                     incremental: bool = False) -> pd.DataFrame:
+    """
+    Fetches up to max_results papers for a topic, paging through the API.
+
+    With incremental=True only papers newer than the topic's stored watermark
+    are returned, and the watermark is advanced before returning.
+    """
+    try:
+        print(f"Fetching up to {max_results} arXiv papers for '{topic}'...")
+        watermark = ArxivWatermark.load(topic) if incremental else None
+        pages = list(iter_arxiv_pages(topic, max_results=max_results, page_size=page_size, watermark=watermark))
+        if watermark is not None:
+            watermark.commit()
+        return pd.concat(pages, ignore_index=True) if pages else pd.DataFrame()
+
     except Exception as e:
         print(f"An error occurred in fetch_arxiv_data: {e}")
-        return pd.DataFrame()
\ No newline at end of file
+        return pd.DataFrame()
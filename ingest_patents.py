@@ -1,117 +1,290 @@
-import requests  # Fallback, but primary is Selenium
+import os
+import requests
 import pandas as pd
-from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import quote_plus
+import threading
 import time
 import re
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+import concurrent.futures
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from browser_pool import get_browser_pool, USER_AGENT
+from filtering import keyword_mask
+from metrics import inc, stage_timer
 
-def fetch_patent_data(topic: str, max_results: int = 10, retries: int = 3) -> pd.DataFrame:
-    formatted_topic = quote_plus(topic)
-    target_url = f"https://patents.google.com/?q=({formatted_topic})&num={max_results}"
-
-    # Selenium setup (headless for efficiency)
-    options = Options()
-    options.add_argument("--headless")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
-
-    driver = None
-    for attempt in range(1, retries + 1):
+def _load_results_page(url: str) -> str:
+    """Loads a search page in a pooled browser session and returns the rendered HTML."""
+    with get_browser_pool().session() as driver:
+        driver.get(url)
         try:
-            print(f"Fetching patents for '{topic}' with Selenium (attempt {attempt})...")
-            driver = webdriver.Chrome(options=options)
-            driver.get(target_url)
-            
             # Wait for results to load
             WebDriverWait(driver, 10).until(
                 EC.presence_of_element_located((By.CSS_SELECTOR, "search-result-item"))
             )
-            
-            soup = BeautifulSoup(driver.page_source, 'lxml')
-            results = soup.select('search-result-item')  # Container from SO/ common structure
-            
-            if not results:
-                print("No results found. Trying fallback selectors.")
-                results = soup.select('div.result') or soup.select('article') or []
+        except TimeoutException:
+            # An empty or slow results page is not a browser fault; let the parser decide, but leave a trace
+            # so a scrape that stopped rendering results can be told apart from topics with no patents
+            print(f"Patent results did not render within 10s: {url}")
+            inc("aetos_patent_render_timeouts_total")
+        return driver.page_source
+
+def _class_test(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+# Compiled once at import; these mirror the CSS selectors the scraper has always used
+_RESULT_ITEMS = etree.XPath("//search-result-item")  # Container from SO/ common structure
+_FALLBACK_RESULT_ITEMS = (etree.XPath(f"//div[{_class_test('result')}]"), etree.XPath("//article"))
+_TITLE_TAGS = (etree.XPath(".//h3//a"), etree.XPath(".//a[starts-with(@href, '/patent/')]//span"))
+_LINK_TAG = etree.XPath(".//a[starts-with(@href, '/patent/')]")
+_SNIPPET_TAGS = (etree.XPath(".//span[@id='htmlContent']"), etree.XPath(f".//*[{_class_test('snippet')}]"),
+                 etree.XPath(f".//div[{_class_test('description')}]"))
+_DATE_TAG = etree.XPath(f".//h4[{_class_test('dates')}]")
+_METADATA_TAG = etree.XPath(f".//h4[{_class_test('metadata')}]")
+
+_PUBLICATION_DATE_RE = re.compile(r'Publication date:\s*([\d-]+)')
+_INVENTOR_RE = re.compile(r'Inventor[:\s]*(.+?)(?=,\s*Assignee|$)', re.IGNORECASE)
+_ASSIGNEE_RE = re.compile(r'Assignee[:\s]*(.+?)(?=,\s*Inventor|$)', re.IGNORECASE)
+
+_PATENT_FETCH_MODES = ("auto", "http", "selenium")
+PATENT_FETCH_MODE = os.getenv("PATENT_FETCH_MODE", "auto")
+PATENT_PAGE_SIZE = 10
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def _first(element, xpaths):
+    for xpath in xpaths:
+        found = xpath(element)
+        if found:
+            return found[0]
+    return None
+
+def _first_nonempty(root, xpaths) -> list:
+    for xpath in xpaths:
+        found = xpath(root)
+        if found:
+            return found
+    return []
+
+def _text(element) -> str:
+    # Same result as BeautifulSoup's get_text(strip=True): stripped text nodes joined without separators
+    return ''.join(s.strip() for s in element.itertext()) if element is not None else ''
+
+def parse_patent_html(html, max_results: int = None) -> list:
+    """
+    Parses a Google Patents search results page (raw bytes or str) into patent
+    dicts. Needs no browser or network, so saved pages can be parsed offline.
+    """
+    if not html:
+        return []
+    try:
+        root = lxml_html.fromstring(html)
+    except (etree.ParserError, ValueError):
+        return []
+
+    results = _RESULT_ITEMS(root)
+    if not results:
+        results = _first_nonempty(root, _FALLBACK_RESULT_ITEMS)
+
+    patents = []
+    for item in results[:max_results]:
+        # Title: h3 or a inside
+        title_tag = _first(item, _TITLE_TAGS)
+        if title_tag is None:
+            continue
+        title = _text(title_tag)
+
+        # Link
+        link_tags = _LINK_TAG(item)
+        patent_url = f"https://patents.google.com{link_tags[0].get('href')}" if link_tags else ''
+
+        # Summary/Snippet: span with abstract or description
+        summary = _text(_first(item, _SNIPPET_TAGS))
+
+        # Date: h4.dates (from SO)
+        date_tags = _DATE_TAG(item)
+        match = _PUBLICATION_DATE_RE.search(_text(date_tags[0])) if date_tags else None
+        published = match.group(1) if match else 'N/A'
+
+        # Authors/Inventors & Assignee
+        authors = []
+        provider_company = 'N/A'
+        metadata_tags = _METADATA_TAG(item)
+        if metadata_tags:
+            metadata_text = _text(metadata_tags[0])
+            inventor_match = _INVENTOR_RE.search(metadata_text)
+            if inventor_match:
+                authors = [a.strip() for a in inventor_match.group(1).split(',')]
 
+            assignee_match = _ASSIGNEE_RE.search(metadata_text)
+            if assignee_match:
+                provider_company = assignee_match.group(1).strip()
+
+        patents.append({
+            'id': patent_url,
+            'title': title,
+            'summary': summary,
+            'published': published,
+            'authors': authors,
+            'source': 'google_patents',
+            'provider_company': provider_company
+        })
+
+    return patents
+
+def _parse_patent_file(path: str, max_results: int = None) -> list:
+    with open(path, 'rb') as f:
+        return parse_patent_html(f.read(), max_results)
+
+def parse_patent_files(paths: list, max_results: int = None, processes: int = None) -> pd.DataFrame:
+    """Parses saved result pages in bulk, spread over worker processes."""
+    if not paths:
+        return pd.DataFrame()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        chunksize = max(1, len(paths) // ((processes or os.cpu_count() or 1) * 4))
+        pages = executor.map(_parse_patent_file, paths, [max_results] * len(paths), chunksize=chunksize)
+        patents = [patent for page in pages for patent in page]
+    return pd.DataFrame(patents)
+
+def _get_http_session() -> requests.Session:
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                                  max_retries=Retry(total=2, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504)))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"User-Agent": USER_AGENT, "Accept-Language": "en-US,en;q=0.9"})
+            _http_session = session
+        return _http_session
+
+def _fetch_html_http(url: str) -> bytes:
+    response = _get_http_session().get(url, timeout=20)
+    response.raise_for_status()
+    return response.content
+
+def _fetch_and_parse(load, url: str, max_results: int, method: str) -> list:
+    """Fetches one results page with `load` (HTTP or Selenium) and parses it, timing both stages."""
+    try:
+        with stage_timer("fetch", source="google_patents"):
+            html = load(url)
+    except Exception:
+        inc("aetos_source_requests_total", source="google_patents", method=method, outcome="error")
+        raise
+    inc("aetos_source_requests_total", source="google_patents", method=method, outcome="ok")
+    with stage_timer("parse", source="google_patents"):
+        return parse_patent_html(html, max_results)
+
+def _filter_relevant(patents: list, topic: str) -> pd.DataFrame:
+    patents_df = pd.DataFrame(patents)
+    if patents_df.empty:
+        return patents_df
+    relevant = keyword_mask(patents_df['title'] + ' ' + patents_df['summary'], topic)
+    return patents_df[relevant].reset_index(drop=True)
+
+def fetch_patent_data(topic: str, max_results: int = 10, retries: int = 3, page: int = 0, mode: str = None,
+                      date_from: str = None, date_to: str = None) -> pd.DataFrame:
+    """
+    Fetches one page of Google Patents results for a topic, optionally limited
+    to priority dates between date_from and date_to (YYYY-MM-DD).
+
+    mode "http" uses plain pooled HTTP requests, "selenium" renders the page
+    in a pooled browser, and "auto" (the default) tries HTTP first and only
+    escalates to Selenium when the HTTP response yields no results.
+    """
+    mode = mode or PATENT_FETCH_MODE
+    if mode not in _PATENT_FETCH_MODES:
+        raise ValueError(f"Unknown patent fetch mode '{mode}'. Expected one of {', '.join(_PATENT_FETCH_MODES)}.")
+
+    formatted_topic = quote_plus(topic)
+    target_url = f"https://patents.google.com/?q=({formatted_topic})&num={max_results}"
+    if page:
+        target_url += f"&page={page}"
+    if date_from:
+        target_url += f"&after=priority:{date_from.replace('-', '')}"
+    if date_to:
+        target_url += f"&before=priority:{date_to.replace('-', '')}"
+
+    for attempt in range(1, retries + 1):
+        try:
             patents = []
-            for item in results[:max_results]:
-                # Title: h3 or a inside
-                title_tag = item.select_one('h3 a') or item.select_one('a[href^="/patent/"] span')
-                if not title_tag:
-                    continue
-                title = title_tag.get_text(strip=True)
-
-                # Link
-                link_tag = item.select_one('a[href^="/patent/"]')
-                patent_url = f"https://patents.google.com{link_tag['href']}" if link_tag else ''
-
-                # Summary/Snippet: span with abstract or description
-                snippet_tag = item.select_one('span#htmlContent') or item.select_one('.snippet') or item.select_one('div.description')
-                summary = snippet_tag.get_text(strip=True) if snippet_tag else ''
-
-                # Date: h4.dates (from SO)
-                date_tag = item.select_one('h4.dates')
-                date_text = date_tag.get_text(strip=True) if date_tag else ''
-                match = re.search(r'Publication date:\s*([\d-]+)', date_text)
-                published = match.group(1) if match else 'N/A'
-
-                # Authors/Inventors & Assignee
-                authors = []
-                provider_company = 'N/A'
-                metadata_tag = item.select_one('h4.metadata')
-                if metadata_tag:
-                    metadata_text = metadata_tag.get_text(strip=True)
-                    inventor_match = re.search(r'Inventor[:\s]*(.+?)(?=,\s*Assignee|$)', metadata_text, re.IGNORECASE)
-                    if inventor_match:
-                        authors = [a.strip() for a in inventor_match.group(1).split(',')]
-                    
-                    assignee_match = re.search(r'Assignee[:\s]*(.+?)(?=,\s*Inventor|$)', metadata_text, re.IGNORECASE)
-                    if assignee_match:
-                        provider_company = assignee_match.group(1).strip()
-
-
-                patents.append({
-                    'id': patent_url,
-                    'title': title,
-                    'summary': summary,
-                    'published': published,
-                    'authors': authors,
-                    'source': 'google_patents',
-                    'provider_company': provider_company
-                })
+            if mode in ("http", "auto"):
+                print(f"Fetching patents for '{topic}' (page {page}) over HTTP (attempt {attempt})...")
+                try:
+                    patents = _fetch_and_parse(_fetch_html_http, target_url, max_results, "http")
+                except requests.RequestException as e:
+                    if mode == "http":
+                        raise
+                    print(f"HTTP patent fetch failed: {e}")
+                if not patents and mode == "auto":
+                    print("No results in static HTML. Escalating to Selenium.")
+
+            if not patents and mode in ("selenium", "auto"):
+                print(f"Fetching patents for '{topic}' (page {page}) with Selenium (attempt {attempt})...")
+                patents = _fetch_and_parse(_load_results_page, target_url, max_results, "selenium")
 
             print(f"Successfully fetched {len(patents)} patents.")
 
             # --- RELEVANCE VALIDATION STEP (matching arXiv) ---
             print(f"--- Relevance Check for Patents ---")
-            relevant_patents = []
-            topic_keywords = set(topic.lower().split())
-            for p in patents:
-                content = (p['title'] + ' ' + p['summary']).lower()
-                if any(keyword in content for keyword in topic_keywords):
-                    relevant_patents.append(p)
-            
+            with stage_timer("filter", source="google_patents"):
+                relevant_patents = _filter_relevant(patents, topic)
+
             print(f"--- Found {len(patents)} total patents, {len(relevant_patents)} are relevant. ---")
             time.sleep(3)
-            return pd.DataFrame(relevant_patents)
+            return relevant_patents
             
         except Exception as e:
             print(f"Patent fetch attempt {attempt}/{retries} failed: {e}")
-            if driver:
-                driver.quit()
             if attempt < retries:
                 sleep_time = 3 * attempt
                 print(f"Retrying after {sleep_time}s...")
                 time.sleep(sleep_time)
 
-    if driver:
-        driver.quit()
     print("All patent fetching attempts failed.")
-    return pd.DataFrame()
\ No newline at end of file
+    return pd.DataFrame()
+
+def fetch_patent_pages(requests_list: list, max_results: int = 10, max_workers: int = None) -> pd.DataFrame:
+    """
+    Fetches several (topic, page) result pages concurrently through the browser
+    pool and returns them as one DataFrame, without duplicate patent ids.
+    """
+    max_workers = max_workers or get_browser_pool().max_size
+    frames = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch_patent_data, topic, max_results=max_results, page=page): (topic, page)
+            for topic, page in requests_list
+        }
+        for future in concurrent.futures.as_completed(futures):
+            topic, page = futures[future]
+            try:
+                frames.append(future.result())
+            except Exception as e:
+                print(f"Patent fetch for '{topic}' page {page} failed: {e}")
+
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).drop_duplicates(subset=['id'])
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Parse saved Google Patents result pages offline.")
+    parser.add_argument("--parse", nargs="+", metavar="HTML", required=True, help="Saved result pages to parse.")
+    parser.add_argument("--processes", type=int, default=None, help="Parser processes (default: one per CPU).")
+    parser.add_argument("--out", help="Write the patents to this JSON file (one record per line).")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    parsed = parse_patent_files(args.parse, processes=args.processes)
+    elapsed = time.perf_counter() - started
+    print(f"Parsed {len(parsed)} patents from {len(args.parse)} pages in {elapsed:.2f}s "
+          f"({len(args.parse) / max(elapsed, 1e-9):.0f} pages/s).")
+    if args.out:
+        parsed.to_json(args.out, orient="records", lines=True)
@@ -4,19 +4,69 @@ load_dotenv()
 
 import os, json, time, re, google.generativeai as genai
 from google.api_core.exceptions import ResourceExhausted
+from llm_cache import analysis_cache, make_cache_key
+from rate_limiter import gemini_limiter, estimate_tokens
+from metrics import inc, stage_timer
 
 generation_config = genai.types.GenerationConfig(
     response_mime_type="application/json",
 )
 
-# ... (keep existing get_gemini_analysis function) ...
-def get_gemini_analysis(text: str, max_retries: int = 3) -> dict:
+MODEL_NAME = 'gemini-2.0-flash-lite'
+# Bump whenever the analysis prompt or its output schema changes so cached results are not reused.
+ANALYSIS_PROMPT_VERSION = "1"
+# Fields of the analysis prompt's output, i.e. what a duplicate can inherit from its canonical document
+ANALYSIS_FIELDS = ("TRL", "TRL_justification", "strategic_summary", "technologies", "key_relationships",
+                   "country", "provider_company", "funding_details")
+
+def _generate(model, prompt: str, kind: str = "analysis"):
+    """
+    Calls Gemini through the shared rate limiter and feeds quota errors back
+    into it. `kind` (analysis, batch or synthesis) labels the call's metrics.
+    """
+    estimated = estimate_tokens(prompt)
+    waited = gemini_limiter.acquire(estimated)
+    if waited:
+        inc("aetos_llm_quota_waits_total", kind=kind)
+        inc("aetos_llm_quota_wait_seconds_total", waited, kind=kind)
+    try:
+        with stage_timer("llm", source="gemini"):
+            response = model.generate_content(prompt)
+    except ResourceExhausted:
+        inc("aetos_llm_requests_total", kind=kind, outcome="throttled")
+        gemini_limiter.on_throttled()
+        raise
+    except Exception:
+        inc("aetos_llm_requests_total", kind=kind, outcome="error")
+        raise
+    inc("aetos_llm_requests_total", kind=kind, outcome="ok")
+    gemini_limiter.on_success()
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and getattr(usage, "total_token_count", None):
+        inc("aetos_llm_tokens_total", usage.total_token_count, kind=kind)
+        gemini_limiter.record_usage(estimated, usage.total_token_count)
+    return response
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    # Quota errors wait on the limiter's shared cooldown instead of sleeping here
+    return 0 if isinstance(error, ResourceExhausted) else min(30, 2 ** (attempt + 1))
+
+def _analysis_cache_key(text: str) -> str:
+    return make_cache_key(text, MODEL_NAME, ANALYSIS_PROMPT_VERSION)
+
+def get_gemini_analysis(text: str, max_retries: int = 3, use_cache: bool = True) -> dict:
     if not text or len(text.split()) < 25:
         return {"TRL": 0, "strategic_summary": "Not analyzed: Abstract too short."}
 
+    cache_key = _analysis_cache_key(text)
+    if use_cache:
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     api_key = os.getenv("GEMINI_API_KEY")
     genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.0-flash-lite', generation_config=generation_config)
+    model = genai.GenerativeModel(MODEL_NAME, generation_config=generation_config)
     
     prompt = f"""
     As a senior defense technology analyst, analyze the following abstract. Provide a structured intelligence report in JSON format.
@@ -39,82 +89,158 @@ def get_gemini_analysis(text: str, max_retries: int = 3) -> dict:
     """
 
     for attempt in range(max_retries):
+        if attempt:
+            inc("aetos_llm_retries_total", kind="analysis")
         try:
-            response = model.generate_content(prompt)
+            response = _generate(model, prompt)
             
             if not response.text:
                 raise ValueError("Received empty response text from Gemini.")
 
             match = re.search(r'\{.*\}', response.text, re.DOTALL)
             if match:
-                return json.loads(match.group(0))
+                result = json.loads(match.group(0))
+                if isinstance(result, dict) and result.get("TRL", 0) != 0:
+                    analysis_cache.set(cache_key, result, model=MODEL_NAME, prompt_version=ANALYSIS_PROMPT_VERSION)
+                return result
             else:
                 raise ValueError("No JSON object found in Gemini response.")
 
         except (ResourceExhausted, Exception) as e:
             print(f"Error in get_gemini_analysis (Attempt {attempt + 1}/{max_retries}): {e}. Waiting...")
             if attempt < max_retries - 1:
-                time.sleep(60)
+                time.sleep(_retry_delay(e, attempt))
             
     return {"TRL": 0, "strategic_summary": "Analysis failed after all retries."}
 
-def get_gemini_analysis(text: str, max_retries: int = 3) -> dict:
-    if not text or len(text.split()) < 25:
-        return {"TRL": 0, "strategic_summary": "Not analyzed: Abstract too short."}
 
-    api_key = os.getenv("GEMINI_API_KEY")
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.0-flash-lite', generation_config=generation_config)
-    
+ANALYSIS_BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", 5))
+
+def _validate_analysis(item) -> dict:
+    """Returns a cleaned analysis dict, or None if the item is unusable."""
+    if not isinstance(item, dict):
+        return None
+    try:
+        trl = int(item.get("TRL"))
+    except (TypeError, ValueError):
+        return None
+    if not 1 <= trl <= 9 or not item.get("strategic_summary"):
+        return None
+    technologies = item.get("technologies", [])
+    if not isinstance(technologies, list):
+        return None
+    cleaned = {k: v for k, v in item.items() if k != "doc_id"}
+    cleaned["TRL"] = trl
+    return cleaned
+
+def _request_batch_analysis(model, texts_by_id: dict, max_retries: int) -> dict:
+    """Sends one multi-abstract prompt and returns the validated items keyed by doc id."""
+    abstracts = "\n\n".join(f'[{doc_id}]\n"{text}"' for doc_id, text in texts_by_id.items())
     prompt = f"""
-    As a senior defense technology analyst, analyze the following abstract. Provide a structured intelligence report in JSON format.
+    As a senior defense technology analyst, analyze each of the following abstracts independently. Each abstract is preceded by its document id in square brackets.
 
-    Abstract: "{text}"
+    Abstracts:
+    {abstracts}
 
-    Your entire output must be a single, valid JSON object.
-    {{
-      "TRL": <integer_from_1_to_9>,
-      "TRL_justification": "A brief explanation for the TRL score.",
-      "strategic_summary": "A concise, one-sentence summary of why this research is important.",
-      "technologies": ["List", "of", "key", "technologies"],
-      "key_relationships": [
-        {{"subject": "Technology A", "relationship": "is used to improve", "object": "Technology B"}}
-      ],
-      "country": "The country of origin of the research, if mentioned.",
-      "provider_company": "The company or institution providing the technology, if mentioned.",
-      "funding_details": "Any details about funding for this research, if mentioned."
-    }}
+    Your entire output must be a single, valid JSON array with exactly one object per document id, in this format:
+    [
+      {{
+        "doc_id": "<the document id>",
+        "TRL": <integer_from_1_to_9>,
+        "TRL_justification": "A brief explanation for the TRL score.",
+        "strategic_summary": "A concise, one-sentence summary of why this research is important.",
+        "technologies": ["List", "of", "key", "technologies"],
+        "key_relationships": [
+          {{"subject": "Technology A", "relationship": "is used to improve", "object": "Technology B"}}
+        ],
+        "country": "The country of origin of the research, if mentioned.",
+        "provider_company": "The company or institution providing the technology, if mentioned.",
+        "funding_details": "Any details about funding for this research, if mentioned."
+      }}
+    ]
     """
 
     for attempt in range(max_retries):
+        if attempt:
+            inc("aetos_llm_retries_total", kind="batch")
         try:
-            response = model.generate_content(prompt)
-            
+            response = _generate(model, prompt, kind="batch")
+
             if not response.text:
                 raise ValueError("Received empty response text from Gemini.")
 
-            match = re.search(r'\{.*\}', response.text, re.DOTALL)
-            if match:
-                return json.loads(match.group(0))
-            else:
-                raise ValueError("No JSON object found in Gemini response.")
+            match = re.search(r'\[.*\]', response.text, re.DOTALL)
+            if not match:
+                raise ValueError("No JSON array found in Gemini batch response.")
+
+            validated = {}
+            for item in json.loads(match.group(0)):
+                doc_id = str(item.get("doc_id", "")) if isinstance(item, dict) else ""
+                cleaned = _validate_analysis(item)
+                if doc_id in texts_by_id and cleaned is not None:
+                    validated[doc_id] = cleaned
+            return validated
 
         except (ResourceExhausted, Exception) as e:
-            print(f"Error in get_gemini_analysis (Attempt {attempt + 1}/{max_retries}): {e}. Waiting...")
+            print(f"Error in get_gemini_analysis_batch (Attempt {attempt + 1}/{max_retries}): {e}. Waiting...")
             if attempt < max_retries - 1:
-                time.sleep(60)
-            
-    return {"TRL": 0, "strategic_summary": "Analysis failed after all retries."}
+                time.sleep(_retry_delay(e, attempt))
+
+    return {}
+
+def get_gemini_analysis_batch(texts: list, batch_size: int = ANALYSIS_BATCH_SIZE, max_retries: int = 2) -> list:
+    """
+    Analyzes several abstracts per Gemini request.
+
+    Returns one result dict per input text, in input order. Cached texts are
+    answered without a request, and any item the batch response does not cover
+    with a valid object falls back to a single-document get_gemini_analysis call.
+    """
+    results = [None] * len(texts)
+    pending = []
+    for i, text in enumerate(texts):
+        if not text or len(text.split()) < 25:
+            results[i] = {"TRL": 0, "strategic_summary": "Not analyzed: Abstract too short."}
+            continue
+        cached = analysis_cache.get(_analysis_cache_key(text))
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append(i)
+
+    if not pending:
+        return results
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel(MODEL_NAME, generation_config=generation_config)
+
+    batch_size = max(1, batch_size)
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        texts_by_id = {f"doc_{i}": texts[i] for i in chunk}
+        validated = _request_batch_analysis(model, texts_by_id, max_retries) if len(chunk) > 1 else {}
+
+        for i in chunk:
+            analysis = validated.get(f"doc_{i}")
+            if analysis is None:
+                # Missing or malformed in the batch response: retry this one on its own
+                results[i] = get_gemini_analysis(texts[i], use_cache=False)
+                continue
+            analysis_cache.set(_analysis_cache_key(texts[i]), analysis, model=MODEL_NAME, prompt_version=ANALYSIS_PROMPT_VERSION)
+            results[i] = analysis
+
+    return results
 
 
 def get_gemini_topic_synthesis(summaries: list, topic: str) -> dict:
-    """Synthesizes summaries and generates mock analytics data."""
+    """Synthesizes summaries into an intelligence report. Chart data comes from analytics.py."""
     if not summaries:
         return {"error": "No content provided for synthesis."}
     
     api_key = os.getenv("GEMINI_API_KEY")
     genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.0-flash-lite', generation_config=generation_config)
+    model = genai.GenerativeModel(MODEL_NAME, generation_config=generation_config)
     
     combined_text = "\n\n---\n\n".join(summaries)
     
@@ -130,30 +256,17 @@ def get_gemini_topic_synthesis(summaries: list, topic: str) -> dict:
     - `overall_summary`: A high-level summary of the technology area.
     - `emerging_signals`: A list of 2-3 early but potentially significant trends.
     - `key_players`: A list of the most frequently mentioned companies, countries, or institutions.
-    - `mock_s_curve`: An array of 7 objects, each with a 'year' and 'cumulative_count', representing a plausible S-curve for this technology's adoption.
-    - `mock_trl_progression`: An object with two keys: 'history' (an array of 5 objects with 'year' and 'avg_trl') and 'forecast' (an array of 3 objects with 'year' and 'avg_trl'). This should represent a plausible TRL progression and forecast.
-
-    Example for s_curve and trl_progression:
-    "mock_s_curve": [
-      {{"year": 2018, "cumulative_count": 5}}, {{"year": 2019, "cumulative_count": 15}}, ...
-    ],
-    "mock_trl_progression": {{
-      "history": [{{"year": 2020, "avg_trl": 2.5}}, {{"year": 2021, "avg_trl": 3.1}}, ...],
-      "forecast": [{{"year": 2025, "avg_trl": 5.3}}, {{"year": 2026, "avg_trl": 5.8}}, ...]
-    }}
 
     JSON Output Format:
     {{
       "overall_summary": "...",
       "emerging_signals": ["...", "..."],
-      "key_players": ["...", "..."],
-      "mock_s_curve": [{{...}}],
-      "mock_trl_progression": {{ "history": [{{...}}], "forecast": [{{...}}] }}
+      "key_players": ["...", "..."]
     }}
     """
     
     try:
-        response = model.generate_content(prompt)
+        response = _generate(model, prompt, kind="synthesis")
         if not response.text:
             raise ValueError("Received empty response text from Gemini for synthesis.")
         
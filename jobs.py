@@ -0,0 +1,97 @@
+# jobs.py
+"""
+Bookkeeping for asynchronous analysis jobs.
+
+/api/analyze enqueues worker.run_analysis_pipeline_task and hands back the
+Celery task id as the job id. Each topic has one Redis key, claimed with
+SET NX, that holds the id of the job currently analyzing it. A second request
+for the same topic gets the running job's id instead of starting another run.
+The worker releases the key when its run finishes. The TTL only matters if a
+worker dies mid-run.
+
+Claiming also records the job id itself. Celery reports PENDING for any id it
+has no result for, so this record is what tells a queued job from an unknown one.
+"""
+
+import os
+import threading
+
+# Enqueued by name (celery_app.send_task), so callers need not import the worker
+ANALYSIS_TASK = 'worker.run_analysis_pipeline_task'
+JOB_LOCK_TTL = int(os.getenv("ANALYSIS_JOB_LOCK_TTL", 3 * 60 * 60))
+JOB_REDIS_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+
+_LOCK_PREFIX = "aetos:jobs:topic"
+_JOB_PREFIX = "aetos:jobs:id"
+
+# Delete the key only if it still names this job, so a late release cannot drop a newer job's claim
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def _redis():
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            import redis
+            _client = redis.Redis.from_url(JOB_REDIS_URL, socket_timeout=2, socket_connect_timeout=2,
+                                           decode_responses=True)
+            _client_pid = os.getpid()
+        return _client
+
+
+def topic_lock_key(topic: str) -> str:
+    return f"{_LOCK_PREFIX}:{(topic or '').strip().lower()}"
+
+
+def claim_topic(topic: str, job_id: str) -> str:
+    """Claims the topic for job_id. Returns the id of the job that owns it, which is job_id on success."""
+    client = _redis()
+    key = topic_lock_key(topic)
+    for _ in range(3):
+        if client.set(key, job_id, nx=True, ex=JOB_LOCK_TTL):
+            client.set(f"{_JOB_PREFIX}:{job_id}", key, ex=JOB_LOCK_TTL)
+            return job_id
+        owner = client.get(key)
+        if owner:
+            return owner
+        # The previous claim expired between SET and GET; try again
+    return client.get(key) or job_id
+
+
+def release_topic(topic: str, job_id: str) -> bool:
+    return bool(_redis().eval(_RELEASE_SCRIPT, 1, topic_lock_key(topic), job_id))
+
+
+def job_exists(job_id: str) -> bool:
+    """True if job_id was claimed within the last JOB_LOCK_TTL seconds."""
+    return bool(_redis().exists(f"{_JOB_PREFIX}:{job_id}"))
+
+
+def queue_lengths(queues) -> dict:
+    """Messages waiting in each Celery queue. With the Redis broker a queue is a list named after it."""
+    client = _redis()
+    return {queue: client.llen(queue) for queue in queues}
+
+
+def job_payload(result) -> dict:
+    """JSON-friendly view of a Celery AsyncResult: state, latest progress, and the outcome once finished."""
+    from celery import states
+    payload = {"job_id": result.id, "state": result.state}
+    info = result.info
+    if result.state == states.SUCCESS:
+        payload["result"] = info
+    elif result.state in states.PROPAGATE_STATES:
+        payload["error"] = str(info)
+    elif isinstance(info, dict):
+        payload["progress"] = info
+    payload["finished"] = result.state in states.READY_STATES
+    return payload
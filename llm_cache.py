@@ -0,0 +1,143 @@
+# llm_cache.py
+"""
+Content-addressed cache for LLM analysis results.
+
+Entries are keyed by a hash of the normalized input text, the model name and
+the prompt version, so the same abstract is only ever sent to Gemini once per
+prompt revision. Lookups go through a small in-process LRU first and fall back
+to a MongoDB collection that survives restarts and is shared by every worker.
+"""
+
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pymongo import ASCENDING
+from metrics import inc
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Collapses whitespace and case so trivial formatting changes still hit."""
+    return _WHITESPACE_RE.sub(" ", text or "").strip().lower()
+
+
+def make_cache_key(text: str, model: str, prompt_version: str) -> str:
+    payload = f"{model}\x00{prompt_version}\x00{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResultCache:
+    """Two-tier (LRU + MongoDB) cache with TTL expiry and hit/miss counters."""
+
+    def __init__(self, collection_name: str = "llm_cache", max_entries: int = None, ttl_days: float = None):
+        self.collection_name = collection_name
+        self.max_entries = max_entries or int(os.getenv("LLM_CACHE_MAX_ENTRIES", 2048))
+        self.ttl = timedelta(days=ttl_days or float(os.getenv("LLM_CACHE_TTL_DAYS", 30)))
+        self.enabled = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._collection = None
+        self._mongo_unavailable = False
+        self.counters = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def _get_collection(self):
+        if self._collection is not None or self._mongo_unavailable:
+            return self._collection
+        try:
+            from database import get_db_connection
+            collection = get_db_connection()[self.collection_name]
+            collection.create_index([("key", ASCENDING)], unique=True)
+            # MongoDB's TTL monitor removes documents once expires_at has passed
+            collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+            self._collection = collection
+        except Exception as e:
+            print(f"LLM cache: MongoDB tier unavailable, using in-process cache only ({e})")
+            self._mongo_unavailable = True
+        return self._collection
+
+    def _remember(self, key: str, value: dict, expires_at: datetime):
+        with self._lock:
+            self._lru[key] = (value, expires_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        now = datetime.utcnow()
+        hit = None
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._lru.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    hit = dict(value)
+                else:
+                    del self._lru[key]
+        if hit is not None:
+            inc("aetos_cache_requests_total", cache=self.collection_name, result="memory_hit")
+            return hit
+
+        collection = self._get_collection()
+        if collection is not None:
+            try:
+                doc = collection.find_one({"key": key, "expires_at": {"$gt": now}}, {"_id": 0, "value": 1, "expires_at": 1})
+            except Exception as e:
+                print(f"LLM cache: lookup failed ({e})")
+                doc = None
+            if doc:
+                self._remember(key, doc["value"], doc["expires_at"])
+                with self._lock:
+                    self.counters["mongo_hits"] += 1
+                inc("aetos_cache_requests_total", cache=self.collection_name, result="mongo_hit")
+                return dict(doc["value"])
+
+        with self._lock:
+            self.counters["misses"] += 1
+        inc("aetos_cache_requests_total", cache=self.collection_name, result="miss")
+        return None
+
+    def set(self, key: str, value: dict, model: str = None, prompt_version: str = None):
+        if not self.enabled:
+            return
+        now = datetime.utcnow()
+        expires_at = now + self.ttl
+        self._remember(key, value, expires_at)
+        with self._lock:
+            self.counters["writes"] += 1
+
+        collection = self._get_collection()
+        if collection is None:
+            return
+        try:
+            collection.update_one(
+                {"key": key},
+                {"$set": {"value": value, "model": model, "prompt_version": prompt_version,
+                          "created_at": now, "expires_at": expires_at}},
+                upsert=True,
+            )
+        except Exception as e:
+            print(f"LLM cache: write failed ({e})")
+
+    def clear_memory(self):
+        with self._lock:
+            self._lru.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self._lru)
+        lookups = stats["memory_hits"] + stats["mongo_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["mongo_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+analysis_cache = LLMResultCache()
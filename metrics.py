@@ -0,0 +1,263 @@
+# metrics.py
+"""
+Pipeline and API metrics in the Prometheus text format, plus structured log events.
+
+Counters and histograms are recorded in-process and pushed as deltas to one
+Redis hash (the Celery broker) by a background thread every
+METRICS_FLUSH_SECONDS, at the end of every Celery task and before each
+scrape. Recording a sample never waits on Redis. /metrics on any API process
+therefore reports totals for the API, every worker and local runs together.
+Gauges such as the Celery queue depth are read at scrape time and never
+leave the process. If Redis is unreachable, /metrics falls back to this
+process's own numbers.
+
+log_event() prints one JSON object per line, so run-level events can be
+grepped or shipped to a log pipeline without parsing free text.
+"""
+
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_LOG_EVENTS = os.getenv("METRICS_LOG_EVENTS", "1") != "0"
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 10))
+METRICS_REDIS_URL = os.getenv("METRICS_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+METRICS_KEY = "aetos:metrics"
+# After a failed flush, stay local for this long instead of paying a Redis timeout on every call
+REDIS_RETRY_SECONDS = 30
+
+# Seconds; covers everything from a cached Mongo lookup to a slow Gemini batch
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# name -> (type, help). Only metrics listed here are exported.
+METRICS = {
+    "aetos_stage_seconds": ("histogram", "Time spent per pipeline stage (fetch, parse, filter, llm, db_write)."),
+    "aetos_arxiv_polite_wait_seconds_total": ("counter", "Time spent waiting between arXiv requests."),
+    "aetos_source_requests_total": ("counter", "Requests to document sources by outcome."),
+    "aetos_patent_render_timeouts_total": ("counter", "Selenium patent pages whose results never rendered."),
+    "aetos_llm_requests_total": ("counter", "Gemini requests by kind and outcome."),
+    "aetos_llm_retries_total": ("counter", "Gemini requests repeated after a failed attempt."),
+    "aetos_llm_quota_waits_total": ("counter", "Gemini requests that waited on the shared rate limiter."),
+    "aetos_llm_quota_wait_seconds_total": ("counter", "Time spent waiting on the shared Gemini rate limiter."),
+    "aetos_llm_tokens_total": ("counter", "Tokens Gemini reported as used."),
+    "aetos_cache_requests_total": ("counter", "Cache lookups by cache and result."),
+    "aetos_mongo_command_seconds": ("histogram", "MongoDB command latency by endpoint or task."),
+    "aetos_http_request_seconds": ("histogram", "API request latency by endpoint, method and status."),
+    "aetos_task_seconds": ("histogram", "Celery task run time by task and final state."),
+    "aetos_pipeline_documents_total": ("counter", "Documents per pipeline outcome, summed over finished runs."),
+    "aetos_celery_queue_length": ("gauge", "Messages waiting in a Celery queue."),
+}
+
+# What is running in this context: an API endpoint or "task:<name>". Labels Mongo latencies.
+current_endpoint = contextvars.ContextVar("aetos_endpoint", default="none")
+
+_lock = threading.Lock()
+_totals = {}
+_pending = {}
+_gauges = {}
+_last_flush = time.monotonic()
+_redis_down_until = 0.0
+_flusher = None
+_flusher_pid = None
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def _redis():
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            import redis
+            _client = redis.Redis.from_url(METRICS_REDIS_URL, socket_timeout=2, socket_connect_timeout=2,
+                                           decode_responses=True)
+            _client_pid = os.getpid()
+        return _client
+
+
+def _sample(name: str, suffix: str, labels: dict) -> str:
+    """Hash field for one sample: JSON [name, suffix, sorted label pairs]."""
+    return json.dumps([name, suffix, sorted((k, str(v)) for k, v in labels.items())], separators=(",", ":"))
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(max(METRICS_FLUSH_SECONDS - (time.monotonic() - _last_flush), 0.1))
+        if time.monotonic() - _last_flush >= METRICS_FLUSH_SECONDS:
+            flush()
+
+
+def _ensure_flusher():
+    """Starts this process's flush thread; called with _lock held."""
+    global _flusher, _flusher_pid
+    if _flusher_pid != os.getpid():
+        _flusher = threading.Thread(target=_flush_periodically, name="metrics-flush", daemon=True)
+        _flusher_pid = os.getpid()
+        _flusher.start()
+
+
+def _add(samples: list):
+    with _lock:
+        for field, value in samples:
+            _totals[field] = _totals.get(field, 0.0) + value
+            _pending[field] = _pending.get(field, 0.0) + value
+        _ensure_flusher()
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    if METRICS_ENABLED and value:
+        _add([(_sample(name, "", labels), float(value))])
+
+
+def observe(name: str, value: float, **labels):
+    """Adds one observation to a histogram."""
+    if not METRICS_ENABLED:
+        return
+    # Every bucket is written, even with 0, so each series exposes the full set of bounds
+    samples = [(_sample(name, "_bucket", {**labels, "le": repr(float(bound))}), 1.0 if value <= bound else 0.0)
+               for bound in BUCKETS]
+    samples.append((_sample(name, "_bucket", {**labels, "le": "+Inf"}), 1.0))
+    samples.append((_sample(name, "_sum", labels), float(value)))
+    samples.append((_sample(name, "_count", labels), 1.0))
+    _add(samples)
+
+
+def set_gauge(name: str, value: float, **labels):
+    if METRICS_ENABLED:
+        with _lock:
+            _gauges[_sample(name, "", labels)] = float(value)
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """Observes the wall time of the block into a histogram, whether or not it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def stage_timer(stage: str, **labels):
+    return timer("aetos_stage_seconds", stage=stage, **labels)
+
+
+def log_event(event: str, **fields):
+    """Prints one structured event as a single JSON line."""
+    if not METRICS_LOG_EVENTS:
+        return
+    record = {"ts": datetime.utcnow().isoformat(timespec="milliseconds") + "Z", "event": event,
+              "pid": os.getpid(), **fields}
+    print(json.dumps(record, default=str), flush=True)
+
+
+def flush() -> bool:
+    """Pushes the deltas recorded since the last flush to Redis. Returns False if they stayed local."""
+    global _pending, _last_flush, _redis_down_until
+    with _lock:
+        _last_flush = time.monotonic()
+        if _last_flush < _redis_down_until:
+            return False
+        if not _pending:
+            return True
+        pending, _pending = _pending, {}
+    try:
+        pipe = _redis().pipeline(transaction=False)
+        for field, value in pending.items():
+            pipe.hincrbyfloat(METRICS_KEY, field, value)
+        pipe.execute()
+        return True
+    except Exception as e:
+        print(f"Metrics: could not flush to Redis, keeping totals in-process ({e})")
+        with _lock:
+            _redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+            for field, value in pending.items():
+                _pending[field] = _pending.get(field, 0.0) + value
+        return False
+
+
+def snapshot() -> dict:
+    """This process's totals, keyed by sample."""
+    with _lock:
+        return {**_totals, **_gauges}
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sort_key(parsed):
+    name, suffix, labels, _ = parsed
+    series = [pair for pair in labels if pair[0] != "le"]
+    le = dict(labels).get("le")
+    bound = float("inf") if le == "+Inf" else float(le) if le is not None else 0.0
+    return name, series, ("_bucket", "_sum", "_count").index(suffix) if suffix else 0, bound
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    global _redis_down_until
+    samples = None
+    if flush():
+        try:
+            samples = {field: float(value) for field, value in _redis().hgetall(METRICS_KEY).items()}
+        except Exception as e:
+            print(f"Metrics: could not read totals from Redis, showing this process only ({e})")
+            _redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+    with _lock:
+        if samples is None:
+            samples = dict(_totals)
+        samples.update(_gauges)
+
+    parsed = []
+    for field, value in samples.items():
+        try:
+            name, suffix, labels = json.loads(field)
+        except ValueError:
+            continue
+        if name in METRICS:
+            parsed.append((name, suffix, [tuple(pair) for pair in labels], value))
+
+    lines = []
+    current = None
+    for name, suffix, labels, value in sorted(parsed, key=_sort_key):
+        if name != current:
+            kind, help_text = METRICS[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            current = name
+        label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+        lines.append(f"{name}{suffix}{{{label_text}}} {_format_value(value)}" if label_text
+                     else f"{name}{suffix} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def reset(shared: bool = False):
+    """Clears this process's metrics, and with shared=True the Redis totals as well."""
+    global _totals, _pending, _gauges
+    with _lock:
+        _totals, _pending, _gauges = {}, {}, {}
+    if shared:
+        _redis().delete(METRICS_KEY)
+
+
+def _reset_after_fork():
+    # Deltas recorded by the parent are the parent's to flush
+    global _lock, _client_lock, _totals, _pending, _gauges
+    _lock = threading.Lock()
+    _client_lock = threading.Lock()
+    _totals, _pending, _gauges = {}, {}, {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
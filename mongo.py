@@ -0,0 +1,177 @@
+# mongo.py
+"""
+Process-wide MongoDB connection manager.
+
+The API, Celery workers and local scripts all get their database handle from
+here, so each process keeps one pooled MongoClient for its lifetime instead of
+building a new one per request or per save. A client created before a fork is
+never reused in the child (pymongo clients are not fork-safe), and index
+creation runs once per process the first time the database is requested.
+"""
+
+import os
+import threading
+from pymongo import MongoClient, ASCENDING, monitoring
+from pymongo.errors import OperationFailure
+from dotenv import load_dotenv
+from search import ensure_search_indexes
+from convergence import ensure_convergence_indexes
+from metrics import observe, current_endpoint
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "aetos_db")
+
+_client = None
+_client_pid = None
+_indexes_ready = False
+_lock = threading.RLock()
+
+
+class _PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events so pool usage can be inspected at runtime."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"created": 0, "closed": 0, "checked_out": 0, "checked_in": 0, "checkout_failed": 0, "pool_cleared": 0}
+
+    def _bump(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def connection_ready(self, event): pass
+    def pool_cleared(self, event): self._bump("pool_cleared")
+    def connection_created(self, event): self._bump("created")
+    def connection_closed(self, event): self._bump("closed")
+    def connection_checked_out(self, event): self._bump("checked_out")
+    def connection_checked_in(self, event): self._bump("checked_in")
+    def connection_check_out_failed(self, event): self._bump("checkout_failed")
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.counts = {key: 0 for key in self.counts}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        counts["open"] = counts["created"] - counts["closed"]
+        counts["in_use"] = counts["checked_out"] - counts["checked_in"]
+        return counts
+
+
+_pool_listener = _PoolStatsListener()
+
+
+class _CommandLatencyListener(monitoring.CommandListener):
+    """Records each command's server round trip, labeled with the API endpoint or task that issued it."""
+
+    def _record(self, event, outcome):
+        observe("aetos_mongo_command_seconds", event.duration_micros / 1e6,
+                endpoint=current_endpoint.get(), command=event.command_name, outcome=outcome)
+
+    def started(self, event): pass
+    def succeeded(self, event): self._record(event, "ok")
+    def failed(self, event): self._record(event, "error")
+
+
+_command_listener = _CommandLatencyListener()
+
+
+def client_options() -> dict:
+    """MongoClient keyword arguments, read from the environment."""
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", 0)),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000)),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000)),
+        "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000)),
+        "readPreference": os.getenv("MONGO_READ_PREFERENCE", "primaryPreferred"),
+        "appname": os.getenv("MONGO_APP_NAME", "aetos"),
+    }
+
+
+def get_client() -> MongoClient:
+    global _client, _client_pid, _indexes_ready
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            # Drop (without closing) any client inherited from the parent process
+            _client = MongoClient(MONGO_URI, event_listeners=[_pool_listener, _command_listener], **client_options())
+            _client_pid = os.getpid()
+            _indexes_ready = False
+        return _client
+
+
+def get_db():
+    """Returns the application database, creating indexes on first use in this process."""
+    global _indexes_ready
+    db = get_client()[MONGO_DB_NAME]
+    if not _indexes_ready:
+        with _lock:
+            if not _indexes_ready:
+                ensure_indexes(db)
+                _indexes_ready = True
+    return db
+
+
+def ensure_indexes(db):
+    documents = db.documents
+    try:
+        documents.create_index([("id", ASCENDING)], unique=True, name="id_unique")
+    except OperationFailure as e:
+        # Existing duplicate ids block the unique index; keep lookups by id indexed anyway
+        print(f"MongoDB: could not create unique index on documents.id ({e}). Falling back to a non-unique index.")
+        documents.create_index([("id", ASCENDING)], name="id_lookup")
+    documents.create_index([("title", ASCENDING)])
+    documents.create_index([("technologies", ASCENDING)])
+    documents.create_index([("published", ASCENDING)])
+    documents.create_index([("source", ASCENDING)])
+    try:
+        ensure_search_indexes(db)
+    except OperationFailure as e:
+        # Only one text index is allowed per collection; an older one with other fields blocks ours
+        print(f"MongoDB: could not create search indexes on documents ({e}).")
+    ensure_convergence_indexes(db)
+    # document_embeddings is indexed by embeddings.py on first use, so the API does not load numpy here
+
+
+def pool_stats() -> dict:
+    client = _client if _client_pid == os.getpid() else None
+    options = client_options()
+    return {
+        "pid": os.getpid(),
+        "connected": client is not None,
+        "max_pool_size": options["maxPoolSize"],
+        "min_pool_size": options["minPoolSize"],
+        "read_preference": options["readPreference"],
+        "connections": _pool_listener.snapshot(),
+    }
+
+
+def close_client():
+    global _client, _client_pid, _indexes_ready
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+        _indexes_ready = False
+
+
+def _reset_after_fork():
+    global _client, _client_pid, _indexes_ready, _lock
+    _lock = threading.RLock()
+    _pool_listener.reset()
+    _client = None
+    _client_pid = None
+    _indexes_ready = False
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,344 @@
+# pipeline.py
+"""
+Asyncio fetch -> filter -> analyze -> save pipeline.
+
+Shared by the Celery task in worker.py and the local runner in main.py. Both
+sources are fetched at the same time and their documents are streamed through
+bounded queues into a fixed number of analysis workers, whose results are
+written to MongoDB in micro-batches as they arrive. Queue sizes are bounded by
+the concurrency settings, so memory does not grow with num_documents and the
+run takes roughly as long as its slowest stage.
+"""
+
+import os
+import asyncio
+import time
+import pandas as pd
+from ingest import iter_arxiv_pages, ArxivWatermark
+from ingest_patents import fetch_patent_pages, PATENT_PAGE_SIZE
+from database import save_to_db, SaveError
+from intelligence import get_gemini_analysis_batch, ANALYSIS_BATCH_SIZE, ANALYSIS_FIELDS
+from dedup import dedup_index, load_canonical_analyses
+from filtering import filter_candidates
+from run_state import RunCheckpoint, SAVED, FAILED
+from metrics import inc, log_event, stage_timer
+
+ANALYSIS_CONCURRENCY = int(os.getenv("PIPELINE_CONCURRENCY", 3))
+SAVE_BATCH_SIZE = int(os.getenv("PIPELINE_SAVE_BATCH_SIZE", 10))
+SAVE_FLUSH_SECONDS = float(os.getenv("PIPELINE_SAVE_FLUSH_SECONDS", 5))
+
+_DONE = object()
+
+
+def _inherit(record: dict, canonical_id: str, analysis: dict) -> dict:
+    """A duplicate document carrying its canonical document's analysis."""
+    return {**record, **analysis, 'duplicate_of': canonical_id}
+
+
+def _single_page(fetch, *args, **kwargs):
+    yield fetch(*args, **kwargs)
+
+
+def _patent_results(topic: str, max_results: int) -> pd.DataFrame:
+    """Up to max_results patents, fetched as result pages in parallel through the browser pool."""
+    page_size = max(1, min(PATENT_PAGE_SIZE, max_results))
+    pages = [(topic, page) for page in range(-(-max_results // page_size))]
+    return fetch_patent_pages(pages, max_results=page_size).head(max_results)
+
+
+def _filter_page(page_df: pd.DataFrame, topic: str, source: str) -> tuple:
+    with stage_timer("filter", source=source):
+        return filter_candidates(page_df, topic)
+
+
+def _record_run(topic: str, stats: dict, error: BaseException = None):
+    """Adds a finished run's document counts to the metrics and logs a pipeline_run_finished event."""
+    for outcome in ("fetched", "candidates", "duplicates", "analyzed", "failed", "saved"):
+        inc("aetos_pipeline_documents_total", stats.get(outcome, 0), outcome=outcome)
+    for stage, count in stats.get("filtered_out", {}).items():
+        inc("aetos_pipeline_documents_total", count, outcome=f"filtered_{stage}")
+    log_event("pipeline_run_finished", topic=topic, status="failed" if error else "ok",
+              error=repr(error) if error else None, **stats)
+
+
+def _source_pages(topic: str, max_per_source: int, arxiv_watermark: ArxivWatermark = None) -> dict:
+    """Maps each source name to a lazy iterator of DataFrame pages."""
+    return {
+        'arxiv': iter_arxiv_pages(topic, max_results=max_per_source, watermark=arxiv_watermark),
+        'google_patents': _single_page(_patent_results, topic, max_per_source),
+    }
+
+
+async def run_pipeline_async(topic: str, num_documents: int = 20, concurrency: int = None,
+                             batch_size: int = None, save_batch_size: int = None, incremental: bool = True,
+                             dedup: bool = True, progress=None, run_id: str = None, resume: bool = False) -> dict:
+    """
+    Runs the whole pipeline for one topic and returns per-stage counts.
+
+    With incremental=True (the default) arXiv paging stops at the topic's
+    watermark, so papers from earlier runs are not downloaded again. With
+    dedup=True near-duplicate abstracts skip the LLM and inherit the analysis
+    of their canonical document. `progress`, if given, is called as
+    progress(stage, stats) whenever a page, analysis batch or save completes.
+
+    Every candidate and its outcome is checkpointed under run_id (generated if
+    not given). With resume=True the run's unfinished candidates are re-queued
+    and anything it already fetched is skipped; see run_state.py.
+    """
+    concurrency = max(1, concurrency or ANALYSIS_CONCURRENCY)
+    batch_size = max(1, batch_size or ANALYSIS_BATCH_SIZE)
+    save_batch_size = max(1, save_batch_size or SAVE_BATCH_SIZE)
+    max_per_source = max(1, num_documents // 2)
+
+    if resume:
+        checkpoint = await asyncio.to_thread(RunCheckpoint.resume, run_id)
+    else:
+        try:
+            checkpoint = await asyncio.to_thread(RunCheckpoint.start, topic, num_documents, run_id)
+        except Exception as e:
+            print(f"Pipeline: could not create a run checkpoint, continuing without one: {e}")
+            checkpoint = None
+
+    async def update_checkpoint(method, *args):
+        if checkpoint is None:
+            return
+        try:
+            await asyncio.to_thread(getattr(checkpoint, method), *args)
+        except Exception as e:
+            print(f"Pipeline: checkpoint update ({method}) failed: {e}")
+
+    stats = {"run_id": checkpoint.run_id if checkpoint else run_id, "fetched": 0, "filtered_out": {}, "candidates": 0, "duplicates": 0, "analyzed": 0, "failed": 0, "saved": 0}
+    failed_sources = set()
+    # Sources with documents that failed analysis or saving; their watermark must not move past them
+    unsaved_sources = set()
+    # Near-duplicate bookkeeping: ids sent for analysis, their finished or failed analyses, and duplicates waiting on them
+    queued_ids = set()
+    failed_ids = set()
+    # Ids this run has already checkpointed; on resume, sources returning them again are skipped
+    known_ids = set()
+    analyses_by_id = {}
+    waiting_duplicates = {}
+    started = time.monotonic()
+
+    def report(stage):
+        if progress is None:
+            return
+        try:
+            progress(stage, {**stats, "filtered_out": dict(stats["filtered_out"]),
+                             "elapsed_seconds": round(time.monotonic() - started, 2)})
+        except Exception as e:
+            print(f"Pipeline: progress callback failed: {e}")
+
+    doc_queue = asyncio.Queue(maxsize=concurrency * batch_size * 2)
+    result_queue = asyncio.Queue(maxsize=save_batch_size * 2)
+
+    async def fetch_source(name, pages):
+        while True:
+            try:
+                # Each next() performs one blocking fetch, so it runs off the event loop
+                page_df = await asyncio.to_thread(next, pages, _DONE)
+            except Exception as e:
+                print(f"Pipeline: fetching from {name} failed: {e}")
+                failed_sources.add(name)
+                break
+            if page_df is _DONE:
+                break
+            if page_df is None or page_df.empty:
+                continue
+            stats["fetched"] += len(page_df)
+            candidates, drops = await asyncio.to_thread(_filter_page, page_df, topic, name)
+            for stage, count in drops.items():
+                stats["filtered_out"][stage] = stats["filtered_out"].get(stage, 0) + count
+            records = [r for r in candidates.to_dict('records') if r['id'] not in known_ids]
+            known_ids.update(r['id'] for r in records)
+            stats["candidates"] += len(records)
+            await update_checkpoint("add_candidates", records)
+            await enqueue(records)
+            report("fetching")
+
+    async def enqueue(records):
+        if dedup:
+            records = await resolve_duplicates(records)
+        for record in records:
+            queued_ids.add(record['id'])
+            await doc_queue.put(record)
+
+    async def resolve_duplicates(records):
+        """Parks or completes near-duplicates and returns the records that still need analysis."""
+        try:
+            canonical, duplicates = await asyncio.to_thread(dedup_index.assign, records)
+        except Exception as e:
+            print(f"Pipeline: duplicate detection failed, analyzing all documents: {e}")
+            return records
+        stats["duplicates"] += len(duplicates)
+        # Canonical documents of this page are about to be queued, so their duplicates can wait on them
+        queued_ids.update(record['id'] for record in canonical)
+
+        stored_ids = set()
+        for record, canonical_id in duplicates:
+            if canonical_id in analyses_by_id:
+                await result_queue.put(_inherit(record, canonical_id, analyses_by_id[canonical_id]))
+            elif canonical_id in queued_ids:
+                waiting_duplicates.setdefault(canonical_id, []).append(record)
+            elif canonical_id in failed_ids:
+                # Its canonical document failed analysis in this run, so this one goes to the LLM
+                canonical.append(record)
+            else:
+                stored_ids.add(canonical_id)
+
+        stored = await asyncio.to_thread(load_canonical_analyses, stored_ids, ANALYSIS_FIELDS) if stored_ids else {}
+        for record, canonical_id in duplicates:
+            if canonical_id not in stored_ids:
+                continue
+            if canonical_id in stored:
+                await result_queue.put(_inherit(record, canonical_id, stored[canonical_id]))
+            else:
+                # The canonical document was never successfully analyzed, so this one goes to the LLM
+                canonical.append(record)
+        return canonical
+
+    async def analyze_batch(batch):
+        """Analyzes one batch and returns the parked duplicates of the documents that failed."""
+        try:
+            insights_list = await asyncio.to_thread(
+                get_gemini_analysis_batch, [r['summary'] for r in batch], batch_size)
+        except Exception as e:
+            print(f"Pipeline: analysis batch failed: {e}")
+            insights_list = [None] * len(batch)
+
+        orphans = []
+        for record, insights in zip(batch, insights_list):
+            if isinstance(insights, dict) and insights.get("TRL", 0) != 0:
+                stats["analyzed"] += 1
+                await result_queue.put({**record, **insights})
+                if dedup:
+                    analysis = {k: insights[k] for k in ANALYSIS_FIELDS if k in insights}
+                    analyses_by_id[record['id']] = analysis
+                    for duplicate in waiting_duplicates.pop(record['id'], []):
+                        await result_queue.put(_inherit(duplicate, record['id'], analysis))
+            else:
+                stats["failed"] += 1
+                unsaved_sources.add(record.get('source'))
+                queued_ids.discard(record['id'])
+                failed_ids.add(record['id'])
+                orphans.extend(waiting_duplicates.pop(record['id'], []))
+                await update_checkpoint("mark", [record['id']], FAILED)
+        return orphans
+
+    async def analyze_worker():
+        while True:
+            record = await doc_queue.get()
+            if record is _DONE:
+                return
+            batch = [record]
+            # Top up the batch with whatever is already waiting, without blocking on slow sources
+            while len(batch) < batch_size and not doc_queue.empty():
+                nxt = doc_queue.get_nowait()
+                if nxt is _DONE:
+                    await doc_queue.put(_DONE)
+                    break
+                batch.append(nxt)
+
+            while batch:
+                # Duplicates of a failed document have nothing to inherit and are analyzed on their own.
+                # They are handled here rather than requeued, since doc_queue may already hold _DONE.
+                batch = await analyze_batch(batch)
+                for record in batch:
+                    queued_ids.add(record['id'])
+            report("analyzing")
+
+    async def flush(pending):
+        if not pending:
+            return
+        ids = [item['id'] for item in pending]
+        try:
+            await asyncio.to_thread(save_to_db, pd.DataFrame(pending), topic=topic)
+            failed = set()
+        except SaveError as e:
+            failed = e.failed_ids & set(ids)
+            print(f"Pipeline: failed to save {len(failed)} of {len(pending)} documents: {e}")
+        except Exception as e:
+            failed = set(ids)
+            print(f"Pipeline: failed to save {len(pending)} documents: {e}")
+        saved = [doc_id for doc_id in ids if doc_id not in failed]
+        unsaved_sources.update(item.get('source') for item in pending if item['id'] in failed)
+        stats["saved"] += len(saved)
+        stats["failed"] += len(failed)
+        await update_checkpoint("mark", saved, SAVED)
+        # Failed items are re-queued by resume_pipeline_sync
+        await update_checkpoint("mark", list(failed), FAILED)
+        await update_checkpoint("update_stats", {**stats, "filtered_out": dict(stats["filtered_out"])})
+        report("saving")
+
+    async def writer():
+        pending = []
+        while True:
+            try:
+                item = await asyncio.wait_for(result_queue.get(), timeout=SAVE_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                await flush(pending)
+                pending = []
+                continue
+            if item is _DONE:
+                await flush(pending)
+                return
+            pending.append(item)
+            if len(pending) >= save_batch_size:
+                await flush(pending)
+                pending = []
+
+    writer_task = asyncio.create_task(writer())
+    analyzers = [asyncio.create_task(analyze_worker()) for _ in range(concurrency)]
+
+    async def requeue_unfinished():
+        records = await asyncio.to_thread(checkpoint.unfinished_records)
+        print(f"Pipeline: resuming run {checkpoint.run_id} with {len(records)} unfinished documents.")
+        stats["candidates"] += len(records)
+        await enqueue(records)
+
+    try:
+        if resume:
+            known_ids.update(await asyncio.to_thread(checkpoint.known_ids))
+        arxiv_watermark = await asyncio.to_thread(ArxivWatermark.load, topic) if incremental else None
+        sources = _source_pages(topic, max_per_source, arxiv_watermark)
+        fetchers = [fetch_source(name, pages) for name, pages in sources.items()]
+        if resume:
+            fetchers.append(requeue_unfinished())
+        await asyncio.gather(*fetchers)
+        for _ in analyzers:
+            await doc_queue.put(_DONE)
+        await asyncio.gather(*analyzers)
+        await result_queue.put(_DONE)
+        await writer_task
+
+        if arxiv_watermark is not None and not {'arxiv'} & (failed_sources | unsaved_sources):
+            # Only advance the mark once every arXiv paper fetched was analyzed and saved; otherwise the next
+            # incremental run fetches them again instead of skipping them for good
+            await asyncio.to_thread(arxiv_watermark.commit)
+    except BaseException as e:
+        writer_task.cancel()
+        for analyzer in analyzers:
+            analyzer.cancel()
+        stats["elapsed_seconds"] = round(time.monotonic() - started, 2)
+        await update_checkpoint("finish", {**stats, "filtered_out": dict(stats["filtered_out"])}, repr(e))
+        _record_run(topic, stats, e)
+        raise
+
+    stats["elapsed_seconds"] = round(time.monotonic() - started, 2)
+    await update_checkpoint("finish", {**stats, "filtered_out": dict(stats["filtered_out"])})
+    _record_run(topic, stats)
+    report("done")
+    print(f"Pipeline stats for '{topic}': {stats}")
+    return stats
+
+
+def run_pipeline_sync(topic: str, num_documents: int = 20, **kwargs) -> dict:
+    """Blocking wrapper for callers that are not running an event loop."""
+    return asyncio.run(run_pipeline_async(topic, num_documents=num_documents, **kwargs))
+
+
+def resume_pipeline_sync(run_id: str, **kwargs) -> dict:
+    """Resumes an interrupted run with its original topic and size."""
+    checkpoint = RunCheckpoint.load(run_id)
+    return run_pipeline_sync(checkpoint.topic, num_documents=checkpoint.num_documents,
+                             run_id=run_id, resume=True, **kwargs)
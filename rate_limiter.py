@@ -0,0 +1,282 @@
+# rate_limiter.py
+"""
+Shared token-bucket rate limiter for Gemini requests.
+
+State lives in Redis (the Celery broker) so every API process, Celery worker
+and local pipeline run draws from the same requests-per-minute and
+tokens-per-minute budgets. The effective rate follows AIMD: it is halved and
+all callers pause when Gemini answers with ResourceExhausted, and it creeps
+back up by a small step after every successful call. If Redis is unreachable
+the limiter degrades to an equivalent per-process bucket.
+"""
+
+import os
+import math
+import time
+import threading
+
+DEFAULT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+
+# KEYS: rpm bucket, tpm bucket, rate factor, cooldown flag
+# ARGV: rpm limit, tpm limit, tokens requested
+# Returns 0 when the request was admitted, otherwise the number of ms to wait.
+_ACQUIRE_SCRIPT = """
+local cooldown = redis.call('PTTL', KEYS[4])
+if cooldown > 0 then return cooldown end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local factor = tonumber(redis.call('GET', KEYS[3]) or '1')
+
+local function refill(key, limit)
+  local capacity = limit * factor
+  local rate = capacity / 60000.0
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(state[1]) or capacity
+  local ts = tonumber(state[2]) or now
+  return math.min(capacity, tokens + math.max(0, now - ts) * rate), rate, capacity
+end
+
+local req_tokens, req_rate = refill(KEYS[1], tonumber(ARGV[1]))
+local tok_tokens, tok_rate, tok_capacity = refill(KEYS[2], tonumber(ARGV[2]))
+local need = math.min(tonumber(ARGV[3]), tok_capacity)
+
+local wait = 0
+if req_tokens < 1 then wait = math.max(wait, math.ceil((1 - req_tokens) / req_rate)) end
+if tok_tokens < need then wait = math.max(wait, math.ceil((need - tok_tokens) / tok_rate)) end
+if wait == 0 then
+  req_tokens = req_tokens - 1
+  tok_tokens = tok_tokens - need
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(req_tokens), 'ts', now)
+redis.call('HSET', KEYS[2], 'tokens', tostring(tok_tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+redis.call('PEXPIRE', KEYS[2], 120000)
+return wait
+"""
+
+# KEYS: rate factor, cooldown flag  ARGV: min factor, cooldown ms
+_DECREASE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+  return redis.call('GET', KEYS[1]) or '1'
+end
+local factor = math.max(tonumber(ARGV[1]), tonumber(redis.call('GET', KEYS[1]) or '1') * 0.5)
+redis.call('SET', KEYS[1], tostring(factor))
+redis.call('SET', KEYS[2], '1', 'PX', ARGV[2])
+return tostring(factor)
+"""
+
+# KEYS: rate factor  ARGV: additive step
+_INCREASE_SCRIPT = """
+local factor = math.min(1.0, tonumber(redis.call('GET', KEYS[1]) or '1') + tonumber(ARGV[1]))
+redis.call('SET', KEYS[1], tostring(factor))
+return tostring(factor)
+"""
+
+# KEYS: tpm bucket  ARGV: token delta (positive = refund, negative = extra debit)
+_ADJUST_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  redis.call('HINCRBYFLOAT', KEYS[1], 'tokens', ARGV[1])
+end
+return 1
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (about four characters per token) used to debit the TPM budget up front."""
+    return max(1, math.ceil(len(text or "") / 4))
+
+
+class _LocalState:
+    """In-process equivalent of the Redis state, used when Redis is unavailable."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.factor = 1.0
+        self.cooldown_until = 0.0
+
+    def acquire(self, rpm: float, tpm: float, tokens: int) -> int:
+        with self.lock:
+            now = time.monotonic() * 1000
+            if self.cooldown_until > now:
+                return math.ceil(self.cooldown_until - now)
+
+            def refill(name, limit):
+                capacity = limit * self.factor
+                rate = capacity / 60000.0
+                level, ts = self.buckets.get(name, (capacity, now))
+                return min(capacity, level + max(0.0, now - ts) * rate), rate, capacity
+
+            req_tokens, req_rate, _ = refill("rpm", rpm)
+            tok_tokens, tok_rate, tok_capacity = refill("tpm", tpm)
+            need = min(tokens, tok_capacity)
+
+            wait = 0
+            if req_tokens < 1:
+                wait = max(wait, math.ceil((1 - req_tokens) / req_rate))
+            if tok_tokens < need:
+                wait = max(wait, math.ceil((need - tok_tokens) / tok_rate))
+            if wait == 0:
+                req_tokens -= 1
+                tok_tokens -= need
+
+            self.buckets["rpm"] = (req_tokens, now)
+            self.buckets["tpm"] = (tok_tokens, now)
+            return wait
+
+
+class RateLimiter:
+    """Token bucket shared across processes through Redis, with AIMD backoff."""
+
+    def __init__(self, name: str, rpm: float, tpm: float, redis_url: str = DEFAULT_REDIS_URL,
+                 cooldown_seconds: float = 60.0, min_factor: float = 0.1, increase_step: float = 0.05):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.redis_url = redis_url
+        self.cooldown_ms = int(cooldown_seconds * 1000)
+        self.min_factor = min_factor
+        self.increase_step = increase_step
+        prefix = f"aetos:ratelimit:{name}"
+        self._keys = {
+            "rpm": f"{prefix}:rpm",
+            "tpm": f"{prefix}:tpm",
+            "factor": f"{prefix}:factor",
+            "cooldown": f"{prefix}:cooldown",
+        }
+        self._redis = None
+        self._scripts = None
+        self._local = None
+        self._init_lock = threading.Lock()
+        self.counters = {"acquired": 0, "throttled": 0, "waits": 0, "wait_seconds": 0.0}
+
+    def _backend(self):
+        """Returns the Redis scripts, or None once we have fallen back to local state."""
+        if self._scripts is not None or self._local is not None:
+            return self._scripts
+        with self._init_lock:
+            if self._scripts is not None or self._local is not None:
+                return self._scripts
+            try:
+                import redis
+                client = redis.Redis.from_url(self.redis_url, socket_timeout=2, socket_connect_timeout=2)
+                client.ping()
+                self._redis = client
+                self._scripts = {
+                    "acquire": client.register_script(_ACQUIRE_SCRIPT),
+                    "decrease": client.register_script(_DECREASE_SCRIPT),
+                    "increase": client.register_script(_INCREASE_SCRIPT),
+                    "adjust": client.register_script(_ADJUST_SCRIPT),
+                }
+            except Exception as e:
+                print(f"Rate limiter '{self.name}': Redis unavailable, using per-process limits ({e})")
+                self._local = _LocalState()
+        return self._scripts
+
+    def _fall_back(self, error: Exception):
+        print(f"Rate limiter '{self.name}': Redis error, switching to per-process limits ({error})")
+        with self._init_lock:
+            self._scripts = None
+            self._local = self._local or _LocalState()
+
+    def _try_acquire(self, tokens: int) -> int:
+        scripts = self._backend()
+        if scripts is not None:
+            try:
+                keys = [self._keys["rpm"], self._keys["tpm"], self._keys["factor"], self._keys["cooldown"]]
+                return int(scripts["acquire"](keys=keys, args=[self.rpm, self.tpm, tokens]))
+            except Exception as e:
+                self._fall_back(e)
+        return self._local.acquire(self.rpm, self.tpm, tokens)
+
+    def acquire(self, tokens: int = 1) -> float:
+        """Blocks until one request and `tokens` tokens are available. Returns seconds waited."""
+        waited = 0.0
+        while True:
+            wait_ms = self._try_acquire(tokens)
+            if wait_ms <= 0:
+                break
+            sleep_for = wait_ms / 1000.0
+            time.sleep(sleep_for)
+            waited += sleep_for
+        self.counters["acquired"] += 1
+        if waited:
+            self.counters["waits"] += 1
+            self.counters["wait_seconds"] += waited
+        return waited
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        """Reconciles the up-front token estimate with the usage Gemini actually reported."""
+        delta = estimated_tokens - actual_tokens
+        if not delta:
+            return
+        scripts = self._backend()
+        if scripts is not None:
+            try:
+                scripts["adjust"](keys=[self._keys["tpm"]], args=[delta])
+                return
+            except Exception as e:
+                self._fall_back(e)
+        with self._local.lock:
+            if "tpm" in self._local.buckets:
+                level, ts = self._local.buckets["tpm"]
+                self._local.buckets["tpm"] = (level + delta, ts)
+
+    def on_success(self):
+        """Additive increase of the shared rate after a successful call."""
+        scripts = self._backend()
+        if scripts is not None:
+            try:
+                scripts["increase"](keys=[self._keys["factor"]], args=[self.increase_step])
+                return
+            except Exception as e:
+                self._fall_back(e)
+        with self._local.lock:
+            self._local.factor = min(1.0, self._local.factor + self.increase_step)
+
+    def on_throttled(self):
+        """Multiplicative decrease plus a shared cooldown after a quota error."""
+        self.counters["throttled"] += 1
+        scripts = self._backend()
+        if scripts is not None:
+            try:
+                factor = scripts["decrease"](keys=[self._keys["factor"], self._keys["cooldown"]],
+                                             args=[self.min_factor, self.cooldown_ms])
+                print(f"Rate limiter '{self.name}': quota exhausted, rate factor now {float(factor):.2f}")
+                return
+            except Exception as e:
+                self._fall_back(e)
+        with self._local.lock:
+            now = time.monotonic() * 1000
+            if self._local.cooldown_until <= now:
+                self._local.factor = max(self.min_factor, self._local.factor * 0.5)
+                self._local.cooldown_until = now + self.cooldown_ms
+            print(f"Rate limiter '{self.name}': quota exhausted, rate factor now {self._local.factor:.2f}")
+
+    def stats(self) -> dict:
+        factor = 1.0
+        backend = "local"
+        if self._backend() is not None:
+            backend = "redis"
+            try:
+                factor = float(self._redis.get(self._keys["factor"]) or 1.0)
+            except Exception:
+                pass
+        elif self._local is not None:
+            factor = self._local.factor
+        return {
+            **self.counters,
+            "backend": backend,
+            "rate_factor": round(factor, 3),
+            "effective_rpm": round(self.rpm * factor, 2),
+            "effective_tpm": round(self.tpm * factor, 2),
+        }
+
+
+gemini_limiter = RateLimiter(
+    "gemini",
+    rpm=float(os.getenv("GEMINI_RPM", 15)),
+    tpm=float(os.getenv("GEMINI_TPM", 250000)),
+    cooldown_seconds=float(os.getenv("GEMINI_THROTTLE_COOLDOWN_SECONDS", 60)),
+)
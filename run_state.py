@@ -0,0 +1,106 @@
+# run_state.py
+"""
+Checkpoints for pipeline runs, so an interrupted run can be resumed by id.
+
+pipeline_runs holds one document per run: topic, parameters, status and the
+latest stats. pipeline_run_items holds one document per candidate the run
+fetched, with the candidate itself and its status:
+
+- pending   fetched and filtered, not yet saved
+- saved     analyzed (or inherited a duplicate's analysis) and written to documents
+- failed    analysis or the database write failed; retried on resume
+
+Resuming a run re-queues its pending and failed candidates without fetching
+them again, and skips anything the sources return that the run already has.
+Saved documents are never analyzed twice. Analyses that finished just before a
+crash are still in the LLM cache, so re-queued documents usually cost no quota.
+"""
+
+import uuid
+from datetime import datetime
+from pymongo import ASCENDING, InsertOne
+from pymongo.errors import BulkWriteError
+
+PENDING, SAVED, FAILED = "pending", "saved", "failed"
+
+
+class RunCheckpoint:
+    def __init__(self, run_id: str, topic: str, num_documents: int):
+        self.run_id = run_id
+        self.topic = topic
+        self.num_documents = num_documents
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            from database import get_db_connection
+            db = get_db_connection()
+            db.pipeline_run_items.create_index([("run_id", ASCENDING), ("status", ASCENDING)])
+            self._db = db
+        return self._db
+
+    @classmethod
+    def start(cls, topic: str, num_documents: int, run_id: str = None):
+        checkpoint = cls(run_id or uuid.uuid4().hex, topic, num_documents)
+        now = datetime.utcnow()
+        checkpoint.db.pipeline_runs.update_one(
+            {"_id": checkpoint.run_id},
+            {"$set": {"topic": topic, "num_documents": num_documents, "status": "running", "updated_at": now},
+             "$setOnInsert": {"started_at": now}},
+            upsert=True,
+        )
+        return checkpoint
+
+    @classmethod
+    def load(cls, run_id: str):
+        from database import get_db_connection
+        run = get_db_connection().pipeline_runs.find_one({"_id": run_id})
+        if run is None:
+            raise ValueError(f"Unknown pipeline run '{run_id}'.")
+        return cls(run_id, run["topic"], run.get("num_documents", 20))
+
+    @classmethod
+    def resume(cls, run_id: str):
+        checkpoint = cls.load(run_id)
+        checkpoint.db.pipeline_runs.update_one(
+            {"_id": run_id}, {"$set": {"status": "running", "updated_at": datetime.utcnow()}, "$inc": {"resumes": 1}})
+        return checkpoint
+
+    def known_ids(self) -> set:
+        return {item["doc_id"] for item in self.db.pipeline_run_items.find({"run_id": self.run_id}, {"doc_id": 1})}
+
+    def unfinished_records(self) -> list:
+        cursor = self.db.pipeline_run_items.find({"run_id": self.run_id, "status": {"$in": [PENDING, FAILED]}},
+                                                 {"record": 1})
+        return [item["record"] for item in cursor]
+
+    def add_candidates(self, records: list):
+        now = datetime.utcnow()
+        ops = [InsertOne({"_id": f"{self.run_id}:{r['id']}", "run_id": self.run_id, "doc_id": r["id"],
+                          "status": PENDING, "record": r, "updated_at": now}) for r in records]
+        if not ops:
+            return
+        try:
+            self.db.pipeline_run_items.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # Candidates re-queued on resume are already recorded
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    def mark(self, doc_ids, status: str):
+        doc_ids = list(doc_ids)
+        if doc_ids:
+            self.db.pipeline_run_items.update_many(
+                {"_id": {"$in": [f"{self.run_id}:{doc_id}" for doc_id in doc_ids]}},
+                {"$set": {"status": status, "updated_at": datetime.utcnow()}})
+
+    def update_stats(self, stats: dict):
+        self.db.pipeline_runs.update_one({"_id": self.run_id},
+                                         {"$set": {"stats": stats, "updated_at": datetime.utcnow()}})
+
+    def finish(self, stats: dict, error: str = None):
+        fields = {"stats": stats, "status": "failed" if error else "completed", "updated_at": datetime.utcnow()}
+        if error:
+            fields["error"] = error
+        self.db.pipeline_runs.update_one({"_id": self.run_id}, {"$set": fields})
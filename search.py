@@ -0,0 +1,136 @@
+# search.py
+"""
+Topic search over db.documents.
+
+Three match modes, all index-backed:
+- "text":   tokenized full-text search on the `documents_text` index (title,
+            technologies and summary, weighted), ranked by text score.
+- "phrase": the same index, but the topic must appear as an exact phrase.
+- "prefix": every topic token must prefix one of the document's
+            `search_terms`, a lowercased token array written at save time.
+            Anchored regexes on that array use its ascending index.
+"""
+
+import re
+import sys
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, TEXT, UpdateOne
+
+MATCH_MODES = ("text", "phrase", "prefix")
+
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+\-]*")
+
+TEXT_INDEX_WEIGHTS = {"title": 10, "technologies": 5, "summary": 1}
+
+
+def tokenize(text: str) -> list:
+    """Lowercased word tokens of two or more characters, in order of appearance, without repeats."""
+    seen = {}
+    for token in _TOKEN_RE.findall((text or "").lower()):
+        if len(token) > 1:
+            seen.setdefault(token, None)
+    return list(seen)
+
+
+def search_terms_for(record: dict) -> list:
+    """The prefix-searchable terms of a document, taken from its title and technologies."""
+    parts = [record.get("title") or ""]
+    technologies = record.get("technologies")
+    if isinstance(technologies, list):
+        parts.extend(str(t) for t in technologies)
+    terms = tokenize(" ".join(parts))
+    # Hyphenated compounds are also indexed by their parts, so "quantum" prefixes "post-quantum"
+    compound_parts = [part for term in terms if "-" in term for part in term.split("-") if len(part) > 1]
+    return list(dict.fromkeys(terms + compound_parts))
+
+
+def ensure_search_indexes(db):
+    db.documents.create_index(
+        [(field, TEXT) for field in TEXT_INDEX_WEIGHTS],
+        weights=TEXT_INDEX_WEIGHTS,
+        name="documents_text",
+        default_language="english",
+    )
+    db.documents.create_index([("search_terms", ASCENDING)])
+
+
+def build_topic_query(topic: str, mode: str = "text") -> dict:
+    if mode not in MATCH_MODES:
+        raise ValueError(f"Unknown match mode '{mode}'. Expected one of {', '.join(MATCH_MODES)}.")
+    topic = (topic or "").strip()
+    if mode == "prefix":
+        tokens = tokenize(topic)
+        if not tokens:
+            return {"_id": None}
+        return {"$and": [{"search_terms": {"$regex": f"^{re.escape(token)}"}} for token in tokens]}
+    if mode == "phrase":
+        phrase = topic.replace('"', " ").strip()
+        return {"$text": {"$search": f'"{phrase}"'}}
+    return {"$text": {"$search": topic}}
+
+
+def keyset_filter(published, doc_id):
+    """
+    Documents that come after (published, doc_id) in prefix-mode order:
+    published descending, then _id ascending. Values of a lower BSON type
+    (strings after dates, then null or missing) sort after every date.
+    Returns None for published values of other types.
+    """
+    if published is None:
+        return {"published": None, "_id": {"$gt": doc_id}}
+    if isinstance(published, datetime):
+        higher_types = ["date"]
+    elif isinstance(published, str):
+        higher_types = ["date", "string"]
+    else:
+        return None
+    return {"$or": [
+        {"published": {"$lt": published}},
+        {"published": published, "_id": {"$gt": doc_id}},
+        {"$and": [{"published": {"$not": {"$type": t}}} for t in higher_types]},
+    ]}
+
+
+def find_documents(db, topic: str, mode: str = "text", projection: dict = None, limit: int = 0, skip: int = 0,
+                   after: tuple = None):
+    """
+    Returns a cursor over matching documents, best matches first. In prefix
+    mode, `after` is the (published, _id) of the last document of the previous
+    page, and the page starts right after it instead of skipping `skip`
+    documents. Text scores cannot be used as a key, so other modes skip.
+    """
+    query = build_topic_query(topic, mode)
+    if mode == "prefix":
+        sort = [("published", DESCENDING), ("_id", ASCENDING)]
+        after_query = keyset_filter(*after) if after is not None else None
+        if after_query is not None:
+            query = {"$and": [query, after_query]}
+            skip = 0
+    else:
+        projection = {**(projection or {}), "score": {"$meta": "textScore"}}
+        sort = [("score", {"$meta": "textScore"}), ("_id", ASCENDING)]
+    cursor = db.documents.find(query, projection).sort(sort).skip(skip).limit(limit)
+    if limit:
+        cursor = cursor.batch_size(limit)
+    return cursor
+
+
+def backfill_search_terms(db, chunk_size: int = 1000) -> int:
+    """Populates search_terms on documents saved before the field existed."""
+    updated = 0
+    ops = []
+    cursor = db.documents.find({"search_terms": {"$exists": False}}, {"title": 1, "technologies": 1})
+    for doc in cursor:
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"search_terms": search_terms_for(doc)}}))
+        if len(ops) >= chunk_size:
+            updated += db.documents.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += db.documents.bulk_write(ops, ordered=False).modified_count
+    return updated
+
+
+if __name__ == "__main__":
+    if "--backfill" in sys.argv:
+        from mongo import get_db
+        print(f"Backfilled search_terms on {backfill_search_terms(get_db())} documents.")
@@ -0,0 +1,209 @@
+# synthesis_cache.py
+"""
+Response cache for topic synthesis (the Gemini report behind
+/api/analytics/synthesis/<topic>).
+
+Entries live in the synthesis_cache collection, keyed by match mode and
+normalized topic. Each entry records a fingerprint of the documents the report
+was generated from: their ids and updated_at, in relevance order.
+
+- An entry is fresh while it is younger than SYNTHESIS_CACHE_TTL_SECONDS and
+  has not been invalidated. It is served without touching the documents.
+- save_to_db marks every entry for re-checking. The next request recomputes
+  the fingerprint, a single indexed query. If the documents are unchanged the
+  entry is simply marked fresh again.
+- If the documents did change, the old report is served immediately and
+  rebuilt in the background (stale-while-revalidate), for up to
+  SYNTHESIS_MAX_STALE_SECONDS.
+- Concurrent requests for the same key share one LLM call: through a future
+  inside a process, and through a lease on the entry across processes.
+"""
+
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from metrics import inc
+
+SYNTHESIS_CACHE_TTL_SECONDS = int(os.getenv("SYNTHESIS_CACHE_TTL_SECONDS", 24 * 60 * 60))
+SYNTHESIS_MAX_STALE_SECONDS = int(os.getenv("SYNTHESIS_MAX_STALE_SECONDS", 7 * 24 * 60 * 60))
+REFRESH_LEASE_SECONDS = 120
+LEASE_POLL_SECONDS = 0.5
+# Counter name -> cache_status, for the lookup outcomes exported as metrics
+_LOOKUP_RESULTS = {"hits": "hit", "revalidated": "revalidated", "stale": "stale", "misses": "miss"}
+
+
+def cache_key(topic: str, mode: str = "text") -> str:
+    return f"{mode}:{(topic or '').strip().lower()}"
+
+
+def fingerprint(documents: list) -> str:
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update(f"{doc.get('id')}\x00{doc.get('updated_at')}\x01".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SynthesisCache:
+    def __init__(self, collection_name: str = "synthesis_cache", ttl_seconds: int = SYNTHESIS_CACHE_TTL_SECONDS,
+                 max_stale_seconds: int = SYNTHESIS_MAX_STALE_SECONDS):
+        self.collection_name = collection_name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_stale = timedelta(seconds=max_stale_seconds)
+        self.enabled = os.getenv("SYNTHESIS_CACHE_ENABLED", "1") != "0"
+        self._collection = None
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.counters = {"hits": 0, "revalidated": 0, "stale": 0, "misses": 0, "coalesced": 0, "refreshes": 0}
+
+    def _get_collection(self):
+        if self._collection is None:
+            from database import get_db_connection
+            collection = get_db_connection()[self.collection_name]
+            collection.create_index([("stale", ASCENDING)])
+            self._collection = collection
+        return self._collection
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+        if name in _LOOKUP_RESULTS:
+            inc("aetos_cache_requests_total", cache="synthesis", result=_LOOKUP_RESULTS[name])
+
+    def _acquire_lease(self, key: str) -> bool:
+        """Cross-process single-flight: only the holder of an entry's lease may regenerate it."""
+        now = datetime.utcnow()
+        try:
+            self._get_collection().update_one(
+                {"_id": key, "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"lease_until": now + timedelta(seconds=REFRESH_LEASE_SECONDS)}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            # The entry exists and someone else holds its lease
+            return False
+
+    def _store(self, key: str, topic: str, mode: str, digest: str, value: dict):
+        now = datetime.utcnow()
+        self._get_collection().update_one(
+            {"_id": key},
+            {"$set": {"topic": (topic or "").strip().lower(), "mode": mode, "fingerprint": digest,
+                      "synthesis": value, "created_at": now, "checked_at": now, "stale": False},
+             "$unset": {"lease_until": ""}},
+            upsert=True,
+        )
+
+    def _generate(self, key: str, topic: str, mode: str, documents: list, compute) -> dict:
+        """Runs compute() at most once per key at a time in this process; other callers wait for its result."""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            self._count("coalesced")
+            return future.result(timeout=REFRESH_LEASE_SECONDS)
+
+        try:
+            value = self._generate_once(key, topic, mode, documents, compute)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _generate_once(self, key, topic, mode, documents, compute) -> dict:
+        collection = self._get_collection()
+        digest = fingerprint(documents)
+        deadline = time.monotonic() + REFRESH_LEASE_SECONDS
+        while not self._acquire_lease(key) and time.monotonic() < deadline:
+            # Another process is generating this entry; use its result once it lands
+            time.sleep(LEASE_POLL_SECONDS)
+            entry = collection.find_one({"_id": key})
+            if entry and entry.get("fingerprint") == digest and "synthesis" in entry:
+                self._count("coalesced")
+                return entry["synthesis"]
+
+        self._count("refreshes")
+        try:
+            value = compute(documents)
+        except Exception:
+            collection.update_one({"_id": key}, {"$unset": {"lease_until": ""}})
+            raise
+        if isinstance(value, dict) and not value.get("error"):
+            self._store(key, topic, mode, digest, value)
+        else:
+            # Failures are returned but not cached, so the next request tries again
+            collection.update_one({"_id": key}, {"$unset": {"lease_until": ""}})
+        return value
+
+    def _refresh_in_background(self, key, topic, mode, documents, compute):
+        with self._lock:
+            if key in self._inflight:
+                return
+
+        def run():
+            try:
+                self._generate(key, topic, mode, documents, compute)
+            except Exception as e:
+                print(f"Synthesis cache: background refresh of '{key}' failed: {e}")
+
+        threading.Thread(target=run, name=f"synthesis-refresh:{key}", daemon=True).start()
+
+    def get_or_compute(self, topic: str, mode: str, load_documents, compute) -> tuple:
+        """
+        Returns (synthesis, cache_status) with cache_status one of hit,
+        revalidated, stale or miss. load_documents() returns the documents the
+        report is built from (each with id, summary and updated_at), and
+        compute(documents) returns the report.
+        """
+        if not self.enabled:
+            documents = load_documents()
+            return (compute(documents) if documents else None), "miss"
+        key = cache_key(topic, mode)
+        collection = self._get_collection()
+        now = datetime.utcnow()
+        entry = collection.find_one({"_id": key})
+        has_value = bool(entry) and "synthesis" in entry
+
+        if has_value and not entry.get("stale") and now - entry["created_at"] < self.ttl:
+            self._count("hits")
+            return entry["synthesis"], "hit"
+
+        documents = load_documents()
+        if not documents:
+            return None, "miss"
+        digest = fingerprint(documents)
+        if has_value and entry.get("fingerprint") == digest and now - entry["created_at"] < self.ttl:
+            collection.update_one({"_id": key}, {"$set": {"stale": False, "checked_at": now}})
+            self._count("revalidated")
+            return entry["synthesis"], "revalidated"
+
+        if has_value and now - entry["created_at"] < self.max_stale:
+            self._count("stale")
+            self._refresh_in_background(key, topic, mode, documents, compute)
+            return entry["synthesis"], "stale"
+
+        self._count("misses")
+        return self._generate(key, topic, mode, documents, compute), "miss"
+
+    def invalidate_all(self) -> int:
+        """Flags every entry for a fingerprint check on its next read. Called after document writes."""
+        if not self.enabled:
+            return 0
+        return self._get_collection().update_many({"stale": False}, {"$set": {"stale": True}}).modified_count
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+
+synthesis_cache = SynthesisCache()
@@ -0,0 +1,106 @@
+# tests/conftest.py
+"""
+Shared fixtures: the benchmarks' mongomock database, fake Gemini model and
+fake arXiv API, so the tests need no network, quota or servers.
+
+    pip install pytest mongomock
+    python -m pytest -q
+"""
+
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.runner import BENCHMARK_ENV
+
+# Set before the application modules read them at import
+os.environ.update(BENCHMARK_ENV)
+os.environ.update({"EMBEDDINGS_ENABLED": "0", "METRICS_ENABLED": "0", "METRICS_LOG_EVENTS": "0"})
+
+from benchmarks.fakes import FakeArxiv, _ArxivResponse, use_fake_gemini, use_mongo
+from benchmarks.fixtures import LAST_YEAR, TOPIC, arxiv_feed
+
+_SUBMITTED_RE = re.compile(r"submittedDate:\[(\d{8})\d{4} TO (\d{8})\d{4}\]")
+
+
+def _position_date(position: int) -> str:
+    # The `published` date arxiv_feed gives the paper at `position`; 0 is the newest possible
+    return (datetime(LAST_YEAR, 12, 31) - timedelta(hours=6 * position)).strftime("%Y-%m-%d")
+
+
+class GrowingArxiv(FakeArxiv):
+    """
+    FakeArxiv whose results can gain newer papers with add(), and that honors
+    the submittedDate range of gap queries. The first `upcoming` feed
+    positions are held back for papers added later, so every paper keeps its
+    id and date as the results grow.
+    """
+
+    def __init__(self, total: int, upcoming: int = 100):
+        super().__init__(0, 1)
+        self.total = total
+        self.upcoming = upcoming
+        self.newer = 0
+
+    def add(self, count: int):
+        self.newer = min(self.upcoming, self.newer + count)
+
+    def _positions(self) -> range:
+        return range(self.upcoming - self.newer, self.upcoming + self.total)
+
+    def ids(self, newest: int = None) -> list:
+        """Ids of every paper, or of the `newest` ones, newest first."""
+        return [f"http://arxiv.org/abs/{2400 - p // 100000:04d}.{p % 100000:05d}v1" for p in self._positions()[:newest]]
+
+    def date(self, index: int) -> str:
+        """`published` of the paper `index` places below the newest."""
+        return _position_date(self._positions()[index])
+
+    def __call__(self, params: dict) -> _ArxivResponse:
+        self.requests += 1
+        positions = self._positions()
+        match = _SUBMITTED_RE.search(params["search_query"])
+        if match:
+            lower, upper = (f"{d[:4]}-{d[4:6]}-{d[6:]}" for d in match.groups())
+            positions = [p for p in positions if lower <= _position_date(p) <= upper]
+        selected = positions[int(params["start"]):][:int(params["max_results"])]
+        return _ArxivResponse(arxiv_feed(selected[0], len(selected)) if len(selected) else arxiv_feed(0, 0))
+
+
+@pytest.fixture
+def db(monkeypatch):
+    pytest.importorskip("mongomock")
+    database = use_mongo("mongomock")
+    from dedup import dedup_index
+    # The index keeps its collection handle, which belongs to the previous test's client
+    monkeypatch.setattr(dedup_index, "_collection", None)
+    return database
+
+
+@pytest.fixture
+def gemini(db):
+    return use_fake_gemini(latency_ms=0, jitter=0)
+
+
+@pytest.fixture
+def arxiv(monkeypatch):
+    import ingest
+    fake = GrowingArxiv(40)
+    monkeypatch.setattr(ingest, "_polite_get", fake)
+    return fake
+
+
+@pytest.fixture
+def no_patents(monkeypatch):
+    import pipeline
+    monkeypatch.setattr(pipeline, "_patent_results", lambda topic, max_results: pd.DataFrame())
+
+
+@pytest.fixture
+def topic():
+    return TOPIC
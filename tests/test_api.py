@@ -0,0 +1,85 @@
+# tests/test_api.py
+"""API behavior through the Flask test client: keyset pagination, job event streams, analytics match modes."""
+
+import types
+from datetime import datetime, timedelta
+import pytest
+import api
+from search import search_terms_for
+
+
+def document(doc_id, published, technologies=("lidar", "radar")):
+    doc = {"id": doc_id, "title": f"Quantum cryptography {doc_id}", "summary": "Quantum key distribution.",
+           "published": published, "technologies": list(technologies)}
+    return {**doc, "search_terms": search_terms_for(doc)}
+
+
+@pytest.fixture
+def client(db):
+    return api.create_app().test_client()
+
+
+@pytest.fixture
+def corpus(db):
+    day = datetime(2024, 1, 1)
+    # Dates with ties, then string and missing dates, which sort after every date
+    docs = ([document(f"dated-{i}", day - timedelta(days=i // 3)) for i in range(20)]
+            + [document(f"string-{i}", "2023-05-01" if i % 2 else "N/A") for i in range(5)]
+            + [document(f"undated-{i}", None) for i in range(5)])
+    db.documents.insert_many(docs)
+    return [doc["id"] for doc in docs]
+
+
+def pages(client, limit, fields="title,published", between_pages=None):
+    ids, after = [], None
+    while True:
+        query = f"match=prefix&limit={limit}&fields={fields}" + (f"&after={after}" if after else "")
+        response = client.get(f"/api/documents/quantum%20crypto?{query}")
+        assert response.status_code == 200
+        ids += [doc["id"] for doc in response.get_json()]
+        after = response.headers.get("X-Next-Cursor")
+        if not after:
+            return ids
+        if between_pages:
+            between_pages()
+            between_pages = None
+
+
+def test_prefix_pages_cover_every_document_once_in_order(client, corpus, db):
+    ids = pages(client, limit=7)
+    assert len(ids) == len(set(ids)) == len(corpus)
+    unpaged = client.get("/api/documents/quantum%20crypto?match=prefix&fields=title").get_json()
+    assert ids == [doc["id"] for doc in unpaged]
+
+
+def test_prefix_pages_are_stable_when_newer_documents_arrive(client, corpus, db):
+    newer = [document(f"new-{i}", datetime(2025, 1, 1)) for i in range(4)]
+    ids = pages(client, limit=6, between_pages=lambda: db.documents.insert_many(newer))
+    # Offsets would shift by the new documents and repeat the ones at the page boundary
+    assert len(ids) == len(set(ids))
+    assert set(ids) == set(corpus)
+
+
+def test_prefix_pages_without_published_in_fields(client, corpus):
+    ids = pages(client, limit=8, fields="title")
+    assert sorted(ids) == sorted(corpus)
+    page = client.get("/api/documents/quantum%20crypto?match=prefix&limit=8&fields=title").get_json()
+    assert all("published" not in doc for doc in page)
+
+
+def test_job_event_stream_ends_with_a_timeout_event(monkeypatch):
+    monkeypatch.setattr(api, "SSE_MAX_SECONDS", 0.05)
+    monkeypatch.setattr(api, "JOB_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(api, "_job_state",
+                        lambda job_id: types.SimpleNamespace(id=job_id, state="STARTED", info={"stage": "analyzing"}))
+    body = api.create_app().test_client().get("/api/jobs/job-1/events").get_data(as_text=True)
+    events = [line.split(": ", 1)[1] for line in body.splitlines() if line.startswith("event: ")]
+    assert events == ["progress", "timeout"]
+
+
+def test_materialized_convergence_only_answers_the_default_match_mode(client, corpus, db):
+    db.tech_cooccurrence.insert_one({"topic": "quantum crypto", "tech_1": "qkd", "tech_2": "fpga", "weight": 99})
+    default = client.get("/api/analytics/convergence/quantum%20crypto").get_json()
+    assert default == [{"tech_1": "qkd", "tech_2": "fpga", "strength": 99}]
+    prefix = client.get("/api/analytics/convergence/quantum%20crypto?match=prefix").get_json()
+    assert prefix == [{"tech_1": "lidar", "tech_2": "radar", "strength": len(corpus)}]
@@ -0,0 +1,44 @@
+# tests/test_backfill.py
+"""Backfill analysis batches: what they report as saved, and duplicates whose canonical document failed."""
+
+import io
+import pytest
+import backfill
+import database
+from ingest import _iter_entries
+from benchmarks.fixtures import arxiv_feed
+
+
+@pytest.fixture
+def batch(db, gemini):
+    first, second = _iter_entries(io.BytesIO(arxiv_feed(0, 2)))
+    duplicate = {**first, "id": "dup-1", "summary": first["summary"] + " Extended version.", "duplicate_of": first["id"]}
+    db.backfill_runs.insert_one({"_id": "backfill-1", "counters": {}})
+    return [first, second, duplicate]
+
+
+def test_batch_saves_analyzed_documents_and_their_duplicates(db, batch, topic):
+    counts = backfill.analyze_batch_task("backfill-1", topic, batch)
+    assert counts["saved"] == 3 and counts["failed"] == 0
+    assert db.documents.find_one({"id": "dup-1"})["duplicate_of"] == batch[0]["id"]
+    assert db.backfill_runs.find_one({"_id": "backfill-1"})["counters"]["saved"] == 3
+
+
+def test_duplicates_of_a_failed_document_are_analyzed_themselves(db, batch, monkeypatch, topic):
+    analyze = backfill.get_gemini_analysis_batch
+    monkeypatch.setattr(backfill, "get_gemini_analysis_batch", lambda texts, **kwargs: [
+        None if text == batch[0]["summary"] else result for text, result in zip(texts, analyze(texts, **kwargs))])
+    counts = backfill.analyze_batch_task("backfill-1", topic, batch)
+    assert counts["saved"] == 2 and counts["failed"] == 1
+    duplicate = db.documents.find_one({"id": "dup-1"})
+    assert duplicate["TRL"] > 0 and "duplicate_of" not in duplicate
+
+
+def test_failed_write_is_reported_as_failed(db, batch, monkeypatch, topic):
+    def failing_write(records, *args, **kwargs):
+        raise RuntimeError("Synthetic write failure")
+
+    monkeypatch.setattr(database, "bulk_upsert_documents", failing_write)
+    counts = backfill.analyze_batch_task("backfill-1", topic, batch)
+    assert counts["saved"] == 0 and counts["failed"] == 3
+    assert db.documents.count_documents({}) == 0
@@ -0,0 +1,162 @@
+# tests/test_pipeline.py
+"""Pipeline runs end to end against the fakes: save accounting, checkpoints and resuming, near-duplicate inheritance."""
+
+import io
+from collections import Counter
+import pandas as pd
+import pytest
+import database
+import pipeline
+from ingest import _iter_entries
+from run_state import SAVED, FAILED
+from benchmarks.fixtures import arxiv_feed
+
+
+def item_statuses(db, run_id):
+    return Counter(item["status"] for item in db.pipeline_run_items.find({"run_id": run_id}))
+
+
+def fail_writes(monkeypatch, ids=None):
+    """Makes bulk writes fail for the given ids, or for every document."""
+    write = database.bulk_upsert_documents
+
+    def failing_write(records, *args, **kwargs):
+        if ids is None:
+            raise RuntimeError("Synthetic write failure")
+        summary = write([r for r in records if r['id'] not in ids], *args, **kwargs)
+        failed = [r['id'] for r in records if r['id'] in ids]
+        return {**summary, "failed": summary["failed"] + len(failed), "failed_ids": summary["failed_ids"] + failed}
+
+    monkeypatch.setattr(database, "bulk_upsert_documents", failing_write)
+
+
+@pytest.fixture
+def run(db, gemini, arxiv, no_patents, topic):
+    # 20 arXiv papers per run; the fake arXiv serves 40
+    return lambda **kwargs: pipeline.run_pipeline_sync(topic, num_documents=40, **kwargs)
+
+
+def test_run_saves_candidates_and_checkpoints_them(db, run, arxiv, topic):
+    stats = run()
+    assert stats["candidates"] == 20
+    assert stats["saved"] == 20 and stats["failed"] == 0
+    assert db.documents.count_documents({}) == 20
+    assert item_statuses(db, stats["run_id"]) == {SAVED: 20}
+    assert db.ingest_watermarks.find_one({"_id": f"arxiv:{topic}"})["published"] == arxiv.date(0)
+
+
+def test_failed_write_is_not_counted_saved_and_resume_retries_it(db, run, monkeypatch, topic):
+    with monkeypatch.context() as patch:
+        fail_writes(patch)
+        stats = run(dedup=False)
+    assert stats["saved"] == 0 and stats["failed"] == 20
+    assert db.documents.count_documents({}) == 0
+    assert item_statuses(db, stats["run_id"]) == {FAILED: 20}
+    # Nothing was stored, so the next incremental run must fetch these papers again
+    assert db.ingest_watermarks.find_one({"_id": f"arxiv:{topic}"}) is None
+
+    resumed = pipeline.resume_pipeline_sync(stats["run_id"], dedup=False)
+    assert resumed["saved"] == 20 and resumed["failed"] == 0
+    assert db.documents.count_documents({}) == 20
+    assert item_statuses(db, stats["run_id"]) == {SAVED: 20}
+    assert db.ingest_watermarks.find_one({"_id": f"arxiv:{topic}"}) is not None
+
+
+def test_partially_failed_write_only_retries_the_failed_documents(db, run, arxiv, monkeypatch):
+    poisoned = arxiv.ids()[3]
+    with monkeypatch.context() as patch:
+        fail_writes(patch, {poisoned})
+        stats = run(dedup=False)
+    assert stats["saved"] == 19 and stats["failed"] == 1
+    assert db.documents.count_documents({"id": poisoned}) == 0
+    failed = [item["doc_id"] for item in db.pipeline_run_items.find({"run_id": stats["run_id"], "status": FAILED})]
+    assert failed == [poisoned]
+
+    resumed = pipeline.resume_pipeline_sync(stats["run_id"], dedup=False)
+    # Saved documents are not analyzed again
+    assert resumed["analyzed"] == 1 and resumed["saved"] == 1
+    assert db.documents.count_documents({}) == 20
+
+
+def test_failed_analysis_holds_the_watermark(db, run, monkeypatch, topic):
+    monkeypatch.setattr(pipeline, "get_gemini_analysis_batch", lambda texts, *args: [None] * len(texts))
+    stats = run(dedup=False)
+    assert stats["saved"] == 0 and stats["failed"] == 20
+    assert item_statuses(db, stats["run_id"]) == {FAILED: 20}
+    assert db.ingest_watermarks.find_one({"_id": f"arxiv:{topic}"}) is None
+
+
+# --- near-duplicates ---
+
+def papers(count):
+    return list(_iter_entries(io.BytesIO(arxiv_feed(0, count))))
+
+
+def copy_of(paper, doc_id):
+    return {**paper, 'id': doc_id, 'summary': paper['summary'] + " Extended version."}
+
+
+@pytest.fixture
+def serve_pages(monkeypatch, db, gemini, no_patents, topic):
+    def serve(*pages, **kwargs):
+        monkeypatch.setattr(pipeline, "_source_pages",
+                            lambda *args: {'arxiv': iter(pd.DataFrame(page) for page in pages)})
+        return pipeline.run_pipeline_sync(topic, num_documents=40, incremental=False, **kwargs)
+    return serve
+
+
+@pytest.fixture
+def analyzed_texts(monkeypatch):
+    """Every abstract sent to Gemini. Abstracts added to the returned `fail` set get no analysis."""
+    texts, fail = [], set()
+    analyze = pipeline.get_gemini_analysis_batch
+
+    def recording_analyze(batch, *args, **kwargs):
+        texts.extend(batch)
+        results = analyze(batch, *args, **kwargs)
+        return [None if text in fail else result for text, result in zip(batch, results)]
+
+    monkeypatch.setattr(pipeline, "get_gemini_analysis_batch", recording_analyze)
+    return texts, fail
+
+
+def test_duplicates_inherit_their_canonical_analysis(db, serve_pages, analyzed_texts):
+    original, other = papers(2)
+    early, late = copy_of(original, "dup-1"), copy_of(original, "dup-2")
+    texts, _ = analyzed_texts
+
+    stats = serve_pages([original, other, early], [late])
+    assert stats["duplicates"] == 2 and stats["analyzed"] == 2 and stats["saved"] == 4
+    assert early['summary'] not in texts and late['summary'] not in texts
+    canonical = db.documents.find_one({"id": original['id']})
+    for doc_id in ("dup-1", "dup-2"):
+        duplicate = db.documents.find_one({"id": doc_id})
+        assert duplicate["duplicate_of"] == original['id']
+        assert duplicate["TRL"] == canonical["TRL"] and duplicate["technologies"] == canonical["technologies"]
+
+
+def test_duplicates_of_a_stored_document_inherit_across_runs(db, serve_pages, analyzed_texts):
+    original, = papers(1)
+    texts, _ = analyzed_texts
+    serve_pages([original])
+    texts.clear()
+
+    stats = serve_pages([copy_of(original, "dup-1")])
+    assert stats["duplicates"] == 1 and stats["analyzed"] == 0 and stats["saved"] == 1
+    assert texts == []
+    assert db.documents.find_one({"id": "dup-1"})["duplicate_of"] == original['id']
+
+
+def test_duplicates_of_a_failed_document_are_analyzed_themselves(db, serve_pages, analyzed_texts):
+    original, other = papers(2)
+    early, late = copy_of(original, "dup-1"), copy_of(original, "dup-2")
+    texts, fail = analyzed_texts
+    fail.add(original['summary'])
+
+    stats = serve_pages([original, other, early], [late])
+    assert stats["failed"] == 1 and stats["saved"] == 3
+    assert early['summary'] in texts and late['summary'] in texts
+    assert db.documents.count_documents({"id": original['id']}) == 0
+    for doc_id in ("dup-1", "dup-2"):
+        duplicate = db.documents.find_one({"id": doc_id})
+        assert duplicate["TRL"] > 0 and "duplicate_of" not in duplicate
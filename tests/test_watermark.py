@@ -0,0 +1,51 @@
+# tests/test_watermark.py
+"""Incremental arXiv paging: the per-topic watermark, and the gap a run capped by max_results leaves below it."""
+
+from ingest import fetch_arxiv_data
+
+
+def fetch(topic, max_results):
+    papers = fetch_arxiv_data(topic, max_results=max_results, page_size=4, incremental=True)
+    return papers['id'].tolist() if not papers.empty else []
+
+
+def stored_mark(db, topic):
+    return db.ingest_watermarks.find_one({"_id": f"arxiv:{topic}"})
+
+
+def test_first_run_marks_newest_paper_and_next_run_skips_it(db, arxiv, topic):
+    assert fetch(topic, 6) == arxiv.ids(6)
+    mark = stored_mark(db, topic)
+    assert mark["published"] == arxiv.date(0)
+    assert mark["gap_before"] is None
+
+    assert fetch(topic, 6) == []
+
+
+def test_capped_run_leaves_a_gap_that_later_runs_fill(db, arxiv, topic):
+    fetched = fetch(topic, 6)
+    first_mark = stored_mark(db, topic)["published"]
+
+    arxiv.add(30)
+    fetched += fetch(topic, 12)
+    mark = stored_mark(db, topic)
+    # The cap was hit above the old mark: it stays, and the unread papers below the 12th are a gap
+    assert mark["published"] == first_mark
+    assert mark["top"] == arxiv.date(0)
+    assert mark["gap_before"] == arxiv.date(11)
+
+    fetched += fetch(topic, 12)
+    narrowed = stored_mark(db, topic)
+    assert narrowed["published"] == first_mark
+    assert first_mark < narrowed["gap_before"] < mark["gap_before"]
+
+    # New papers arrive on top while the gap is still open; one run reads both
+    arxiv.add(8)
+    fetched += fetch(topic, 50)
+    mark = stored_mark(db, topic)
+    assert mark["gap_before"] is None
+    assert mark["published"] == arxiv.date(0)
+
+    assert len(fetched) == len(set(fetched))
+    assert set(fetched) == set(arxiv.ids(38 + 6))
+    assert fetch(topic, 50) == []
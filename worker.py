@@ -1,65 +1,77 @@
 import os
 import time
-import pandas as pd
-from celery import Celery
-from ingest import fetch_arxiv_data
-from ingest_patents import fetch_patent_data
-from database import save_to_db
-from intelligence import get_gemini_analysis
+from celery.signals import task_prerun, task_postrun
+from celery_app import celery_app
+from pipeline import run_pipeline_sync, resume_pipeline_sync
+from llm_cache import analysis_cache
+from rate_limiter import gemini_limiter
+from jobs import release_topic, ANALYSIS_TASK
+from embeddings import sync_index
+from database import get_db_connection
+from metrics import observe, log_event, flush as flush_metrics, current_endpoint
 
-# Keep Celery for potential async use, but API now calls sync
-celery_app = Celery('aetos_tasks', broker=os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"), backend=os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0"))
+PROGRESS_STATE = 'PROGRESS'
+PROGRESS_INTERVAL_SECONDS = float(os.getenv("JOB_PROGRESS_INTERVAL_SECONDS", 1.0))
 
-@celery_app.task(name='worker.run_analysis_pipeline_task')
-def run_analysis_pipeline_task(topic: str, num_documents: int = 20):  # Increased default
-    print(f"--- [Worker] Starting AETOS Batch Intelligence Run for topic: '{topic}' ---")
-    max_per_source = max(1, num_documents // 2)
+_task_started_at = {}
 
-    arxiv_df = fetch_arxiv_data(topic, max_results=max_per_source)
-    patents_df = fetch_patent_data(topic, max_results=max_per_source)
-    combined_df = pd.concat([arxiv_df, patents_df], ignore_index=True, sort=False)
+@task_prerun.connect
+def _on_task_start(task_id=None, task=None, **kwargs):
+    # Mongo commands issued by the task are labeled with its name
+    current_endpoint.set(f"task:{task.name}")
+    _task_started_at[task_id] = time.monotonic()
+    log_event("task_started", task=task.name, task_id=task_id)
 
-    # Parse published dates for sorting/filtering
-    combined_df['published'] = pd.to_datetime(combined_df['published'], errors='coerce')
+@task_postrun.connect
+def _on_task_end(task_id=None, task=None, state=None, **kwargs):
+    current_endpoint.set("none")
+    started = _task_started_at.pop(task_id, None)
+    if started is not None:
+        elapsed = time.monotonic() - started
+        observe("aetos_task_seconds", elapsed, task=task.name, state=state or "UNKNOWN")
+        log_event("task_finished", task=task.name, task_id=task_id, state=state, seconds=round(elapsed, 3))
+    # Workers can sit idle for a long time after a task, so its numbers go out now
+    flush_metrics()
 
-    MIN_SUMMARY_LENGTH = 150
-    original_count = len(combined_df)
-    combined_df.dropna(subset=['summary'], inplace=True)
-    combined_df = combined_df[combined_df['summary'].str.len() >= MIN_SUMMARY_LENGTH]
-    print(f"Filtered {original_count} docs to {len(combined_df)} high-quality candidates.")
+@celery_app.task(bind=True, name=ANALYSIS_TASK)
+def run_analysis_pipeline_task(self, topic: str, num_documents: int = 20, resume_run_id: str = None):  # Increased default
+    """The Celery task id doubles as the pipeline run id; pass resume_run_id to continue an interrupted run."""
+    print(f"--- [Worker] Starting AETOS Batch Intelligence Run for topic: '{topic}' ---")
+    job_id = self.request.id
+    last_report = 0.0
 
-    if combined_df.empty:
-        return "Analysis complete. No high-quality documents found."
+    def progress(stage, stats):
+        # Progress goes to the result backend, so intermediate updates are throttled
+        nonlocal last_report
+        now = time.monotonic()
+        if job_id is None or (stage != "done" and now - last_report < PROGRESS_INTERVAL_SECONDS):
+            return
+        last_report = now
+        self.update_state(state=PROGRESS_STATE, meta={"topic": topic, "stage": stage, "stats": stats})
 
-    all_insights = []
-    print("Starting throttled, sequential analysis...")
-    for idx, (_, row) in enumerate(combined_df.iterrows(), start=1):
-        title_preview = (row.get('title') or '')[:60]
-        print(f"Analyzing doc {idx}/{len(combined_df)}: {title_preview}...")
-        
-        # Skip very short summaries
-        if len(row['summary'].split()) < 25:
-            print(f"Skipping doc {idx}: Summary too short.")
-            continue
-            
-        insights = get_gemini_analysis(row['summary'])
-        
-        if isinstance(insights, dict) and insights.get("TRL", 0) != 0:
-            merged = row.to_dict()
-            merged.update(insights)
-            all_insights.append(merged)
+    try:
+        if resume_run_id:
+            stats = resume_pipeline_sync(resume_run_id, progress=progress)
         else:
-            print(f"Warning: Analysis failed or was skipped for doc {idx}.")
-        
-        time.sleep(4.1)  # Rate limit
-
-    if all_insights:
-        processed_df = pd.DataFrame(all_insights)
-        if not processed_df.empty:
+            stats = run_pipeline_sync(topic, num_documents=num_documents, progress=progress, run_id=job_id)
+    finally:
+        if job_id is not None:
             try:
-                save_to_db(processed_df)
-                return f"Analysis complete. Saved {len(processed_df)} documents."
+                release_topic(topic, job_id)
             except Exception as e:
-                return f"Analysis complete. Failed to save to DB: {e}"
-    
-    return "Analysis complete. No new documents were saved."
\ No newline at end of file
+                print(f"[Worker] Could not release the job claim for '{topic}': {e}")
+
+    # Vectors embedded since save_to_db's last rate-limited sync become searchable now
+    if stats["saved"]:
+        sync_index(get_db_connection(), force=True)
+
+    print(f"LLM cache stats: {analysis_cache.stats()}")
+    print(f"Gemini rate limiter stats: {gemini_limiter.stats()}")
+
+    if stats["candidates"] == 0:
+        message = "Analysis complete. No high-quality documents found."
+    elif stats["saved"]:
+        message = f"Analysis complete. Saved {stats['saved']} documents."
+    else:
+        message = "Analysis complete. No new documents were saved."
+    return {"topic": topic, "message": message, "stats": stats}